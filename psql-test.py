@@ -4,8 +4,9 @@
 Peewee ORM Database Manager - Separate Functions
 - Create single table
 - Drop table
-- Migrations
-- Add test data
+- Migrations (checksummed, skipped once applied, non-blocking index and constraint DDL)
+- Add test data (bulk loading of generated records via COPY)
+- DDL storm benchmark against a running psql-watcher.py
 
 Requirements:
 pip install peewee psycopg2-binary python-dotenv
@@ -15,15 +16,26 @@ python3 psql-test.py --create-table
 python3 psql-test.py --drop-table
 python3 psql-test.py --migrate
 python3 psql-test.py --add-test-data
+python3 psql-test.py --add-test-data --rows 10000000 --loaders 4 --batch-size 50000
 python3 psql-test.py --show-data
+python3 psql-test.py --benchmark --bench-tables 50 --bench-statements 5000 --bench-rate 200
+python3 psql-test.py --bench-hook --bench-acks bench-acks.ndjson   (as a streaming watcher hook)
 """
 
 import os
 import sys
+import json
+import math
+import time
+import re
+import random
 import argparse
+import functools
+import hashlib
 import logging
-from datetime import datetime
-from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
 # pip install peewee psycopg2-binary python-dotenv
 from dotenv import load_dotenv
@@ -89,6 +101,7 @@ class Migration(BaseModel):
     """Table for tracking migrations"""
     id = AutoField(primary_key=True)
     name = CharField(max_length=255, unique=True)
+    checksum = CharField(max_length=64, null=True)
     applied_at = DateTimeField(default=datetime.now)
     
     class Meta:
@@ -131,49 +144,189 @@ def create_migration_table():
         if DATABASE.is_closed():
             DATABASE.connect()
         DATABASE.create_tables([Migration], safe=True)
+        # Tables created before migrations were checksummed
+        DATABASE.execute_sql("ALTER TABLE migrations ADD COLUMN IF NOT EXISTS checksum varchar(64)")
         logger.info("Migrations table created/verified")
     except Exception as e:
         logger.error(f"Error creating migrations table: {e}")
         raise
 
 # Function 4: Apply migrations
-def apply_migrations():
-    """Applies all migrations"""
+# Migrations in order: (name, statements). Each one is recorded with the checksum of its
+# statements; never edit an applied migration, append a new one. Write plain DDL: the runner
+# builds indexes CONCURRENTLY and adds CHECK/FOREIGN KEY constraints NOT VALID, then validates them.
+MIGRATIONS = [
+    # A constant default is stored in the catalog (PostgreSQL 11+), the table is not rewritten
+    ('add_status_column', [
+        "ALTER TABLE test_table ADD COLUMN IF NOT EXISTS status varchar(50) DEFAULT 'active'",
+        "ALTER TABLE test_table ALTER COLUMN status SET DEFAULT 'active'",
+    ]),
+    ('add_status_index', [
+        "CREATE INDEX test_table_status_idx ON test_table (status)",
+    ]),
+    ('check_status_values', [
+        "ALTER TABLE test_table ADD CONSTRAINT test_table_status_check "
+        "CHECK (status IN ('active', 'pending', 'inactive'))",
+    ]),
+]
+LOCK_NOT_AVAILABLE = '55P03'
+CREATE_INDEX_RE = re.compile(r'CREATE\s+(UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?([\w."]+)\s+ON\s+(.+)',
+                             re.IGNORECASE | re.DOTALL)
+ADD_CONSTRAINT_RE = re.compile(r'ALTER\s+TABLE\s+(?:ONLY\s+)?([\w."]+)\s+ADD\s+CONSTRAINT\s+([\w"]+)\s+'
+                               r'((?:CHECK|FOREIGN\s+KEY)\b.+?)(?:\s+NOT\s+VALID)?',
+                               re.IGNORECASE | re.DOTALL)
+
+def migration_checksum(statements: List[str]) -> str:
+    """sha256 of the statements of a migration, insensitive to whitespace"""
+    text = '\n'.join(' '.join(statement.split()) for statement in statements)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def migration_steps(statement: str) -> List[dict]:
+    """
+    Steps that run statement without blocking the table for long. A step
+    has the 'sql' to run, whether it is 'transactional', whether it needs
+    a transaction of its own ('isolated'), and optionally a 'done' query
+    that finds it already applied and an 'invalid' query plus 'cleanup'
+    for what an interrupted run left behind.
+    """
+    statement = statement.strip().rstrip(';')
+    match = CREATE_INDEX_RE.fullmatch(statement)
+    if match:
+        # Plain CREATE INDEX blocks writes for the whole build; CONCURRENTLY only
+        # runs outside a transaction and leaves an INVALID index when it fails
+        unique, name, rest = match.groups()
+        return [{'sql': f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {rest}",
+                 'transactional': False, 'isolated': True,
+                 'invalid': ("SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid",
+                             (name,)),
+                 'cleanup': f"DROP INDEX CONCURRENTLY IF EXISTS {name}"}]
+    match = ADD_CONSTRAINT_RE.fullmatch(statement)
+    if match:
+        # NOT VALID only takes the ACCESS EXCLUSIVE lock briefly; VALIDATE scans the
+        # table under SHARE UPDATE EXCLUSIVE, which lets reads and writes through
+        table, name, definition = match.groups()
+        done = "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s"
+        return [{'sql': f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition} NOT VALID",
+                 'transactional': True, 'isolated': False, 'done': (done, (table, name.strip('"')))},
+                {'sql': f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}",
+                 'transactional': True, 'isolated': True,
+                 'done': (done + " AND convalidated", (table, name.strip('"')))}]
+    return [{'sql': statement, 'transactional': True, 'isolated': False}]
+
+def migration_units(pending: List[tuple]) -> List[dict]:
+    """
+    Groups the steps of the pending migrations into units that each run in
+    one go: consecutive transactional steps share one transaction, the others
+    run alone. A migration is recorded in the transaction of its last step.
+    """
+    units = []
+    current = None
+    for name, statements, checksum in pending:
+        for statement in statements:
+            for step in migration_steps(statement):
+                if step['isolated']:
+                    units.append({'steps': [step], 'records': [], 'transactional': step['transactional']})
+                    current = None
+                else:
+                    if current is None:
+                        current = {'steps': [], 'records': [], 'transactional': True}
+                        units.append(current)
+                    current['steps'].append(step)
+        if not units or not units[-1]['transactional']:
+            current = {'steps': [], 'records': [], 'transactional': True}
+            units.append(current)
+        units[-1]['records'].append((name, checksum))
+    return units
+
+def sqlstate(error: Exception) -> Optional[str]:
+    """SQLSTATE of a database error, also when peewee wraps the driver's exception"""
+    for e in (error, error.args[0] if error.args else None, error.__context__):
+        code = getattr(e, 'pgcode', None) or getattr(e, 'sqlstate', None)
+        if code:
+            return code
+    return None
+
+def run_step(step: dict):
+    """Runs one migration step, unless it is already done"""
+    if step.get('invalid') and DATABASE.execute_sql(*step['invalid']).fetchone():
+        logger.info(f"Dropping the invalid leftover of an interrupted run: {step['cleanup']}")
+        DATABASE.execute_sql(step['cleanup'])
+    if step.get('done') and DATABASE.execute_sql(*step['done']).fetchone():
+        logger.info(f"Already in place, skipping: {step['sql']}")
+        return
+    DATABASE.execute_sql(step['sql'])
+    logger.info(f"Migration: {step['sql']}")
+
+def run_unit(unit: dict, lock_timeout: int, lock_retries: int):
+    """
+    Runs one unit with lock_timeout (ms), so a statement that waits for a lock
+    gives up instead of queueing every other query on the table behind it;
+    retried up to lock_retries times with exponential backoff
+    """
+    for attempt in range(lock_retries + 1):
+        try:
+            if unit['transactional']:
+                with DATABASE.atomic():
+                    DATABASE.execute_sql(f"SET LOCAL lock_timeout = {int(lock_timeout)}")
+                    for step in unit['steps']:
+                        run_step(step)
+                    for name, checksum in unit['records']:
+                        now = datetime.now()
+                        Migration.insert(name=name, checksum=checksum, applied_at=now).on_conflict(
+                            conflict_target=[Migration.name],
+                            update={Migration.checksum: checksum, Migration.applied_at: now}).execute()
+            else:
+                DATABASE.execute_sql(f"SET lock_timeout = {int(lock_timeout)}")
+                try:
+                    run_step(unit['steps'][0])
+                finally:
+                    DATABASE.execute_sql("RESET lock_timeout")
+            return
+        except DatabaseError as e:
+            if sqlstate(e) != LOCK_NOT_AVAILABLE or attempt == lock_retries:
+                raise
+            delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning(f"Lock timeout ({lock_timeout}ms), retry {attempt + 1}/{lock_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+def apply_migrations(force: bool = False, lock_timeout: int = 2000, lock_retries: int = 5):
+    """
+    Applies the migrations not applied yet; with force all of them. Fails
+    before changing anything when an applied migration has changed since.
+    """
     try:
         if DATABASE.is_closed():
             DATABASE.connect()
         
         # Create migrations table if it doesn't exist
         create_migration_table()
-
-        # Migration 1: FORCE drop status column (if exists)
-        try:
-            # Check if column exists
-            with DATABASE.cursor() as cursor:
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns 
-                    WHERE table_name = 'test_table' AND column_name = 'status'
-                """)
-                if cursor.fetchone():
-                    migrator = PostgresqlMigrator(DATABASE)
-                    migrate(
-                        migrator.drop_column('test_table', 'status')
-                    )
-                    logger.info("Migration: dropped column status")
-                else:
-                    logger.info("Column status does not exist, skipping drop")
-        except Exception as e:
-            logger.warning(f"Error checking/dropping column status: {e}")
         
-        # Migration 2: FORCE create status column
-        try:
-            migrator = PostgresqlMigrator(DATABASE)
-            migrate(
-                migrator.add_column('test_table', 'status', CharField(max_length=50, default='active'))
-            )
-            logger.info("Migration: added column status")
-        except Exception as e:
-            logger.warning(f"Error creating column status: {e}")
+        applied = {m.name: m for m in Migration.select()}
+        pending = []
+        for name, statements in MIGRATIONS:
+            checksum = migration_checksum(statements)
+            record = applied.get(name)
+            if record is None or force:
+                pending.append((name, statements, checksum))
+            elif record.checksum is None:
+                # Recorded before migrations were checksummed
+                Migration.update(checksum=checksum).where(Migration.id == record.id).execute()
+            elif record.checksum != checksum:
+                raise ValueError(f"Migration {name} changed since it was applied "
+                                 f"(checksum {record.checksum[:12]}, now {checksum[:12]}); "
+                                 f"add a new migration instead, or use --force-migrate")
+        
+        if not pending:
+            logger.info(f"No pending migrations ({len(MIGRATIONS)} applied)")
+            return
+        
+        units = migration_units(pending)
+        logger.info(f"Applying {len(pending)} migration(s) in {len(units)} step(s), "
+                    f"{len(MIGRATIONS) - len(pending)} already applied")
+        for unit in units:
+            run_unit(unit, lock_timeout, lock_retries)
+            for name, _ in unit['records']:
+                logger.info(f"Migration {name} applied")
             
     except Exception as e:
         logger.error(f"Error applying migrations: {e}")
@@ -183,8 +336,89 @@ def apply_migrations():
             DATABASE.close()
 
 # Function 5: Add test data
-def add_test_data():
-    """Adds test data to table"""
+TEST_DATA_COLUMNS = ('name', 'email', 'age', 'is_active', 'status', 'created_at', 'updated_at')
+FIRST_NAMES = ('John', 'Maria', 'Alex', 'Elena', 'Dmitry', 'Anna', 'Peter', 'Olga', 'Sergey', 'Irina',
+               'Michael', 'Kate', 'Nikolai', 'Sofia', 'Victor', 'Daria')
+LAST_NAMES = ('Smith', 'Johnson', 'Brown', 'Davis', 'Wilson', 'Miller', 'Taylor', 'Moore', 'Clark', 'Lewis',
+              'Walker', 'Young', 'Allen', 'King', 'Wright', 'Scott')
+# (name, email local part) of every first/last name pair: 256 entries, one random byte picks one
+FULL_NAMES = [(f'{first} {last}', f'{first.lower()}.{last.lower()}') for first in FIRST_NAMES for last in LAST_NAMES]
+STATUSES = ('active', 'pending', 'inactive')
+COPY_CHUNK = 64 * 1024
+
+def generate_rows(start: int, count: int, seed: int, columns=TEST_DATA_COLUMNS):
+    """
+    Yields count synthetic test_table rows (tuples in the order of columns),
+    numbered from start. Each range draws from its own generator seeded with
+    (seed, start), so loaders generate disjoint ranges in parallel. One
+    64-bit draw per row supplies every random field.
+    """
+    bits = random.Random(f'{seed}:{start}').getrandbits
+    now = datetime.now().replace(microsecond=0)
+    positions = [TEST_DATA_COLUMNS.index(c) for c in columns]
+    for n in range(start, start + count):
+        r = bits(64)
+        name, local = FULL_NAMES[r & 255]
+        created = now - timedelta(seconds=(r >> 8) % (365 * 86400))
+        row = (name, f'{local}{n}@example.com', 18 + (r >> 33) % 63, (r >> 40) % 5 != 0,
+               STATUSES[(r >> 44) % 3], created, created + timedelta(seconds=(r >> 46) % (30 * 86400)))
+        yield tuple(row[p] for p in positions)
+
+def copy_value(value) -> str:
+    """Value in COPY text format (generated values never contain tabs, newlines or backslashes)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value)
+
+class CopyStream:
+    """File-like object COPY ... FROM STDIN reads rows from; lines are built only as they are read"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        chunks, length = [self.buffer], len(self.buffer)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = ('\t'.join([copy_value(v) for v in row]) + '\n').encode('utf-8')
+            chunks.append(line)
+            length += len(line)
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+def load_batch(start: int, count: int, columns: tuple, method: str, seed: int) -> int:
+    """
+    Loads rows [start, start + count) of the generated data in one
+    transaction. Runs in a loader process, which keeps its connection open
+    between batches. Returns the number of rows loaded.
+    """
+    if DATABASE.is_closed():
+        DATABASE.connect()
+    rows = generate_rows(start, count, seed, columns)
+    with DATABASE.atomic():
+        if method == 'copy':
+            statement = f"COPY test_table ({', '.join(columns)}) FROM STDIN"
+            DATABASE.cursor().copy_expert(statement, CopyStream(rows), size=COPY_CHUNK)
+        else:
+            TestTable.insert_many(rows, fields=[getattr(TestTable, c) for c in columns]).execute()
+    return count
+
+def add_test_data(rows: int = 0, batch_size: int = 10000, loaders: int = 1, method: str = 'copy',
+                  seed: Optional[int] = None):
+    """
+    Adds test data to table: five sample records, or with rows > 0 that many
+    generated records. They are streamed through COPY FROM STDIN, or batched
+    insert_many with method 'insert' or when the driver has no COPY support,
+    one batch_size transaction at a time by loaders parallel processes.
+    """
     try:
         if DATABASE.is_closed():
             DATABASE.connect()
@@ -194,50 +428,53 @@ def add_test_data():
             logger.error("Table test_table does not exist. Create table first.")
             return
         
-        # Test data
-        test_data = [
-            {
-                'name': 'John Smith',
-                'email': 'ivan@example.com',
-                'age': 25,
-                'phone': '+7-123-456-7890',
-                'status': 'active'
-            },
-            {
-                'name': 'Maria Johnson',
-                'email': 'maria@example.com',
-                'age': 30,
-                'phone': '+7-987-654-3210',
-                'status': 'pending'
-            },
-            {
-                'name': 'Alex Brown',
-                'email': 'alex@example.com',
-                'age': 28,
-                'phone': '+7-555-123-4567',
-                'status': 'inactive'
-            },
-            {
-                'name': 'Elena Davis',
-                'email': 'elena@example.com',
-                'age': 35,
-                'phone': '+7-111-222-3333',
-                'status': 'active'
-            },
-            {
-                'name': 'Dmitry Wilson',
-                'email': 'dmitry@example.com',
-                'age': 42,
-                'phone': '+7-444-555-6666',
-                'status': 'pending'
-            }
-        ]
+        if rows <= 0:
+            # Test data
+            test_data = [
+                {'name': 'John Smith', 'email': 'john@example.com', 'age': 25, 'status': 'active'},
+                {'name': 'Maria Johnson', 'email': 'maria@example.com', 'age': 30, 'status': 'pending'},
+                {'name': 'Alex Brown', 'email': 'alex@example.com', 'age': 28, 'status': 'inactive'},
+                {'name': 'Elena Davis', 'email': 'elena@example.com', 'age': 35, 'status': 'active'},
+                {'name': 'Dmitry Wilson', 'email': 'dmitry@example.com', 'age': 42, 'status': 'pending'},
+            ]
+            
+            # Add data in one statement
+            TestTable.insert_many(test_data).execute()
+            logger.info(f"Added {len(test_data)} test records")
+            return
+        
+        # Load only the columns the table has now (status exists once the add_status_column migration ran)
+        existing = {c.name for c in DATABASE.get_columns('test_table')}
+        columns = tuple(c for c in TEST_DATA_COLUMNS if c in existing)
+        if method == 'copy' and not hasattr(DATABASE.cursor(), 'copy_expert'):
+            logger.warning("Database driver has no COPY support, falling back to batched insert_many")
+            method = 'insert'
+        # Loader processes open their own connections; none is inherited
+        DATABASE.close()
+        
+        seed = seed if seed is not None else int(time.time())
+        batch_size = max(1, batch_size)
+        batches = [(start, min(batch_size, rows - start)) for start in range(0, rows, batch_size)]
+        loaders = max(1, min(loaders, len(batches)))
+        logger.info(f"Loading {rows} generated records with {method} in {len(batches)} batches of {batch_size}, "
+                    f"{loaders} loader(s), seed {seed}")
         
-        # Add data
-        for data in test_data:
-            TestTable.create(**data)
+        loaded, logged = 0, time.monotonic()
+        started = logged
+        with ProcessPoolExecutor(max_workers=loaders) as pool:
+            futures = [pool.submit(load_batch, start, count, columns, method, seed) for start, count in batches]
+            for future in as_completed(futures):
+                loaded += future.result()
+                now = time.monotonic()
+                if now - logged >= 5:
+                    logged = now
+                    logger.info(f"Loaded {loaded}/{rows} records ({loaded / (now - started):.0f} rows/s)")
+        elapsed = time.monotonic() - started
         
-        logger.info(f"Added {len(test_data)} test records")
+        # Fresh statistics, so the planner knows how large the table is now
+        DATABASE.connect()
+        DATABASE.execute_sql('ANALYZE test_table')
+        logger.info(f"Added {loaded} test records in {elapsed:.1f}s ({loaded / max(elapsed, 1e-9):.0f} rows/s)")
         
     except Exception as e:
         logger.error(f"Error adding test data: {e}")
@@ -247,8 +484,8 @@ def add_test_data():
             DATABASE.close()
 
 # Function 6: Show data
-def show_data():
-    """Shows data from table"""
+def show_data(limit: int = 100):
+    """Shows data from table (the first limit records)"""
     try:
         if DATABASE.is_closed():
             DATABASE.connect()
@@ -257,20 +494,20 @@ def show_data():
             logger.error("Table test_table does not exist")
             return
         
-        records = TestTable.select()
+        records = TestTable.select().order_by(TestTable.id)
         count = records.count()
         
         if count == 0:
             logger.info("Table is empty")
             return
         
-        logger.info(f"Found {count} records:")
+        logger.info(f"Found {count} records" + (f", showing the first {limit}:" if count > limit else ":"))
         logger.info("-" * 80)
         
-        for record in records:
-            logger.info(f"ID: {record.id:3d} | Name: {record.name:20s} | Email: {record.email:20s} | "
-                       f"Age: {record.age:2d} | Phone: {getattr(record, 'phone', 'N/A'):15s} | "
-                       f"Status: {getattr(record, 'status', 'N/A'):10s}")
+        for record in records.limit(limit):
+            logger.info(f"ID: {record.id:3d} | Name: {record.name:20s} | Email: {record.email or '':20s} | "
+                       f"Age: {record.age if record.age is not None else '':>2} | "
+                       f"Status: {getattr(record, 'status', None) or 'N/A':10s}")
         
     except Exception as e:
         logger.error(f"Error retrieving data: {e}")
@@ -280,62 +517,13 @@ def show_data():
             DATABASE.close()
 
 # Function 7: Force apply migrations
-def force_apply_migrations():
-    """Force applies all migrations, ignoring already applied ones"""
-    try:
-        if DATABASE.is_closed():
-            DATABASE.connect()
-        
-        # Create migrations table if it doesn't exist
-        create_migration_table()
-        
-        # Remove old migration records
-        Migration.delete().where(Migration.name.in_([
-            'drop_status_column', 'add_status_column'
-        ])).execute()
-        logger.info("Removed old migration records")
-        
-        # Force apply migrations
-        logger.info("Force applying migrations...")
-        
-        # Migration 1: FORCE drop status column (if exists)
-        try:
-            # Check if column exists
-            with DATABASE.cursor() as cursor:
-                cursor.execute("""
-                    SELECT column_name FROM information_schema.columns 
-                    WHERE table_name = 'test_table' AND column_name = 'status'
-                """)
-                if cursor.fetchone():
-                    migrator = PostgresqlMigrator(DATABASE)
-                    migrate(
-                        migrator.drop_column('test_table', 'status')
-                    )
-                    logger.info("Migration: dropped column status")
-                else:
-                    logger.info("Column status does not exist, skipping drop")
-        except Exception as e:
-            logger.warning(f"Error checking/dropping column status: {e}")
-        
-        # Migration 2: FORCE create status column
-        try:
-            migrator = PostgresqlMigrator(DATABASE)
-            migrate(
-                migrator.add_column('test_table', 'status', CharField(max_length=50, default='active'))
-            )
-            logger.info("Migration: added column status")
-        except Exception as e:
-            logger.warning(f"Error creating column status: {e}")
-            
-    except Exception as e:
-        logger.error(f"Error force applying migrations: {e}")
-        raise
-    finally:
-        if not DATABASE.is_closed():
-            DATABASE.close()
+def force_apply_migrations(lock_timeout: int = 2000, lock_retries: int = 5):
+    """Force applies all migrations, ignoring already applied ones and their checksums"""
+    logger.info("Force applying migrations...")
+    apply_migrations(force=True, lock_timeout=lock_timeout, lock_retries=lock_retries)
 
 # Function 8: Reset migrations
-def reset_migrations():
+def reset_migrations(lock_timeout: int = 2000, lock_retries: int = 5):
     """Resets all migrations and reapplies them"""
     try:
         if DATABASE.is_closed():
@@ -350,7 +538,7 @@ def reset_migrations():
         
         # Reapply migrations
         logger.info("Reapplying migrations...")
-        apply_migrations()
+        apply_migrations(lock_timeout=lock_timeout, lock_retries=lock_retries)
             
     except Exception as e:
         logger.error(f"Error resetting migrations: {e}")
@@ -360,7 +548,7 @@ def reset_migrations():
             DATABASE.close()
 
 # Function 9: Full reset
-def full_reset():
+def full_reset(lock_timeout: int = 2000, lock_retries: int = 5):
     """Full reset: drops table, migrations and recreates everything"""
     try:
         if DATABASE.is_closed():
@@ -388,7 +576,7 @@ def full_reset():
         
         # 4. Apply migrations
         logger.info("Applying migrations...")
-        apply_migrations()
+        apply_migrations(lock_timeout=lock_timeout, lock_retries=lock_retries)
         
         logger.info("Full reset completed successfully!")
             
@@ -399,6 +587,219 @@ def full_reset():
         if not DATABASE.is_closed():
             DATABASE.close()
 
+# Function 10: DDL storm benchmark
+@functools.lru_cache(maxsize=None)
+def bench_model(index: int):
+    """Model of benchmark table bench_<index> (the test_table layout)"""
+    class Meta:
+        table_name = f'bench_{index}'
+    return type(f'BenchTable{index}', (TestTable,), {'Meta': Meta})
+
+def bench_hook(acks_path: str):
+    """
+    Streaming hook for psql-watcher.py: reads one event per line on stdin,
+    appends the txids it completed to acks_path and answers 'ok'.
+    """
+    with open(acks_path, 'a', encoding='utf-8') as acks:
+        for line in sys.stdin:
+            try:
+                data = json.loads(line)
+                events = data.get('events', [data]) if data.get('event') == 'BATCH' else [data]
+                txids = sorted({str(e['txid']) for e in events if e.get('txid') is not None})
+                if txids:
+                    acks.write(json.dumps({'txids': txids, 'done': time.time()}) + '\n')
+                    acks.flush()
+            except (ValueError, AttributeError):
+                pass
+            sys.stdout.write('ok\n')
+            sys.stdout.flush()
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def latency_summary(values: List[float]) -> dict:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+def bench_statement(state: dict, index: int, rng: random.Random):
+    """Picks the next DDL for bench_<index> from its state; returns (op, function that runs it)"""
+    model = bench_model(index)
+    table = model._meta.table_name
+    migrator = PostgresqlMigrator(DATABASE)
+    if not state['exists']:
+        def run():
+            DATABASE.create_tables([model])
+            state.update(exists=True, column=False, index=False)
+        return 'create_table', run
+    choices = ['add_column' if not state['column'] else 'drop_column',
+               'create_index' if not state['index'] else 'drop_index',
+               'alter_column', 'drop_table']
+    op = rng.choices(choices, weights=[4, 3, 2, 1])[0]
+    if op == 'add_column':
+        def run():
+            migrate(migrator.add_column(table, 'note', TextField(null=True)))
+            state['column'] = True
+    elif op == 'drop_column':
+        def run():
+            migrate(migrator.drop_column(table, 'note'))
+            state['column'] = False
+    elif op == 'create_index':
+        def run():
+            migrate(migrator.add_index(table, ('status', 'created_at'), False))
+            state['index'] = True
+    elif op == 'drop_index':
+        def run():
+            migrate(migrator.drop_index(table, f'{table}_status_created_at'))
+            state['index'] = False
+    elif op == 'alter_column':
+        def run():
+            migrate(migrator.add_column_default(table, 'status', rng.choice(['active', 'pending', 'inactive'])))
+    else:
+        def run():
+            DATABASE.drop_tables([model], cascade=True)
+            state.update(exists=False)
+    return op, run
+
+def read_acks(path: str, offset: int, done: Dict[str, float]) -> int:
+    """Reads acks appended after offset into done (txid -> last completion time); returns the new offset"""
+    if not os.path.exists(path):
+        return offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # partially written, read again next time
+            offset += len(line)
+            try:
+                ack = json.loads(line)
+            except ValueError:
+                continue
+            for txid in ack.get('txids', []):
+                done[txid] = max(done.get(txid, 0), ack['done'])
+    return offset
+
+def run_benchmark(tables: int = 20, statements: int = 1000, rate: float = 0, cascade_every: int = 100,
+                  acks_path: str = 'bench-acks.ndjson', out_path: str = 'bench-results.json',
+                  wait: float = 60, seed: Optional[int] = None, baseline: Optional[str] = None):
+    """
+    DDL storm against a running psql-watcher.py whose hooks end with
+    bench_hook (see --bench-hook). Every statement runs in its own
+    transaction that records txid_current(); latency is from COMMIT to the
+    acknowledgement of that txid by the hook. rate is statements per second,
+    0 runs them back to back; every cascade_every statements all existing
+    bench tables are dropped in one DROP TABLE ... CASCADE.
+    """
+    rng = random.Random(seed)
+    states = [{'exists': False, 'column': False, 'index': False} for _ in range(tables)]
+    committed: Dict[str, Tuple[str, float]] = {}
+    errors: Dict[str, int] = {}
+    acks_offset = os.path.getsize(acks_path) if os.path.exists(acks_path) else 0
+    try:
+        if DATABASE.is_closed():
+            DATABASE.connect()
+        with DATABASE.atomic():
+            DATABASE.drop_tables([bench_model(i) for i in range(tables)], safe=True, cascade=True)
+
+        logger.info(f"Benchmark: {statements} statements on {tables} tables, "
+                    f"rate {rate or 'unlimited'}/s, cascade drop every {cascade_every or 'never'}")
+        started = time.time()
+        for n in range(statements):
+            if rate > 0:
+                delay = started + n / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            existing = [i for i, s in enumerate(states) if s['exists']]
+            if cascade_every and n and n % cascade_every == 0 and existing:
+                op = 'cascade_drop'
+                models = [bench_model(i) for i in existing]
+
+                def run():
+                    DATABASE.execute_sql('DROP TABLE {} CASCADE'.format(
+                        ', '.join(DATABASE.quote(m._meta.table_name) for m in models)))
+                    for i in existing:
+                        states[i]['exists'] = False
+            else:
+                index = rng.randrange(tables)
+                op, run = bench_statement(states[index], index, rng)
+            try:
+                with DATABASE.atomic():
+                    txid = str(DATABASE.execute_sql('SELECT txid_current()').fetchone()[0])
+                    run()
+                committed[txid] = (op, time.time())
+            except Exception as e:
+                errors[op] = errors.get(op, 0) + 1
+                logger.warning(f"Benchmark: {op} failed: {e}")
+        storm_seconds = time.time() - started
+        logger.info(f"Benchmark: {len(committed)} statements committed in {storm_seconds:.2f}s, "
+                    f"waiting up to {wait}s for hooks...")
+
+        done: Dict[str, float] = {}
+        deadline = time.time() + wait
+        while True:
+            acks_offset = read_acks(acks_path, acks_offset, done)
+            if all(txid in done for txid in committed) or time.time() >= deadline:
+                break
+            time.sleep(0.2)
+    except Exception as e:
+        logger.error(f"Error running benchmark: {e}")
+        raise
+    finally:
+        if not DATABASE.is_closed():
+            DATABASE.close()
+
+    latencies = [done[txid] - ts for txid, (op, ts) in committed.items() if txid in done]
+    by_op: Dict[str, List[float]] = {}
+    for txid, (op, ts) in committed.items():
+        if txid in done:
+            by_op.setdefault(op, []).append(done[txid] - ts)
+    finished = max((done[txid] for txid in committed if txid in done), default=started)
+    results = {
+        'started': datetime.fromtimestamp(started).isoformat(),
+        'config': {'tables': tables, 'statements': statements, 'rate': rate,
+                   'cascade_every': cascade_every, 'seed': seed},
+        'committed': len(committed),
+        'errors': errors,
+        'acknowledged': len(latencies),
+        'missing': len(committed) - len(latencies),
+        'ddl_per_second': len(committed) / storm_seconds if storm_seconds else None,
+        'end_to_end_per_second': len(latencies) / (finished - started) if finished > started else None,
+        'latency_seconds': latency_summary(latencies),
+        'by_op': {op: latency_summary(values) for op, values in sorted(by_op.items())},
+    }
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    lat = results['latency_seconds']
+    logger.info(f"Benchmark: {results['acknowledged']}/{results['committed']} acknowledged, "
+                f"{results['end_to_end_per_second'] or 0:.1f} statements/s end to end, "
+                f"p50 {lat['p50'] or 0:.4f}s p99 {lat['p99'] or 0:.4f}s -> {out_path}")
+    if results['missing']:
+        logger.warning(f"Benchmark: {results['missing']} statements were not acknowledged "
+                       f"(is bench_hook the last hook of the watcher?)")
+    if baseline:
+        compare_results(baseline, results)
+    return results
+
+def compare_results(baseline_path: str, results: dict):
+    """Logs the change of throughput and latency percentiles against an earlier results file"""
+    with open(baseline_path, encoding='utf-8') as f:
+        base = json.load(f)
+    metrics = [('end_to_end_per_second', base.get('end_to_end_per_second'), results['end_to_end_per_second'])]
+    for pct in ('p50', 'p95', 'p99'):
+        metrics.append((f'latency {pct}', base.get('latency_seconds', {}).get(pct),
+                        results['latency_seconds'][pct]))
+    for name, old, new in metrics:
+        if old and new is not None:
+            logger.info(f"Compared to {baseline_path}: {name} {old:.4f} -> {new:.4f} ({(new - old) / old:+.1%})")
+
 def main():
     """Main function"""
     parser = argparse.ArgumentParser(description='Peewee ORM Database Manager - Separate Functions')
@@ -410,19 +811,66 @@ def main():
     main_group.add_argument('--drop-table', action='store_true',
                           help='Drop test table')
     main_group.add_argument('--migrate', action='store_true',
-                          help='Apply migrations')
+                          help='Apply pending migrations')
     main_group.add_argument('--force-migrate', action='store_true',
-                          help='Force apply migrations (ignore already applied)')
+                          help='Force apply migrations (ignore already applied and their checksums)')
     main_group.add_argument('--reset-migrations', action='store_true',
                           help='Reset all migrations and reapply')
     main_group.add_argument('--full-reset', action='store_true',
                           help='Full reset: drop table, migrations and recreate')
     main_group.add_argument('--add-test-data', action='store_true',
-                          help='Add test data')
+                          help='Add test data (five sample records, or --rows generated ones)')
     main_group.add_argument('--show-data', action='store_true',
                           help='Show data from table')
-    
+    main_group.add_argument('--benchmark', action='store_true',
+                          help='Run a DDL storm and measure commit-to-hook latency of psql-watcher.py')
+    main_group.add_argument('--bench-hook', action='store_true',
+                          help='Acknowledge events as a streaming psql-watcher.py hook (used by --benchmark)')
+
+    # Migration options
+    migration_group = parser.add_argument_group('migration options')
+    migration_group.add_argument('--lock-timeout', type=int, default=2000,
+                                 help='lock_timeout for migration statements, ms (default: 2000)')
+    migration_group.add_argument('--lock-retries', type=int, default=5,
+                                 help='Retries of a migration step that hit the lock timeout (default: 5)')
+
+    # Test data options
+    data_group = parser.add_argument_group('test data options')
+    data_group.add_argument('--rows', type=int, default=0,
+                            help='Number of generated records for --add-test-data, 0 for the five samples (default: 0)')
+    data_group.add_argument('--batch-size', type=int, default=10000,
+                            help='Records per transaction (default: 10000)')
+    data_group.add_argument('--loaders', type=int, default=1,
+                            help='Parallel loader processes, each with its own connection (default: 1)')
+    data_group.add_argument('--load-method', choices=['copy', 'insert'], default='copy',
+                            help='COPY FROM STDIN or batched INSERT ... VALUES (default: copy)')
+    data_group.add_argument('--data-seed', type=int, help='Random seed for the generated records')
+
+    # Benchmark options
+    bench_group = parser.add_argument_group('benchmark options')
+    bench_group.add_argument('--bench-tables', type=int, default=20,
+                             help='Number of bench_<n> tables (default: 20)')
+    bench_group.add_argument('--bench-statements', type=int, default=1000,
+                             help='Number of DDL statements to run (default: 1000)')
+    bench_group.add_argument('--bench-rate', type=float, default=0,
+                             help='Statements per second, 0 for as fast as possible (default: 0)')
+    bench_group.add_argument('--bench-cascade-every', type=int, default=100,
+                             help='Drop all bench tables with one CASCADE every N statements, 0 never (default: 100)')
+    bench_group.add_argument('--bench-acks', default='bench-acks.ndjson',
+                             help='File the bench hook appends acknowledgements to (default: bench-acks.ndjson)')
+    bench_group.add_argument('--bench-results', default='bench-results.json',
+                             help='File to write benchmark results to (default: bench-results.json)')
+    bench_group.add_argument('--bench-wait', type=float, default=60,
+                             help='Seconds to wait for outstanding acknowledgements (default: 60)')
+    bench_group.add_argument('--bench-seed', type=int, help='Random seed for the statement mix')
+    bench_group.add_argument('--bench-baseline', help='Earlier results file to compare against')
+
     args = parser.parse_args()
+
+    if args.bench_hook:
+        # stdout belongs to the watcher protocol: no connection, no log output there
+        bench_hook(args.bench_acks)
+        return
     
     try:
         logger.info(f"Connecting to database: {DATABASE_CONFIG['database']}")
@@ -433,17 +881,21 @@ def main():
         elif args.drop_table:
             drop_table()
         elif args.migrate:
-            apply_migrations()
+            apply_migrations(lock_timeout=args.lock_timeout, lock_retries=args.lock_retries)
         elif args.force_migrate:
-            force_apply_migrations()
+            force_apply_migrations(args.lock_timeout, args.lock_retries)
         elif args.reset_migrations:
-            reset_migrations()
+            reset_migrations(args.lock_timeout, args.lock_retries)
         elif args.full_reset:
-            full_reset()
+            full_reset(args.lock_timeout, args.lock_retries)
         elif args.add_test_data:
-            add_test_data()
+            add_test_data(args.rows, args.batch_size, args.loaders, args.load_method, args.data_seed)
         elif args.show_data:
             show_data()
+        elif args.benchmark:
+            run_benchmark(args.bench_tables, args.bench_statements, args.bench_rate, args.bench_cascade_every,
+                          args.bench_acks, args.bench_results, args.bench_wait, args.bench_seed,
+                          args.bench_baseline)
         
     except Exception as e:
         logger.error(f"Error executing operation: {e}")
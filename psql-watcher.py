@@ -4,9 +4,49 @@
 """
 ONE-FILE PostgreSQL schema watcher:
 - Loads .env (PG_HOST, PG_PORT, PG_USER, PG_PASSWORD, optional PG_SSLMODE)
-- Args: --db (required), --schemas (default: public), --channel (default: ddl_changes), --no-ping
-- Installs event triggers & functions scoped to given schemas
-- LISTEN for NOTIFYs and calls run_user_hook(payload)
+- Args: --db / --dsn (repeatable) or --config (JSON list of targets), --schemas (default: public),
+  --channel (default: ddl_changes), --no-ping, --events / --object-types (default: all)
+- Watches many databases from one process: one selector multiplexes all LISTEN connections,
+  every event is tagged with its 'source' target
+- Installs event triggers & functions scoped to given schemas, command tags and object types;
+  each DDL statement sends one NOTIFY that the watcher unpacks into per-object events
+- Every statement is also written to a watcher-owned, size-bounded event log table with a
+  sequence number: payloads over the NOTIFY size limit are read from it (their query text
+  only if a hook asks for it), and a lost LISTEN connection is re-opened and catches up on
+  missed events with one query
+- Connections use TCP keepalives, idle LISTEN connections are probed (--probe-interval) and
+  lost ones reconnect with jittered backoff, reusing the installed triggers
+- Optionally writes schema.sql in-process from the catalogs after each hook run (--snapshot)
+  or keeps a content-addressed snapshot history with one version per change, re-reading only
+  changed objects (--snapshot-dir)
+- Optionally keeps the shape of every relation in memory and attaches one structured diff
+  (columns, defaults, constraints, indexes) of the affected relation to each event (--diff)
+- LISTEN for NOTIFYs and hands them to a worker pool that calls run_hook(payload)
+- run_hook routes every event through a hook registry loaded once at startup (--hooks file,
+  'psql_watcher.hooks' entry points, or script.py / script.sh) and indexed by its match predicates;
+  command hooks can run as long-lived co-processes fed NDJSON on stdin ("stream": true)
+  (--workers, --pool); events of one object keep their order
+- Between LISTEN and the workers, one bounded queue (--queue-size) with priority lanes: sql_drop
+  events first, bulk ones (--bulk-tags) last; when full, low-value events (--low-value) are
+  coalesced or dropped and the rest spill to disk (--spill-dir) or pause LISTEN intake
+- Every notification is decoded once into a read-only, typed DDLEvent shared by all hooks
+  (orjson is used when installed); typed hooks get the event object instead of the JSON string
+- Optionally coalesces bursts of events (--debounce) so hooks run once per batch
+- Optionally journals every event to disk before its hooks run (--journal) and replays events
+  whose hooks did not complete, on the next start or on demand (--replay-from); failing hooks
+  are retried (--journal-retries), then the event is recorded for --replay-from failed
+- --engine asyncio consumes notifications on an asyncio event loop; script.py may then define
+  `async def main(payload)`, awaited concurrently (--concurrency), sync hooks run via an adapter
+- Optionally serves Prometheus metrics (--metrics-port): events received, notification lag,
+  queue depth, hook durations, timeouts, failures and exit codes, reconnects
+- Without a database, --source feeds hooks a recorded NDJSON file or synthetic notifications
+  through the same dispatch path, at --source-rate or as fast as possible, and reports hook
+  throughput and latency
+- With --shared, watchers of the same settings share one content-hashed trigger set, reference
+  counted in a table: startup is a catalog lookup when that version is installed already
+- --cluster runs replicas of one watcher on a shared trigger set: a leader elected through
+  pg_try_advisory_lock runs the hooks (or partitions of them, by schema or object hash), a
+  standby takes over within --cluster-interval seconds and catches up from the event log
 - On Ctrl+C/SIGTERM removes ONLY the objects it created and exits
 
 Requires superuser to create event triggers.
@@ -27,17 +67,43 @@ python3 psql-watcher.py --db mydb
 import os
 import sys
 import json
+import asyncio
+import functools
+import hashlib
+import time
 import uuid
+import random
+import zlib
+import queue
+import shlex
 import signal
-import select
+import selectors
 import argparse
+import importlib
+import itertools
+import subprocess
 import logging
-from typing import List
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 # pip install python-dotenv psycopg2-binary
 from dotenv import load_dotenv
 import psycopg2
 import psycopg2.extensions
 from psycopg2 import sql
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # Python 3.7
+    entry_points = None
+try:
+    import orjson  # optional, faster JSON for the event path
+except ImportError:
+    orjson = None
+
+import schema_snapshot
 
 LOGGING = {
     'format': '%(asctime)s.%(msecs)03d [%(levelname)s]: (%(name)s.%(funcName)s) %(message)s',
@@ -65,70 +131,201 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASS = os.getenv("POSTGRES_PASSWORD", "password")
 
 STOP_FLAG = False
+# Set by the asyncio engine: `async def` hooks are awaited there, not in run_hook
+ASYNC_HOOKS = False
+
+# NOTIFY payloads must be shorter than this many bytes
+NOTIFY_PAYLOAD_LIMIT = 8000
+# Rows kept in the event log table (--event-log-size); older ones are pruned
+EVENT_LOG_SIZE = 10000
+# libpq TCP keepalives for every connection: a dead peer is noticed after ~11s
+KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 5,
+    "keepalives_interval": 2,
+    "keepalives_count": 3,
+    "connect_timeout": 10,
+}
+# Reconnect delay: doubles per failed attempt from the first value up to the second, with jitter
+RECONNECT_BACKOFF = (0.5, 30.0)
+# Catch-up re-reads this many sequence numbers below the last one seen: concurrent
+# DDL transactions may commit (and notify) out of sequence order
+CATCHUP_OVERLAP = 100
+
+# Watched databases by name (Target.name is the 'source' of their events)
+TARGETS = {}
+
+# Hooks run by run_hook (HookRegistry), loaded once in main()
+HOOKS = None
+HOOK_ENTRY_POINTS = "psql_watcher.hooks"
+
+# --snapshot: schema.sql written in-process after every hook run
+# --snapshot-dir: per-object stores (one per target) refreshed for the objects of every event
+SNAPSHOT_PATH = None
+SNAPSHOT_STORES = {}
+SNAPSHOT_LOCK = threading.Lock()
+# --diff: schema_snapshot.RelationCache per target name, refreshed one event at a time
+RELATION_CACHES = {}
+RELATION_LOCK = threading.Lock()
+# Fills in the query text of a parked statement, which the events of the statement share across workers
+QUERY_LOCK = threading.Lock()
+
+# --journal: on-disk log of received events (EventJournal)
+JOURNAL = None
 
 # language=TEXT
 # noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
 INSTALL_SQL = """
+-- Sequenced log of every notified statement: read by the watcher for payloads too
+-- large for NOTIFY and to catch up after a lost LISTEN connection
+CREATE TABLE IF NOT EXISTS {event_log} (
+  id         bigserial PRIMARY KEY,
+  payload    text NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
 CREATE OR REPLACE FUNCTION {fn_changes}()
 RETURNS event_trigger AS $$
 DECLARE
-  rec record;
-  payload text;
+  objects  json;
+  payload  text;
+  -- Always UTC (see SET timezone below), so the watcher can measure notification lag
+  fired_at text := to_char(clock_timestamp(), 'YYYY-MM-DD\"T\"HH24:MI:SS.MS TZ');
+  notice   text;
+  seq      bigint;
 BEGIN
-  -- Log ALL events without filtering
-  FOR rec IN SELECT * FROM pg_event_trigger_ddl_commands() LOOP
-    payload := json_build_object(
-      'event',       TG_TAG,
-      'schema',      COALESCE(rec.schema_name, 'unknown'),
-      'object',      COALESCE(rec.object_identity, 'unknown'),
-      'object_type', COALESCE(rec.object_type, 'unknown'),
-      'command_tag', TG_TAG,
-      'username',    session_user,
-      'txid',        txid_current(),
-      'ts',          to_char(clock_timestamp(), 'YYYY-MM-DD\"T\"HH24:MI:SS.MS TZ'),
-      'query',       current_query(),
-      'classid',     COALESCE(rec.classid::text, 'unknown'),
-      'objid',       COALESCE(rec.objid::text, 'unknown')
+  -- One NOTIFY per statement: every affected object goes into a single payload,
+  -- statement-level fields are sent once
+  SELECT json_agg(json_build_object(
+           'schema',      COALESCE(rec.schema_name, 'unknown'),
+           'object',      COALESCE(rec.object_identity, 'unknown'),
+           'object_type', COALESCE(rec.object_type, 'unknown'),
+           'classid',     rec.classid,
+           'objid',       rec.objid
+         ))
+    INTO objects
+    FROM pg_event_trigger_ddl_commands() AS rec,
+         LATERAL (SELECT COALESCE(rec.schema_name,
+                                  CASE WHEN rec.object_type = 'schema' THEN rec.object_identity END) AS name) AS sch
+   -- Only watched schemas (pg_temp churn included); objects without a schema pass
+   WHERE ({schema_array} IS NULL OR sch.name IS NULL OR sch.name = ANY ({schema_array}))
+     -- Only requested object types
+     AND ({object_types} IS NULL OR rec.object_type = ANY ({object_types}));
+
+  IF objects IS NULL THEN
+    RETURN;
+  END IF;
+
+  payload := json_build_object(
+    'event',       TG_TAG,
+    'command_tag', TG_TAG,
+    'trigger',     TG_EVENT,
+    'username',    session_user,
+    'txid',        txid_current(),
+    'ts',          fired_at,
+    'query',       current_query(),
+    'objects',     objects
+  )::text;
+
+  -- Log the statement first; its sequence number goes out with the NOTIFY
+  INSERT INTO {event_log} (payload) VALUES (payload) RETURNING id INTO seq;
+  notice := '{{"seq" : ' || seq || ', ' || substr(payload, 2);
+
+  -- NOTIFY payloads must stay below {payload_limit} bytes (a bigger one would make the
+  -- DDL itself fail): send a compact reference to the logged payload instead,
+  -- dropping the query text first and the object list only if still too big
+  IF octet_length(notice) >= {payload_limit} THEN
+    notice := json_build_object(
+      'seq', seq, 'event', TG_TAG, 'command_tag', TG_TAG, 'trigger', TG_EVENT,
+      'username', session_user, 'txid', txid_current(), 'ts', fired_at, 'query_ref', seq, 'objects', objects
     )::text;
-    
-    -- Send notification for ALL events
-    PERFORM pg_notify({channel}, payload);
-  END LOOP;
+    IF octet_length(notice) >= {payload_limit} THEN
+      notice := json_build_object(
+        'seq', seq, 'event', TG_TAG, 'command_tag', TG_TAG, 'trigger', TG_EVENT,
+        'username', session_user, 'txid', txid_current(), 'ts', fired_at, 'overflow', seq
+      )::text;
+    END IF;
+  END IF;
+
+  PERFORM pg_notify({channel}, notice);
 END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, pg_temp SET timezone = 'UTC';
 
 CREATE OR REPLACE FUNCTION {fn_drops}()
 RETURNS event_trigger AS $$
 DECLARE
-  rec record;
-  payload text;
+  objects  json;
+  payload  text;
+  -- Always UTC (see SET timezone below), so the watcher can measure notification lag
+  fired_at text := to_char(clock_timestamp(), 'YYYY-MM-DD\"T\"HH24:MI:SS.MS TZ');
+  notice   text;
+  seq      bigint;
 BEGIN
-  -- Log ALL DROP events without filtering
-  FOR rec IN SELECT * FROM pg_event_trigger_dropped_objects() LOOP
-    payload := json_build_object(
-      'event',       TG_TAG,
-      'schema',      COALESCE(rec.schema_name, 'unknown'),
-      'object',      COALESCE(rec.object_identity, 'unknown'),
-      'object_type', COALESCE(rec.object_type, 'unknown'),
-      'command_tag', TG_TAG,
-      'username',    session_user,
-      'txid',        txid_current(),
-      'ts',          to_char(clock_timestamp(), 'YYYY-MM-DD\"T\"HH24:MI:SS.MS TZ'),
-      'query',       current_query()
+  -- One NOTIFY per statement: every affected object goes into a single payload,
+  -- statement-level fields are sent once
+  SELECT json_agg(json_build_object(
+           'schema',      COALESCE(rec.schema_name, 'unknown'),
+           'object',      COALESCE(rec.object_identity, 'unknown'),
+           'object_type', COALESCE(rec.object_type, 'unknown'),
+           'classid',     rec.classid,
+           'objid',       rec.objid
+         ))
+    INTO objects
+    FROM pg_event_trigger_dropped_objects() AS rec,
+         LATERAL (SELECT COALESCE(rec.schema_name,
+                                  CASE WHEN rec.object_type = 'schema' THEN rec.object_identity END) AS name) AS sch
+   -- Only watched schemas (pg_temp churn included); objects without a schema pass
+   WHERE ({schema_array} IS NULL OR sch.name IS NULL OR sch.name = ANY ({schema_array}))
+     -- Only requested object types
+     AND ({object_types} IS NULL OR rec.object_type = ANY ({object_types}));
+
+  IF objects IS NULL THEN
+    RETURN;
+  END IF;
+
+  payload := json_build_object(
+    'event',       TG_TAG,
+    'command_tag', TG_TAG,
+    'trigger',     TG_EVENT,
+    'username',    session_user,
+    'txid',        txid_current(),
+    'ts',          fired_at,
+    'query',       current_query(),
+    'objects',     objects
+  )::text;
+
+  -- Log the statement first; its sequence number goes out with the NOTIFY
+  INSERT INTO {event_log} (payload) VALUES (payload) RETURNING id INTO seq;
+  notice := '{{"seq" : ' || seq || ', ' || substr(payload, 2);
+
+  -- NOTIFY payloads must stay below {payload_limit} bytes (a bigger one would make the
+  -- DDL itself fail): send a compact reference to the logged payload instead,
+  -- dropping the query text first and the object list only if still too big
+  IF octet_length(notice) >= {payload_limit} THEN
+    notice := json_build_object(
+      'seq', seq, 'event', TG_TAG, 'command_tag', TG_TAG, 'trigger', TG_EVENT,
+      'username', session_user, 'txid', txid_current(), 'ts', fired_at, 'query_ref', seq, 'objects', objects
     )::text;
-    
-    -- Send notification for ALL DROP events
-    PERFORM pg_notify({channel}, payload);
-  END LOOP;
+    IF octet_length(notice) >= {payload_limit} THEN
+      notice := json_build_object(
+        'seq', seq, 'event', TG_TAG, 'command_tag', TG_TAG, 'trigger', TG_EVENT,
+        'username', session_user, 'txid', txid_current(), 'ts', fired_at, 'overflow', seq
+      )::text;
+    END IF;
+  END IF;
+
+  PERFORM pg_notify({channel}, notice);
 END;
-$$ LANGUAGE plpgsql;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = pg_catalog, pg_temp SET timezone = 'UTC';
 
 CREATE EVENT TRIGGER {trg_ddl}
   ON ddl_command_end
+  {when_tags}
   EXECUTE FUNCTION {fn_changes}();
 
 CREATE EVENT TRIGGER {trg_drop}
   ON sql_drop
+  {when_tags}
   EXECUTE FUNCTION {fn_drops}();
 """
 
@@ -137,76 +334,1848 @@ DROP EVENT TRIGGER IF EXISTS {trg_ddl};
 DROP EVENT TRIGGER IF EXISTS {trg_drop};
 DROP FUNCTION IF EXISTS {fn_changes}();
 DROP FUNCTION IF EXISTS {fn_drops}();
+DROP TABLE IF EXISTS {event_log};
+"""
+
+# --shared: watchers with the same trigger settings share one versioned trigger set; each
+# running watcher holds a row here (pid: its LISTEN backend; cluster: a --cluster replica)
+# and the last one drops the set
+SHARED_REFS_TABLE = "schema_watch_refs"
+SHARED_LOCK = "psql-watcher:shared-triggers"
+
+# language=TEXT
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+REFS_SQL = """
+CREATE TABLE IF NOT EXISTS {refs} (
+  watcher    text PRIMARY KEY,
+  version    text NOT NULL,
+  names      text NOT NULL,
+  pid        integer,
+  started_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER TABLE {refs} ADD COLUMN IF NOT EXISTS cluster boolean NOT NULL DEFAULT false;
+"""
+
+# References of watchers that are gone: their LISTEN backend ended, or it never
+# registered within a minute of installing (crashed during startup)
+STALE_REFS_SQL = """
+DELETE FROM {refs}
+ WHERE CASE WHEN pid IS NULL THEN started_at < now() - interval '1 minute'
+            ELSE pid NOT IN (SELECT pid FROM pg_stat_activity) END
+RETURNING version, names
+"""
+
+# --cluster: replicas of a shared set split its events into partitions, each held by one
+# replica through a session advisory lock; a partition's row records the sequence number
+# up to which its holder completed the hooks, where the next holder catches up from
+PROGRESS_TABLE = "schema_watch_progress"
+
+# language=TEXT
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+PROGRESS_SQL = """
+CREATE TABLE IF NOT EXISTS {progress} (
+  lock_key   bigint PRIMARY KEY,
+  version    text NOT NULL,
+  seq        bigint NOT NULL DEFAULT 0,
+  watcher    text,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
 """
 
-def run_hook(payload: str) -> None:
+class Metrics:
     """
-    Called for every DDL event. 'payload' is a JSON string.
-    Edit this to run your custom logic.
+    Counters, histograms and callback gauges of the watcher, rendered in the
+    Prometheus text format by the --metrics-port endpoint. Recording is
+    cheap and thread-safe, so it is always on.
     """
-    logging.info("[HOOK TRIGGERED] DDL Event detected!")
-    logging.info(f"[PAYLOAD] {payload}")
-    logging.info("-" * 50)
-    
-    # Try to import and run script.py
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, list]] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self.meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            buckets = series.get(key)
+            if buckets is None:
+                buckets = series[key] = [0] * len(self.BUCKETS) + [0, 0.0]  # ..., count, sum
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            buckets[-2] += 1
+            buckets[-1] += value
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        self.gauges[name] = read
+
+    @staticmethod
+    def _labels(key: tuple, extra: tuple = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+
+        def header(name, default_kind):
+            kind, help_text = self.meta.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                header(name, "counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{self._labels(key)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for key, buckets in sorted(series.items()):
+                    for bound, count in zip(self.BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{self._labels(key, (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(key, (('le', '+Inf'),))} {buckets[-2]}")
+                    lines.append(f"{name}_sum{self._labels(key)} {buckets[-1]:g}")
+                    lines.append(f"{name}_count{self._labels(key)} {buckets[-2]}")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception:
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+METRICS.describe("psql_watcher_events_received_total", "counter",
+                 "DDL events received (one per affected object), by source, channel, event and schema")
+METRICS.describe("psql_watcher_notification_lag_seconds", "histogram",
+                 "Time from the trigger firing (payload 'ts') to the watcher receiving the statement")
+METRICS.describe("psql_watcher_queue_depth", "gauge", "Events queued for hooks")
+METRICS.describe("psql_watcher_events_spilled", "gauge", "Events of the intake queue spilled to disk")
+METRICS.describe("psql_watcher_events_shed_total", "counter",
+                 "Low-value events dropped or coalesced while the intake queue was full, by policy")
+METRICS.describe("psql_watcher_hook_duration_seconds", "histogram", "Hook run time, by hook")
+METRICS.describe("psql_watcher_hook_timeouts_total", "counter", "Hook runs that hit their timeout, by hook")
+METRICS.describe("psql_watcher_hook_failures_total", "counter", "Hook runs that raised or reported a failure, by hook")
+METRICS.describe("psql_watcher_hook_exit_codes_total", "counter", "Exit codes of command hooks, by hook and code")
+METRICS.describe("psql_watcher_reconnects_total", "counter", "LISTEN reconnect attempts, by source and result")
+
+def serve_metrics(host: str, port: int) -> ThreadingHTTPServer:
+    """Serves METRICS on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+def parse_ts(ts) -> Optional[datetime]:
+    """A payload 'ts' ('YYYY-MM-DDTHH:MI:SS.MS UTC' as the triggers send it) as an aware datetime, or None."""
+    stamp, _, zone = str(ts).partition(" ")
+    if zone not in ("UTC", "GMT"):
+        return None
+    try:
+        return datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def event_time(ts) -> Optional[float]:
+    """Epoch seconds of a payload 'ts', or None."""
+    parsed = parse_ts(ts)
+    return parsed.timestamp() if parsed is not None else None
+
+def target_path(path: str, source: str) -> str:
+    """
+    Per-target variant of a --snapshot / --snapshot-dir path: '{source}' in the
+    path is replaced, otherwise the target name is appended when watching
+    more than one database (schema.sql -> schema.<source>.sql).
+    """
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in source)
+    if "{source}" in path:
+        return path.replace("{source}", safe)
+    if len(TARGETS) <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{safe}{ext}"
+
+def snapshot_hook(target) -> None:
+    """
+    Rewrites the target's snapshot file from the system catalogs over a single
+    connection, the in-process equivalent of script.sh without its pg_dump
+    passes. Snapshots are serialized: concurrent workers never write at once.
+    """
+    path = target_path(SNAPSHOT_PATH, target.name)
+    with SNAPSHOT_LOCK:
+        started = time.monotonic()
+        conn = target.connect()
+        try:
+            count = schema_snapshot.write_snapshot(conn, path)
+        finally:
+            conn.close()
+    logging.info(f"[HOOK] Snapshot {path}: {count} objects in {time.monotonic() - started:.2f}s")
+
+def event_keys(payload) -> Set[Tuple[int, int]]:
+    """(classid, objid) of every object in an event (DDLEvent) or batch payload."""
+    if isinstance(payload, DDLEvent):
+        return {(payload.classid, payload.objid)} if payload.classid is not None and payload.objid is not None else set()
+    try:
+        data = json_loads(payload)
+    except ValueError:
+        return set()
+    if not isinstance(data, dict):
+        return set()
+    keys = set()
+    for event in data.get("events", [data]):
+        try:
+            keys.add((int(event["classid"]), int(event["objid"])))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return keys
+
+def event_stamp(payload) -> Tuple[Optional[int], Optional[datetime]]:
+    """(txid, ts) of an event (DDLEvent) or of the latest event of a batch payload."""
+    if isinstance(payload, DDLEvent):
+        return payload.txid, payload.ts
+    return schema_snapshot.event_stamp(str(payload))
+
+def store_hook(target, payload) -> None:
+    """
+    Refreshes only the event's objects and their direct dependents in the
+    target's store; a change becomes a store version linked to the event.
+    """
+    store = SNAPSHOT_STORES[target.name]
+    keys = event_keys(payload)
+    if not keys:
+        return
+    txid, ts = event_stamp(payload)
+    with SNAPSHOT_LOCK:
+        started = time.monotonic()
+        conn = target.connect()
+        try:
+            changed = store.refresh(conn, keys, txid, ts)
+        finally:
+            conn.close()
+    logging.info(f"[HOOK] Snapshot store {store.path}: {len(keys)} objects re-read, "
+                 f"{changed} objects changed (version {store.version}) in {time.monotonic() - started:.2f}s")
+
+def attach_diffs(target, payloads: list) -> list:
+    """
+    Re-reads only the relations the events touched into the target's
+    relation cache and attaches their structured diff as DDLEvent.diff
+    ("diff" in its JSON). Runs in the intake path, before the events are
+    journaled and handed to workers, one statement at a time in arrival
+    order, so a diff never depends on when a worker gets to its event.
+    A failed read is logged and leaves the events without a diff, as a
+    failed fetch of a parked payload does (see EventLog.expand).
+    """
+    cache = RELATION_CACHES.get(target.name)
+    if cache is None:
+        return payloads
+    statements = []  # events grouped by the statement they share, in order
+    for payload in payloads:
+        if isinstance(payload, DDLEvent) and event_keys(payload):
+            if statements and statements[-1][0]._statement is payload._statement:
+                statements[-1].append(payload)
+            else:
+                statements.append([payload])
+    if not statements:
+        return payloads
+    started = time.monotonic()
+    changed = 0
+    with RELATION_LOCK:
+        for events in statements:
+            keys = set().union(*(event_keys(event) for event in events))
+            if target.catalog_conn is None or target.catalog_conn.closed:
+                target.catalog_conn = target.connect()
+            try:
+                diffs = cache.refresh(target.catalog_conn, keys)
+            except psycopg2.Error as e:
+                logging.error(f"[DIFF] Relation diff for {target.name} failed: {e}")
+                METRICS.inc("psql_watcher_hook_failures_total", hook="diff")
+                target.catalog_conn.close()
+                target.catalog_conn = None
+                continue
+            changed += len(diffs)
+            for event in events:
+                oid = event.objid if event.objid in diffs else cache.owners.get(event.objid)
+                if oid in diffs:
+                    event.attach_diff(diffs[oid])
+    logging.info(f"[DIFF] Relation diff {target.name}: {len(statements)} statements, "
+                 f"{changed} relations changed in {time.monotonic() - started:.3f}s")
+    return payloads
+
+class CoProcess:
+    """
+    A command hook started once and kept running: events are written to its
+    stdin as newline-delimited JSON and it answers each with one line on
+    stdout, 'ok' on success (any other answer fails the event, see Hook.run).
+    Its stderr goes to the log. A handler that exits is started again and the
+    event in flight is sent once more; one that misses the timeout, or closes
+    its pipes without exiting within it, is killed and restarted for the next
+    event. Events are sent one at a time.
+    """
+
+    def __init__(self, name: str, command: List[str], timeout: float = 30):
+        self.name = name
+        self.command = command
+        self.timeout = timeout
+        self.proc = None
+        self.buffer = b""
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+        self.buffer = b""
+        threading.Thread(target=self._log_stderr, args=(self.proc,), name=f"hook-stderr-{self.name}",
+                         daemon=True).start()
+        logging.info(f"[HOOK] Started {self.name} (pid {self.proc.pid})")
+
+    def _log_stderr(self, proc):
+        for line in proc.stderr:
+            logging.error(f"[HOOK ERROR] {self.name}: {line.decode('utf-8', 'replace').rstrip()}")
+
+    def _readline(self, timeout: float) -> Optional[bytes]:
+        """Next stdout line, None on timeout; raises EOFError if the handler closed stdout."""
+        deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while b"\n" not in self.buffer:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    return None
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise EOFError
+                self.buffer += chunk
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return line
+
+    def _kill(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def send(self, payload: str) -> str:
+        """Writes one event and returns the handler's answer line."""
+        with self.lock:
+            for attempt in (1, 2):
+                if self.proc is None or self.proc.poll() is not None:
+                    if self.proc is not None:
+                        logging.error(f"[HOOK ERROR] {self.name} exited with code {self.proc.returncode}, restarting")
+                    self._start()
+                try:
+                    self.proc.stdin.write(payload.encode("utf-8") + b"\n")
+                    self.proc.stdin.flush()
+                    line = self._readline(self.timeout)
+                except (OSError, EOFError):
+                    # the handler closed its pipes; wait for it to exit, but not forever under the lock
+                    try:
+                        self.proc.wait(self.timeout)
+                    except subprocess.TimeoutExpired:
+                        logging.error(f"[HOOK ERROR] {self.name} closed its pipes but did not exit, killing it")
+                        self._kill()
+                    continue
+                if line is None:
+                    self._kill()
+                    raise subprocess.TimeoutExpired(self.command, self.timeout)
+                return line.decode("utf-8", "replace").strip()
+            raise RuntimeError(f"{self.name} exited twice while handling the event")
+
+    def close(self, timeout: float = 5):
+        """Closes stdin so the handler can finish, then waits for it to exit."""
+        with self.lock:
+            if self.proc is None:
+                return
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self._kill()
+
+class Hook:
+    """
+    One registered hook: a Python callable (sync or `async def`) or a command
+    that gets the payload on stdin, so its size is not bound by the argument
+    limit (with stream, a CoProcess that gets one per line), plus the values it matches on (MATCH_FIELDS; a
+    missing field matches anything). A typed callable gets the shared
+    DDLEvent (a tuple of them for a batch) instead of the JSON string. The
+    JSON of a statement parked in the event log only carries its query text
+    if the hook asks for it (wants_query), otherwise a 'query_ref'.
+    """
+    MATCH_FIELDS = ("event", "schema", "object_type", "command_tag")
+
+    def __init__(self, name: str, func: Optional[Callable] = None, command: Optional[List[str]] = None,
+                 match: Optional[dict] = None, timeout: float = 30, stream: bool = False,
+                 typed: bool = False, wants_query: bool = False):
+        self.name = name
+        self.func = func
+        self.typed = typed
+        self.wants_query = wants_query
+        self.command = command
+        self.timeout = timeout
+        self.coprocess = CoProcess(name, command, timeout) if command is not None and stream else None
+        self.match = {}
+        for field, values in (match or {}).items():
+            if field not in self.MATCH_FIELDS:
+                raise ValueError(f"hook '{name}': unknown match field '{field}'")
+            self.match[field] = split_list(values, "lower" if field == "object_type" else
+                                           "upper" if field in ("event", "command_tag") else None)
+
+    @property
+    def is_async(self) -> bool:
+        return self.func is not None and asyncio.iscoroutinefunction(self.func)
+
+    def argument(self, payload):
+        """What the callable is called with: the typed event(s) or the JSON string."""
+        return as_event(payload) if self.typed else payload_text(payload, self.wants_query)
+
+    def run(self, payload) -> bool:
+        """Runs the hook; False if it raised, exited non-zero, timed out or did not answer 'ok'."""
+        started = time.monotonic()
+        try:
+            logging.info(f"[HOOK] Running {self.name}...")
+            if self.command is None:
+                result = self.func(self.argument(payload))
+                if asyncio.iscoroutine(result):
+                    asyncio.run(result)
+                return True
+            if self.coprocess is not None:
+                answer = self.coprocess.send(payload_text(payload, self.wants_query))
+                if answer != "ok":
+                    logging.error(f"[HOOK ERROR] {self.name} answered: {answer}")
+                    METRICS.inc("psql_watcher_hook_failures_total", hook=self.name)
+                    return False
+                return True
+            result = subprocess.run(self.command,
+                input=payload_text(payload, self.wants_query),
+                capture_output=True,
+                text=True,
+                timeout=self.timeout)
+            if result.stdout:
+                logging.info(f"[HOOK OUTPUT] {result.stdout}")
+            if result.stderr:
+                logging.error(f"[HOOK ERROR] {result.stderr}")
+            logging.info(f"[HOOK] {self.name} completed with code {result.returncode}")
+            METRICS.inc("psql_watcher_hook_exit_codes_total", hook=self.name, code=result.returncode)
+            if result.returncode != 0:
+                METRICS.inc("psql_watcher_hook_failures_total", hook=self.name)
+                return False
+            return True
+        except subprocess.TimeoutExpired:
+            logging.error(f"[HOOK ERROR] {self.name} timed out after {self.timeout} seconds")
+            METRICS.inc("psql_watcher_hook_timeouts_total", hook=self.name)
+            return False
+        except Exception as e:
+            logging.error(f"[HOOK ERROR] Error running {self.name}: {e}")
+            METRICS.inc("psql_watcher_hook_failures_total", hook=self.name)
+            return False
+        finally:
+            METRICS.observe("psql_watcher_hook_duration_seconds", time.monotonic() - started, hook=self.name)
+
+    def close(self):
+        if self.coprocess is not None:
+            self.coprocess.close()
+
+class HookRegistry:
+    """
+    Routes events to the hooks whose predicates they match.
+
+    The predicates are compiled once into a dispatch table keyed by
+    (event, schema, object_type, command_tag), where a hook without a
+    predicate on a field is filed under WILDCARD. Routing an event looks up
+    the 16 combinations of its values and WILDCARD, however many hooks are
+    registered; results are memoized per distinct key. A batch is routed
+    per event, and every hook gets the batch of only the events it matches.
+    """
+    WILDCARD = "*"
+    CACHE_SIZE = 10000
+
+    def __init__(self, hooks: List[Hook]):
+        self.hooks = hooks
+        self.table: Dict[tuple, List[int]] = {}
+        self.cache: Dict[tuple, List[Hook]] = {}
+        for i, hook in enumerate(hooks):
+            choices = [hook.match.get(field) or [self.WILDCARD] for field in Hook.MATCH_FIELDS]
+            for key in itertools.product(*choices):
+                self.table.setdefault(key, []).append(i)
+
+    def match(self, event: dict) -> List[Hook]:
+        """Hooks for one event, in registration order."""
+        key = tuple(event.get(field) for field in Hook.MATCH_FIELDS)
+        hooks = self.cache.get(key)
+        if hooks is None:
+            ids = set()
+            for combo in itertools.product(*[(v, self.WILDCARD) if v is not None else (self.WILDCARD,)
+                                             for v in key]):
+                ids.update(self.table.get(combo, ()))
+            hooks = [self.hooks[i] for i in sorted(ids)]
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            self.cache[key] = hooks
+        return hooks
+
+    def route(self, payload) -> List[Tuple[Hook, object]]:
+        """(hook, payload for it) pairs for an event (DDLEvent or JSON) or a batch."""
+        if isinstance(payload, DDLEvent):
+            return [(hook, payload) for hook in self.match(payload)]
+        try:
+            data = json_loads(payload)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return [(hook, payload) for hook in self.match({})]
+        if data.get("event") != "BATCH":
+            return [(hook, payload) for hook in self.match(data)]
+        matched: Dict[int, List[int]] = {}
+        events = batch_events(data)
+        for i, event in enumerate(events):
+            for hook in self.match(event):
+                matched.setdefault(id(hook), []).append(i)
+        routed = []
+        for hook in self.hooks:
+            indexes = matched.get(id(hook))
+            if indexes is None:
+                continue
+            if len(indexes) == len(events):
+                routed.append((hook, payload))
+            else:
+                routed.append((hook, json_dumps(sub_batch(data, indexes))))
+        return routed
+
+def default_hooks(snapshot: bool = False) -> List[Hook]:
+    """
+    script.py main() and ./script.sh, run for every event unless --hooks is
+    given. With --snapshot the watcher already writes the schema in-process
+    and ./script.sh, which would read the same catalogs again, is skipped.
+    """
+    hooks = []
     try:
         import script
         if hasattr(script, 'main'):
-            logging.info("[HOOK] Running script.py main()...")
-            script.main(payload)
+            hooks.append(Hook("script.py main()", func=script.main, typed=getattr(script.main, "typed", False),
+                              wants_query=getattr(script.main, "wants_query", False)))
         else:
             logging.warning("[HOOK] script.py found but no main() function")
     except ImportError:
         logging.info("[HOOK] script.py not found, skipping Python script")
     except Exception as e:
-        logging.error(f"[HOOK ERROR] Error running script.py: {e}")
-    
-    # Try to run script.sh if it exists
-    import os
-    import subprocess
+        logging.error(f"[HOOK ERROR] Error loading script.py: {e}")
     script_path = "./script.sh"
-    if os.path.exists(script_path):
-        try:
-            logging.info(f"[HOOK] Running {script_path}...")
-            result = subprocess.run([script_path, payload], 
-                capture_output=True, 
-                text=True, 
-                timeout=30)
-            if result.stdout:
-                logging.info(f"[HOOK OUTPUT] {result.stdout}")
-            if result.stderr:
-                logging.error(f"[HOOK ERROR] {result.stderr}")
-            logging.info(f"[HOOK] {script_path} completed with code {result.returncode}")
-        except subprocess.TimeoutExpired:
-            logging.error(f"[HOOK ERROR] {script_path} timed out after 30 seconds")
-        except Exception as e:
-            logging.error(f"[HOOK ERROR] Error running {script_path}: {e}")
+    if snapshot:
+        logging.info(f"[HOOK] --snapshot writes the schema in-process, skipping {script_path}")
+    elif os.path.exists(script_path):
+        hooks.append(Hook(script_path, command=[script_path]))
     else:
         logging.info(f"[HOOK] {script_path} not found, skipping shell script")
+    return hooks
+
+def load_hooks(path: str) -> List[Hook]:
+    """
+    Hooks from a JSON file: {"hooks": [{...}]} or a list. Per-hook keys: name,
+    python ("module:function") or command (string or argv list), match
+    ({"event"|"schema"|"object_type"|"command_tag": value or list}), timeout,
+    stream (run the command once and feed it events on stdin, see CoProcess),
+    typed (pass a python hook the DDLEvent instead of the JSON string),
+    query (fetch the query text of statements parked in the event log).
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    hooks = []
+    for spec in data.get("hooks", []) if isinstance(data, dict) else data:
+        name = spec.get("name") or spec.get("python") or spec.get("command")
+        if spec.get("python"):
+            module, _, attr = spec["python"].partition(":")
+            func = getattr(importlib.import_module(module), attr or "main")
+            hooks.append(Hook(name, func=func, match=spec.get("match"), timeout=spec.get("timeout", 30),
+                              typed=bool(spec.get("typed")), wants_query=bool(spec.get("query"))))
+        elif spec.get("command"):
+            command = spec["command"]
+            command = shlex.split(command) if isinstance(command, str) else list(command)
+            hooks.append(Hook(name, command=command, match=spec.get("match"), timeout=spec.get("timeout", 30),
+                              stream=bool(spec.get("stream")), wants_query=bool(spec.get("query"))))
+        else:
+            raise ValueError(f"hook needs 'python' or 'command': {spec}")
+    return hooks
+
+def entry_point_hooks() -> List[Hook]:
+    """
+    Hooks installed as 'psql_watcher.hooks' entry points. The loaded callable
+    may carry a `match` dict attribute with its predicates, `typed = True`
+    and `wants_query = True`.
+    """
+    if entry_points is None:
+        return []
+    found = entry_points()
+    found = found.select(group=HOOK_ENTRY_POINTS) if hasattr(found, "select") else found.get(HOOK_ENTRY_POINTS, [])
+    hooks = []
+    for ep in found:
+        try:
+            func = ep.load()
+            hooks.append(Hook(ep.name, func=func, match=getattr(func, "match", None),
+                              typed=getattr(func, "typed", False),
+                              wants_query=getattr(func, "wants_query", False)))
+        except Exception as e:
+            logging.error(f"[HOOK ERROR] Error loading entry point {ep.name}: {e}")
+    return hooks
+
+def run_hook(payload):
+    """
+    Called for every DDL event. 'payload' is a DDLEvent (str() gives the JSON
+    hooks receive) or a JSON string; its 'source' names the watched database
+    the event came from.
+    With --debounce it is called once per batch instead and 'payload' is
+    {"event": "BATCH", "source": ..., "count": N, "txids": [...], "statements": [...],
+    "events": [{"statement": <index>, ...object fields}, ...]} (see batch_events()).
+    With --diff it carries the structured diff of the affected relation (attach_diffs).
+    Runs the hooks HOOKS routes the event to. Edit this to run your custom logic.
+    Returns the payload the hooks got. Every hook runs even if another one
+    fails; failures are raised afterwards as one RuntimeError, so the
+    dispatcher reports the event as failed (see EventJournal.done()).
+    """
+    failed = []
+    target = TARGETS.get(payload_source(payload))
+
+    logging.info("[HOOK TRIGGERED] DDL Event detected!")
+    logging.info(f"[PAYLOAD] {payload_text(payload, resolve=False)}")
+    logging.info("-" * 50)
+
+    if target is not None and SNAPSHOT_PATH:
+        try:
+            snapshot_hook(target)
+        except Exception as e:
+            logging.error(f"[HOOK ERROR] Error writing snapshot for {target.name}: {e}")
+            METRICS.inc("psql_watcher_hook_failures_total", hook="snapshot")
+            failed.append("snapshot")
+    if target is not None and target.name in SNAPSHOT_STORES:
+        try:
+            store_hook(target, payload)
+        except Exception as e:
+            logging.error(f"[HOOK ERROR] Error refreshing snapshot store for {target.name}: {e}")
+            METRICS.inc("psql_watcher_hook_failures_total", hook="snapshot-store")
+            failed.append("snapshot-store")
+
+    for hook, hook_payload in HOOKS.route(payload) if HOOKS is not None else []:
+        if hook.is_async and ASYNC_HOOKS:
+            continue  # awaited on the event loop by run_hook_async
+        if not hook.run(hook_payload):
+            failed.append(hook.name)
+    if failed:
+        raise RuntimeError(f"{len(failed)} hook(s) failed: {', '.join(failed)}")
+    return payload
+
+def hooks_want_query() -> bool:
+    """
+    True if a registered hook asks for the query text of statements parked in
+    the event log (Hook.wants_query). Otherwise their events keep the compact
+    'query_ref' and nothing is fetched, unless a typed hook reads `query`.
+    """
+    return HOOKS is not None and any(hook.wants_query for hook in HOOKS.hooks)
+
+def to_async(fn: Callable, executor=None) -> Callable:
+    """
+    Adapter for the asyncio engine: coroutine functions are returned as is,
+    plain functions are wrapped to run on `executor` (the loop's default
+    executor if None) so they never block the event loop.
+    """
+    if asyncio.iscoroutinefunction(fn):
+        return fn
+
+    async def call(*args):
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args))
+    return call
+
+async def run_hook_async(payload) -> None:
+    """
+    Hook of the asyncio engine. The sync run_hook() runs unchanged through the
+    to_async() adapter; `async def` hooks (e.g. main() in script.py) are
+    awaited here on the event loop instead, so hundreds of I/O-bound
+    reactions (HTTP calls, cache invalidation, catalog queries) can wait at
+    the same time. Failures of both kinds are raised together, as in run_hook().
+    """
+    failed = []
+    try:
+        payload = await to_async(run_hook)(payload)
+    except RuntimeError as e:
+        failed.append(str(e))
+    for hook, hook_payload in HOOKS.route(payload) if HOOKS is not None else []:
+        if not hook.is_async:
+            continue
+        started = time.monotonic()
+        try:
+            logging.info(f"[HOOK] Awaiting {hook.name}...")
+            await hook.func(hook.argument(hook_payload))
+        except Exception as e:
+            logging.error(f"[HOOK ERROR] Error running {hook.name}: {e}")
+            METRICS.inc("psql_watcher_hook_failures_total", hook=hook.name)
+            failed.append(f"{hook.name} failed")
+        finally:
+            METRICS.observe("psql_watcher_hook_duration_seconds", time.monotonic() - started, hook=hook.name)
+    if failed:
+        raise RuntimeError("; ".join(failed))
+
+def json_loads(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+def json_dumps(data) -> str:
+    return orjson.dumps(data).decode("utf-8") if orjson is not None else json.dumps(data)
+
+# Per-object fields of the legacy (one NOTIFY per object) payload, in order
+EVENT_FIELDS = ("event", "schema", "object", "object_type", "command_tag",
+                "username", "txid", "ts", "query", "classid", "objid")
+
+def to_int(value) -> Optional[int]:
+    """An id from a payload ('unknown', None and other non-numbers give None)."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class DDLEvent:
+    """
+    One DDL event (one affected object of a statement), decoded once when its
+    notification arrives and shared read-only by every hook. Fields are
+    typed: ids are ints (None where the payload has 'unknown'), ts is an
+    aware UTC datetime. The events of a statement share its decoded dict, so
+    the query text is not copied per object, and the query of a statement
+    parked in the event log ('query_ref') is only fetched when `query` is
+    first read. `payload`, also str(event), is the JSON hooks have always
+    received; it is built on first use. With --diff, `diff` is the
+    structured diff of the affected relation (see attach_diffs).
+    """
+    __slots__ = ("event", "command_tag", "schema", "object", "object_type", "username", "source",
+                 "txid", "seq", "classid", "objid", "ts", "diff", "_statement", "_object", "_payload")
+
+    def __init__(self, statement: dict, obj: Optional[dict] = None, source: Optional[str] = None):
+        fields = dict(statement, **obj) if obj is not None else statement
+        init = functools.partial(object.__setattr__, self)
+        for name in ("event", "command_tag", "schema", "object", "object_type", "username"):
+            init(name, fields.get(name))
+        init("source", source if source is not None else fields.get("source"))
+        for name in ("txid", "seq", "classid", "objid"):
+            init(name, to_int(fields.get(name)))
+        init("ts", parse_ts(fields.get("ts")))
+        init("diff", None)
+        init("_statement", statement)
+        init("_object", obj)
+        init("_payload", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"DDLEvent is immutable, cannot set '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"DDLEvent is immutable, cannot delete '{name}'")
+
+    def __reduce__(self):
+        return DDLEvent, (self._statement, self._object, self.source)
+
+    def __str__(self) -> str:
+        return self.payload
+
+    def __repr__(self) -> str:
+        return f"DDLEvent({self.event!r}, {self.object!r}, source={self.source!r})"
+
+    def attach_diff(self, diff: Optional[dict]):
+        """Set once by attach_diffs, before any hook sees the event."""
+        object.__setattr__(self, "diff", diff)
+        object.__setattr__(self, "_payload", None)
+
+    @property
+    def query(self) -> Optional[str]:
+        statement = self._statement
+        if "query" in statement or "query_ref" not in statement:
+            return statement.get("query")
+        # the statement dict is shared by events on other workers: fetch once, under the lock
+        with QUERY_LOCK:
+            ref = statement.get("query_ref")
+            target = TARGETS.get(self.source)
+            if "query" not in statement and ref is not None and target is not None and target.log is not None:
+                try:
+                    body = target.log.fetch([ref]).get(ref)
+                except psycopg2.Error as e:
+                    logging.error(f"[EVENT LOG] Fetch failed: {e}")
+                    body = None
+                if body is not None:
+                    statement["query"] = body.get("query")
+                    statement.pop("query_ref", None)
+        return statement.get("query")
+
+    @property
+    def key(self) -> str:
+        """Ordering key, see event_key()."""
+        return f"{self.source or ''}:{self.schema or ''}.{self.object or ''}"
+
+    def get(self, field: str, default=None):
+        """Dict-style access by payload field name (typed where the event has an attribute)."""
+        if field == "query":
+            value = self.query
+        elif field in self.__slots__ and not field.startswith("_"):
+            value = getattr(self, field)
+        else:
+            value = self._object.get(field) if self._object is not None and field in self._object \
+                else self._statement.get(field)
+        return default if value is None else value
+
+    def parts(self, resolve: bool = True) -> Tuple[dict, dict]:
+        """
+        (statement fields, object fields) of the legacy payload: a batch
+        stores the first once per statement and the second once per object.
+        """
+        if resolve:
+            self.query
+        statement = dict(self._statement)
+        statement.pop("objects", None)
+        obj = {}
+        if self._object is not None:
+            obj.update(self._object)
+            for field in ("classid", "objid"):
+                value = obj[field] if field in obj else statement.get(field)
+                obj[field] = "unknown" if value is None else str(value)
+        if self.diff is not None:
+            obj["diff"] = self.diff
+        return statement, obj
+
+    def to_dict(self, resolve: bool = True) -> dict:
+        """The legacy per-object payload; without resolve a parked query stays a 'query_ref'."""
+        statement, obj = self.parts(resolve)
+        event = dict(statement)
+        event.update(obj)
+        diff = event.pop("diff", None)
+        if self.source is not None:
+            event["source"] = self.source
+        if diff is not None:
+            event["diff"] = diff
+        ordered = {k: event[k] for k in EVENT_FIELDS if k in event}
+        ordered.update(event)
+        return ordered
+
+    @property
+    def payload(self) -> str:
+        if self._payload is None:
+            object.__setattr__(self, "_payload", json_dumps(self.to_dict()))
+        return self._payload
+
+    def dumps(self, resolve: bool = True) -> str:
+        """JSON of the event; without resolve a query that was not fetched yet stays a 'query_ref'."""
+        if resolve or "query_ref" not in self._statement:
+            return self.payload
+        return json_dumps(self.to_dict(resolve=False))
+
+def decode_notification(payload: str):
+    """A NOTIFY payload as a dict, or the string itself if it is not a JSON object."""
+    try:
+        data = json_loads(payload)
+    except ValueError:
+        return payload
+    return data if isinstance(data, dict) else payload
+
+def unpack_events(statement, source: Optional[str] = None) -> list:
+    """
+    Splits a decoded statement-level NOTIFY ({..., "objects": [...]}) into
+    one DDLEvent per affected object, tagged with the 'source' target it came
+    from. Notifications without "objects" (e.g. PING) become a single event;
+    ones that are not JSON objects are passed on as strings.
+    """
+    if not isinstance(statement, dict):
+        return [statement]
+    if not isinstance(statement.get("objects"), list):
+        return [DDLEvent(statement, source=source)]
+    return [DDLEvent(statement, obj, source) for obj in statement["objects"]]
+
+def as_event(payload):
+    """A payload for typed hooks: a DDLEvent, or a tuple of them for a batch."""
+    if isinstance(payload, DDLEvent):
+        return payload
+    data = decode_notification(payload)
+    if not isinstance(data, dict):
+        return payload
+    if data.get("event") == "BATCH":
+        statements = data.get("statements", [])
+        return tuple(DDLEvent(statements[event["statement"]],
+                              {k: v for k, v in event.items() if k != "statement"}, data.get("source"))
+                     for event in data.get("events", []))
+    return DDLEvent(data)
+
+def batch_events(data: dict) -> List[dict]:
+    """The events of a decoded batch as per-object payloads, each with the fields of its statement."""
+    statements = data.get("statements", [])
+    events = []
+    for event in data.get("events", []):
+        merged = dict(statements[event["statement"]])
+        merged.update((k, v) for k, v in event.items() if k != "statement")
+        events.append(merged)
+    return events
+
+def sub_batch(data: dict, indexes: List[int]) -> dict:
+    """A decoded batch reduced to the events at 'indexes' and the statements they refer to."""
+    statements, renumbered, events = [], {}, []
+    for i in indexes:
+        event = data["events"][i]
+        n = renumbered.setdefault(event["statement"], len(statements))
+        if n == len(statements):
+            statements.append(data["statements"][event["statement"]])
+        events.append(dict(event, statement=n))
+    batch = dict(data, count=len(events), statements=statements, events=events,
+                 txids=list(dict.fromkeys(s.get("txid") for s in statements)))
+    batch.pop("diffs", None)
+    diffs = [e["diff"] for e in events if e.get("diff") is not None]
+    if diffs:
+        batch["diffs"] = diffs
+    return batch
+
+def event_key(payload) -> str:
+    """
+    Ordering key of an event: hooks for events with the same key never run
+    concurrently and always run in arrival order.
+    """
+    if isinstance(payload, DDLEvent):
+        return payload.key
+    try:
+        data = json_loads(payload)
+    except ValueError:
+        return payload
+    if not isinstance(data, dict):
+        return ""
+    return f"{data.get('source', '')}:{data.get('schema', '')}.{data.get('object', '')}"
+
+def payload_source(payload) -> Optional[str]:
+    """Name of the target an event or batch payload came from."""
+    if isinstance(payload, DDLEvent):
+        return payload.source
+    try:
+        data = json_loads(payload)
+    except ValueError:
+        return None
+    return data.get("source") if isinstance(data, dict) else None
+
+def payload_text(payload, resolve: bool = True) -> str:
+    """JSON of an event (DDLEvent, see DDLEvent.dumps()) or batch payload."""
+    return payload.dumps(resolve) if isinstance(payload, DDLEvent) else str(payload)
+
+# Ordering key prefix of coalesced batches: the batches of one target are handled one at a time, in order
+BATCH_KEY = "*batch*"
+
+class EventCoalescer:
+    """
+    Collects DDL events into batches so hooks run once per burst instead of
+    once per event.
+
+    A batch is released when no new event arrived for `window` seconds, or
+    once it has been open for `max_wait` seconds during a continuous storm,
+    or as soon as it holds `max_events` events or about `max_bytes` of JSON.
+    PostgreSQL delivers all NOTIFYs of a transaction together at commit, so
+    a transaction's events land in the same batch unless it alone exceeds a
+    cap. The fields of a statement, its query text included, are stored
+    once per batch and its objects refer to them. Events without a txid
+    (e.g. the startup PING) are not coalesced.
+    """
+
+    def __init__(self, window: float, max_wait: float, max_events: int = 1000, max_bytes: int = 1 << 20):
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.max_events = max(1, max_events)
+        self.max_bytes = max_bytes
+        self.statements: List[dict] = []
+        self.events: List[dict] = []
+        self.refs: List[int] = []
+        self.index: Dict[int, Tuple[int, dict]] = {}  # id(statement dict) -> (position, the dict itself)
+        self.source = None
+        self.bytes = 0
+        self.opened = 0.0
+        self.last = 0.0
+
+    def add(self, payload, ref: Optional[List[int]] = None) -> bool:
+        """
+        Buffer an event (and its journal offsets); returns False if it must
+        be dispatched on its own. Call ready() after it: a full batch is due.
+        """
+        if isinstance(payload, DDLEvent):
+            if payload.txid is None:
+                return False
+            # a parked query is resolved for the whole batch at once, see EventLog.resolve()
+            original = payload._statement
+            statement, obj = payload.parts(resolve=False)
+            source = payload.source
+        else:
+            original = decode_notification(payload)
+            if not isinstance(original, dict) or original.get("txid") is None:
+                return False
+            statement, obj = original, {}
+            source = original.get("source")
+        now = time.monotonic()
+        if not self.events:
+            self.opened = now
+            self.source = source
+        known = self.index.get(id(original))
+        if known is None:
+            known = self.index[id(original)] = (len(self.statements), original)
+            self.statements.append(statement)
+            self.bytes += len(json_dumps(statement))
+        obj["statement"] = known[0]
+        self.events.append(obj)
+        self.bytes += len(json_dumps(obj))
+        self.refs += ref or []
+        self.last = now
+        return True
+
+    def full(self) -> bool:
+        return len(self.events) >= self.max_events or self.bytes >= self.max_bytes
+
+    def timeout(self, default: float) -> float:
+        """Seconds the caller may wait before the pending batch is due."""
+        if not self.events:
+            return default
+        if self.full():
+            return 0.0
+        deadline = min(self.last + self.window, self.opened + self.max_wait)
+        return max(0.0, min(default, deadline - time.monotonic()))
+
+    def ready(self, force: bool = False) -> Optional[Tuple[str, int, List[int]]]:
+        """
+        The pending batch, as (payload, event count, journal offsets), if it
+        is due, full or force is set; else None.
+        """
+        if not self.events:
+            return None
+        now = time.monotonic()
+        if force or self.full() or now >= self.last + self.window or now >= self.opened + self.max_wait:
+            batch = (batch_payload(self.statements, self.events, self.source), len(self.events), self.refs)
+            self.statements, self.events, self.refs = [], [], []
+            self.index.clear()
+            self.bytes = 0
+            return batch
+        return None
+
+def batch_payload(statements: List[dict], events: List[dict], source: Optional[str] = None) -> str:
+    """
+    JSON payload handed to hooks for a coalesced batch: the statement fields
+    once per statement, and per event its object fields and the index of
+    its statement (batch_events() merges them back).
+    """
+    txids = list(dict.fromkeys(s.get("txid") for s in statements))
+    batch = {"event": "BATCH", "source": source, "count": len(events), "txids": txids,
+             "statements": statements, "events": events}
+    diffs = [e["diff"] for e in events if e.get("diff") is not None]
+    if diffs:
+        batch["diffs"] = diffs  # --diff: those of the events, in order
+    return json_dumps(batch)
+
+class EventLog:
+    """
+    Reads the watcher's event log table, where the trigger functions store
+    every notified statement under a sequence number ('seq'). Payloads that
+    did not fit into a NOTIFY are fetched from it when needed and always in
+    bulk: one query for any number of references. After a lost LISTEN
+    connection, catch_up() returns everything logged since in one query.
+    The table is kept at EVENT_LOG_SIZE rows by prune() and dropped by
+    uninstall_ddl. Hook workers share the log, so access to its connection
+    is locked.
+    """
+
+    def __init__(self, connect: Callable, table: sql.Identifier):
+        self.connect = connect
+        self.table = table
+        self.conn = None
+        self.lock = threading.Lock()
+        self.pruned = time.monotonic()
+
+    def _cursor(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+        return self.conn.cursor()
+
+    def fetch(self, ids: Iterable[int]) -> Dict[int, dict]:
+        ids = sorted(set(ids))
+        if not ids:
+            return {}
+        with self.lock, self._cursor() as cur:
+            cur.execute(sql.SQL("SELECT id, payload FROM {} WHERE id = ANY(%s)").format(self.table), (ids,))
+            bodies = {ref: dict(json_loads(payload), seq=ref) for ref, payload in cur.fetchall()}
+        missing = set(ids) - set(bodies)
+        if missing:
+            logging.warning(f"[EVENT LOG] Payloads not found (pruned?): {sorted(missing)}")
+        return bodies
+
+    def expand(self, statements: list) -> list:
+        """Replaces decoded references whose object list did not fit ('overflow') with the stored payloads."""
+        refs = {i: data["overflow"] for i, data in enumerate(statements)
+                if isinstance(data, dict) and "overflow" in data}
+        if not refs:
+            return statements
+        try:
+            bodies = self.fetch(refs.values())
+        except psycopg2.Error as e:
+            logging.error(f"[EVENT LOG] Fetch failed: {e}")
+            return statements
+        return [bodies[refs[i]] if refs.get(i) in bodies else data for i, data in enumerate(statements)]
+
+    def resolve(self, payload: str) -> str:
+        """Fills in 'query' for an event (or every statement of a batch) that only carries a 'query_ref'."""
+        if '"query_ref"' not in payload:
+            return payload
+        data = json_loads(payload)
+        events = data.get("statements", []) if data.get("event") == "BATCH" else [data]
+        try:
+            bodies = self.fetch(e["query_ref"] for e in events if "query_ref" in e)
+        except psycopg2.Error as e:
+            logging.error(f"[EVENT LOG] Fetch failed: {e}")
+            return payload
+        for event in events:
+            body = bodies.get(event.get("query_ref"))
+            if body is not None:
+                event["query"] = body.get("query")
+                del event["query_ref"]
+        return json_dumps(data)
+
+    def catch_up(self, after: int) -> Tuple[List[dict], Optional[int]]:
+        """
+        Every logged payload (decoded) with a sequence number above `after`,
+        in order, and the oldest sequence number still in the log (None if empty).
+        """
+        query = sql.SQL("""
+            SELECT log.id, log.payload, oldest.id
+              FROM (SELECT min(id) AS id FROM {0}) AS oldest
+              LEFT JOIN {0} AS log ON log.id > %s
+             ORDER BY log.id
+        """).format(self.table)
+        with self.lock:
+            try:
+                with self._cursor() as cur:
+                    cur.execute(query, (after,))
+                    rows = cur.fetchall()
+            except psycopg2.Error:
+                # the log's own connection may have died in the same outage
+                self.conn.close()
+                raise
+        payloads = [dict(json_loads(payload), seq=seq) for seq, payload, _ in rows if seq is not None]
+        return payloads, rows[0][2] if rows else None
+
+    def prune(self, every: float = 60):
+        """Trims the log to its newest EVENT_LOG_SIZE rows, at most once per `every` seconds."""
+        now = time.monotonic()
+        if now - self.pruned < every:
+            return
+        self.pruned = now
+        try:
+            with self.lock, self._cursor() as cur:
+                cur.execute(sql.SQL("DELETE FROM {0} WHERE id <= (SELECT max(id) FROM {0}) - %s")
+                            .format(self.table), (EVENT_LOG_SIZE,))
+        except psycopg2.Error as e:
+            logging.warning(f"[EVENT LOG] Prune failed: {e}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+class EventJournal:
+    """
+    Append-only on-disk log of every received event, so neither a crash nor a
+    failing hook loses a schema change.
+
+    Records are NDJSON lines {"offset": N, "payload": "..."} in segment files
+    named after their first offset and rotated at segment_size bytes. append()
+    only writes; sync() is the group commit: one flush + fsync for everything
+    appended since the last call, made once per received batch before its
+    hooks run. The consumer's offset (DIR/<consumer>.offset) is the first
+    event whose hooks have not completed. Hooks finish in any order; the
+    offset only advances over an unbroken run of completed events, so an
+    event that was never handled (skipped by --replay-from, or still queued
+    at shutdown) is never passed. An event whose hooks still fail after the
+    dispatcher's retries is recorded in DIR/<consumer>.failed and counts as
+    completed, so it does not hold back the offset or --journal-keep;
+    --replay-from failed re-runs those events.
+    """
+    SUFFIX = ".log"
+
+    def __init__(self, path: str, consumer: str = "hooks",
+                 segment_size: int = 64 * 1024 * 1024, keep: int = 0):
+        self.path = path
+        self.consumer = consumer
+        self.segment_size = segment_size
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.file = None
+        self.dirty = False
+        self.completed: Set[int] = set()  # completed events past the offset, waiting for the gap below them
+        self.failed: Set[int] = set()  # events recorded as failed by this run
+        os.makedirs(path, exist_ok=True)
+        self.next_offset = self._recover()
+        self.committed = self.offset()
+        self.saved = self.committed
+
+    def segments(self) -> List[Tuple[int, str]]:
+        """(first offset, path) of every segment, oldest first."""
+        names = sorted(f for f in os.listdir(self.path) if f.endswith(self.SUFFIX))
+        return [(int(f[:-len(self.SUFFIX)]), os.path.join(self.path, f)) for f in names]
+
+    def _recover(self) -> int:
+        """Next offset to write; cuts a record torn by a crash off the last segment."""
+        segments = self.segments()
+        if not segments:
+            return 0
+        next_offset, path = segments[-1]
+        good = 0
+        with open(path, "rb+") as f:
+            for line in f:
+                try:
+                    next_offset = json.loads(line)["offset"] + 1
+                except (ValueError, KeyError):
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+            if good < f.seek(0, os.SEEK_END):
+                logging.warning(f"[JOURNAL] Dropping torn record at the end of {path}")
+                f.truncate(good)
+        return next_offset
+
+    def offset(self, consumer: Optional[str] = None) -> int:
+        """Stored offset of a consumer; a new consumer starts at the end of the journal."""
+        try:
+            with open(os.path.join(self.path, f"{consumer or self.consumer}.offset"), encoding="utf-8") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return self.next_offset
+
+    def _open(self):
+        segments = self.segments()
+        if segments and os.path.getsize(segments[-1][1]) < self.segment_size:
+            path = segments[-1][1]
+        else:
+            path = os.path.join(self.path, f"{self.next_offset:020d}{self.SUFFIX}")
+        self.file = open(path, "ab")
+
+    def _rotate(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = open(os.path.join(self.path, f"{self.next_offset:020d}{self.SUFFIX}"), "ab")
+        if self.keep > 0:
+            # never drop a segment that still holds events the consumer has not completed
+            segments = self.segments()
+            for i, (first, path) in enumerate(segments[:-self.keep]):
+                if segments[i + 1][0] <= self.committed:
+                    os.remove(path)
+                    logging.info(f"[JOURNAL] Removed old segment {path}")
+
+    def append(self, payloads: List[str]) -> List[int]:
+        """Writes events (not yet durable, see sync()) and returns their offsets."""
+        offsets = []
+        with self.lock:
+            if self.file is None:
+                self._open()
+            for payload in payloads:
+                if self.file.tell() >= self.segment_size:
+                    self._rotate()
+                record = json_dumps({"offset": self.next_offset, "payload": payload}) + "\n"
+                self.file.write(record.encode("utf-8"))
+                offsets.append(self.next_offset)
+                self.next_offset += 1
+            self.dirty = self.dirty or bool(offsets)
+        return offsets
+
+    def sync(self):
+        """Group commit: one fsync for all events appended so far, then stores the consumer offset."""
+        with self.lock:
+            if self.dirty:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.dirty = False
+            if self.committed != self.saved:
+                path = os.path.join(self.path, f"{self.consumer}.offset")
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(f"{self.committed}\n")
+                os.replace(path + ".tmp", path)
+                self.saved = self.committed
+
+    def done(self, offsets: List[int], ok: bool = True):
+        """Hook completion callback of the dispatchers; advances the offset (stored by sync())."""
+        with self.lock:
+            if not ok:
+                with open(self._failed_path(), "a", encoding="utf-8") as f:
+                    f.write("".join(f"{offset}\n" for offset in offsets))
+                self.failed.update(offsets)
+            self.completed.update(offset for offset in offsets if offset >= self.committed)
+            while self.committed in self.completed:
+                self.completed.remove(self.committed)
+                self.committed += 1
+        if not ok:
+            logging.error(f"[JOURNAL] Hooks failed for offsets {offsets}; recorded in {self._failed_path()}, "
+                          f"re-run them with --replay-from failed")
+
+    def _failed_path(self) -> str:
+        return os.path.join(self.path, f"{self.consumer}.failed")
+
+    def failed_offsets(self) -> List[int]:
+        """Offsets recorded in DIR/<consumer>.failed, ascending."""
+        try:
+            with open(self._failed_path(), encoding="utf-8") as f:
+                return sorted({int(line) for line in f if line.strip().isdigit()})
+        except OSError:
+            return []
+
+    def set_failed(self, offsets: Iterable[int]):
+        """Replaces DIR/<consumer>.failed, e.g. with what --replay-from failed could not fix."""
+        path = self._failed_path()
+        with self.lock:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write("".join(f"{offset}\n" for offset in sorted(set(offsets))))
+            os.replace(path + ".tmp", path)
+
+    def replay(self, start: int, offsets: Optional[Set[int]] = None) -> Iterable[Tuple[int, str]]:
+        """(offset, payload) of every journaled event from `start` on, or only of `offsets`."""
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+        segments = self.segments()
+        if segments and segments[0][0] > start:
+            logging.warning(f"[JOURNAL] Offsets before {segments[0][0]} were removed (--journal-keep)")
+        for i, (first, path) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= start:
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json_loads(line)
+                    except ValueError:
+                        break
+                    if record["offset"] >= start and (offsets is None or record["offset"] in offsets):
+                        yield record["offset"], record["payload"]
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class HookDispatcher:
+    """
+    Runs hooks off the LISTEN loop on a fixed set of worker threads.
+
+    Every worker owns a bounded queue and events are routed to a worker by
+    event_key(), so events of one object are handled strictly in order while
+    different objects are processed concurrently. With pool="process" the
+    hooks themselves run in a process pool and the worker threads only wait
+    for their results. resolve, when given, is applied to every payload on
+    the worker right before the hook runs; done(ref, ok) is called after it
+    for events submitted with a ref. A failed event with a ref is retried up
+    to `retries` times with backoff() on its worker, so later events of the
+    same object wait for it. Fed from an EventQueue, a full worker queue is
+    the normal state and is not warned about (warn=False).
+    """
+    _STOP = object()
+
+    def __init__(self, hook: Callable[[str], None], workers: int = 4,
+                 queue_size: int = 1000, pool: str = "thread",
+                 resolve: Optional[Callable[[str], str]] = None,
+                 done: Optional[Callable[[List[int], bool], None]] = None,
+                 warn: bool = True, retries: int = 0):
+        self.hook = hook
+        self.resolve = resolve
+        self.done = done
+        self.warn = warn
+        self.retries = retries
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self.executor = ProcessPoolExecutor(max_workers=len(self.queues)) if pool == "process" else None
+        self.threads = [
+            threading.Thread(target=self._worker, args=(q,), name=f"hook-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
 
-def get_conn(dbname: str):
-    conn = psycopg2.connect(
-        dbname=dbname,
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASS,
-        sslmode=os.getenv("POSTGRES_SSLMODE", "disable"),
-    )
+    def submit(self, key: str, payload: str, ref: Optional[List[int]] = None) -> None:
+        """Enqueue an event; blocks only while the target worker queue is full."""
+        q = self.queues[zlib.crc32(key.encode("utf-8")) % len(self.queues)]
+        warned = not self.warn
+        while True:
+            try:
+                q.put((payload, ref), timeout=1)
+                return
+            except queue.Full:
+                if not warned:
+                    logging.warning(f"[DISPATCH] Worker queue full ({q.maxsize}), waiting for hooks to catch up")
+                    warned = True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def stop(self, timeout: Optional[float] = 60):
+        """Let workers drain what is already queued, then shut them down."""
+        for q in self.queues:
+            q.put(self._STOP)
+        for t in self.threads:
+            if t.is_alive():
+                t.join(timeout)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is self._STOP:
+                return
+            payload, ref = item
+            ok = False
+            for attempt in range(1, (self.retries if ref is not None else 0) + 2):
+                if attempt > 1:
+                    if STOP_FLAG:
+                        break
+                    delay = backoff(attempt - 1)
+                    logging.warning(f"[DISPATCH] Retrying hooks in {delay:.1f}s (attempt {attempt})")
+                    time.sleep(delay)
+                try:
+                    if self.resolve is not None:
+                        payload = self.resolve(payload)
+                    if self.executor is not None:
+                        self.executor.submit(self.hook, payload_text(payload, hooks_want_query())).result()
+                    else:
+                        self.hook(payload)
+                    ok = True
+                    break
+                except Exception as e:
+                    logging.error(f"[WATCHER ERROR] Hook failed: {e}")
+            if ref is not None and self.done is not None:
+                self.done(ref, ok)
+
+class AsyncHookDispatcher:
+    """
+    asyncio counterpart of HookDispatcher. Every event becomes a task on the
+    event loop; tasks with the same event_key() are chained, so events of one
+    object still run strictly in order, while up to `concurrency` hooks run at
+    once. Hooks and resolve go through to_async(), done(ref, ok) and retries
+    work as in HookDispatcher. submit() waits while `queue_size` events are
+    pending, which pauses LISTEN intake.
+    """
+
+    def __init__(self, hook: Callable, concurrency: int = 100, queue_size: int = 1000,
+                 resolve: Optional[Callable[[str], str]] = None,
+                 done: Optional[Callable[[List[int], bool], None]] = None,
+                 warn: bool = True, retries: int = 0):
+        self.hook = to_async(hook)
+        self.resolve = to_async(resolve) if resolve is not None else None
+        self.done = done
+        self.warn = warn
+        self.retries = retries
+        self.running = asyncio.Semaphore(max(1, concurrency))
+        self.pending = asyncio.Semaphore(max(1, queue_size))
+        self.tails: Dict[str, asyncio.Future] = {}
+        self.count = 0
+
+    async def submit(self, key: str, payload: str, ref: Optional[List[int]] = None) -> None:
+        """Schedule an event after the previous one with the same key."""
+        if self.pending.locked() and self.warn:
+            logging.warning(f"[DISPATCH] {self.count} events pending, waiting for hooks to catch up")
+        await self.pending.acquire()
+        self.count += 1
+        task = asyncio.ensure_future(self._run(self.tails.get(key), payload, ref))
+        self.tails[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+
+    def depth(self) -> int:
+        return self.count
+
+    async def stop(self, timeout: Optional[float] = 60):
+        """Wait for the events already scheduled."""
+        tasks = list(self.tails.values())
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def _run(self, previous: Optional[asyncio.Future], payload: str, ref: Optional[List[int]]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self.running:
+            ok = False
+            for attempt in range(1, (self.retries if ref is not None else 0) + 2):
+                if attempt > 1:
+                    if STOP_FLAG:
+                        break
+                    delay = backoff(attempt - 1)
+                    logging.warning(f"[DISPATCH] Retrying hooks in {delay:.1f}s (attempt {attempt})")
+                    await asyncio.sleep(delay)
+                try:
+                    if self.resolve is not None:
+                        payload = await self.resolve(payload)
+                    await self.hook(payload)
+                    ok = True
+                    break
+                except Exception as e:
+                    logging.error(f"[WATCHER ERROR] Hook failed: {e}")
+            if ref is not None and self.done is not None:
+                self.done(ref, ok)
+
+    def _done(self, key: str, task: asyncio.Future):
+        self.count -= 1
+        self.pending.release()
+        if self.tails.get(key) is task:
+            del self.tails[key]
+
+# Priority lanes of EventQueue, served in this order
+LANES = ("drop", "normal", "bulk")
+
+# Events each hook worker holds beyond the one it runs when fed from an EventQueue:
+# small, so that lane priorities and shedding decide what runs next
+DISPATCH_WINDOW = 16
+
+class SpillFile:
+    """
+    Overflow of one EventQueue lane: an NDJSON file of (key, payload, ref)
+    records read back in FIFO order, events as DDLEvent again, truncated
+    whenever it has been read to the end. Not synced: it keeps memory flat,
+    --journal is what survives a crash.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w+b")
+        self.read_at = 0
+        self.count = 0
+
+    def push(self, key: str, payload, ref: Optional[List[int]]):
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(json_dumps({"key": key, "payload": payload_text(payload, resolve=False), "ref": ref})
+                        .encode("utf-8") + b"\n")
+        self.count += 1
+
+    def pop(self) -> Tuple[str, str, Optional[List[int]]]:
+        self.file.seek(self.read_at)
+        record = json_loads(self.file.readline())
+        self.read_at = self.file.tell()
+        self.count -= 1
+        if not self.count:
+            self.file.seek(0)
+            self.file.truncate()
+            self.read_at = 0
+        payload = decode_notification(record["payload"])
+        if isinstance(payload, dict) and payload.get("event") != "BATCH":
+            payload = DDLEvent(payload)
+        elif isinstance(payload, dict):
+            payload = record["payload"]
+        return record["key"], payload, record["ref"]
+
+    def close(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class EventQueue:
+    """
+    Bounded queue between LISTEN intake and the hook dispatcher. At most
+    `size` events are held in memory, in priority lanes (LANES) served in
+    order: sql_drop events first, bulk ones (command tags in `bulk_tags` and
+    low-value events) last. Events with the same ordering key never overtake
+    each other: an event joins the lowest-priority lane still holding an
+    event of its key.
+
+    When memory is full, low-value events (those matching the `low_value`
+    predicates, see Hook.MATCH_FIELDS) are shed by `policy`: "drop"
+    discards them, "coalesce" replaces the queued event of the same key if
+    it is the newest one. Other events spill to one SpillFile per lane in
+    `spill_dir`, read back once their lane has drained; without spill_dir
+    put() waits, which pauses LISTEN intake; event loops wait on
+    space() instead, so no thread is held while the queue is full.
+    done(ref, True) is called for shed events, as for completed ones.
+    """
+
+    def __init__(self, size: int = 1000, spill_dir: Optional[str] = None,
+                 low_value: Optional[dict] = None, policy: str = "coalesce",
+                 bulk_tags: Optional[List[str]] = None,
+                 done: Optional[Callable[[List[int], bool], None]] = None):
+        self.size = max(1, size)
+        self.policy = policy
+        self.bulk_tags = set(bulk_tags or [])
+        self.low_value = HookRegistry([Hook("low-value", match=low_value)]) if low_value else None
+        self.done = done
+        self.lanes = [deque() for _ in LANES]
+        self.spills: List[Optional[SpillFile]] = [None] * len(LANES)
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spills = [SpillFile(os.path.join(spill_dir, f"spill-{os.getpid()}-{lane}.ndjson"))
+                           for lane in LANES]
+        self.count = 0
+        self.pending: Dict[str, List[int]] = {}  # key -> events queued per lane
+        self.newest: Dict[str, list] = {}        # key -> its newest event, while held in memory
+        self.cond = threading.Condition()
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.closed = False
+
+    def classify(self, payload) -> Tuple[int, bool]:
+        """(lane, low value) of a payload."""
+        event = payload if isinstance(payload, DDLEvent) else decode_notification(payload)
+        if not isinstance(event, (dict, DDLEvent)) or event.get("event") == "BATCH":
+            return 1, False
+        low = self.low_value is not None and bool(self.low_value.match(event))
+        if event.get("trigger") == "sql_drop":
+            return 0, low
+        if low or event.get("command_tag") in self.bulk_tags:
+            return 2, low
+        return 1, low
+
+    def put(self, key: str, payload, ref: Optional[List[int]] = None, block: bool = True) -> bool:
+        """
+        Queues an event, spilling or shedding it if memory is full. Returns
+        False if it would have to wait and block is False.
+        """
+        lane, low = self.classify(payload)
+        shed = None
+        warned = False
+        with self.cond:
+            counts = self.pending.get(key)
+            if counts is not None:
+                lane = max([lane] + [i for i, n in enumerate(counts) if n])
+            while self.count >= self.size:
+                if low and self.policy != "keep":
+                    shed = self._shed(key, payload, ref)
+                    if shed is not None:
+                        break
+                spill = self.spills[lane]
+                if spill is not None:
+                    spill.push(key, payload, ref)
+                    self.newest.pop(key, None)
+                    self._count(key, lane, 1)
+                    self.cond.notify()
+                    return True
+                if not block:
+                    return False
+                if not warned:
+                    self.warn_full()
+                    warned = True
+                self.cond.wait(1)
+            else:
+                spill = self.spills[lane]
+                if spill is not None and spill.count:
+                    spill.push(key, payload, ref)  # behind what its lane spilled already
+                    self.newest.pop(key, None)
+                else:
+                    item = [key, payload, ref, low]
+                    self.lanes[lane].append(item)
+                    self.newest[key] = item
+                    self.count += 1
+                self._count(key, lane, 1)
+                self.cond.notify()
+                return True
+        METRICS.inc("psql_watcher_events_shed_total", policy=self.policy)
+        if shed and self.done is not None:
+            self.done(shed, True)
+        return True
+
+    def _shed(self, key: str, payload, ref: Optional[List[int]]) -> Optional[List[int]]:
+        """Drops or coalesces a low-value event; returns the refs now done, None if it must be kept."""
+        if self.policy == "drop":
+            return ref or []
+        item = self.newest.get(key)
+        if item is None or not item[3]:
+            return None
+        item[1] = payload
+        item[2] = (item[2] or []) + (ref or []) or None
+        return []
+
+    def _count(self, key: str, lane: int, delta: int):
+        counts = self.pending.setdefault(key, [0] * len(LANES))
+        counts[lane] += delta
+        if not any(counts):
+            del self.pending[key]
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[str, object, Optional[List[int]]]]:
+        """Next event by lane priority; None once closed and empty (or after timeout)."""
+        with self.cond:
+            while True:
+                for lane, items in enumerate(self.lanes):
+                    if items:
+                        item = items.popleft()
+                        key, payload, ref, _ = item
+                        self.count -= 1
+                        if self.newest.get(key) is item:
+                            del self.newest[key]
+                    elif self.spills[lane] is not None and self.spills[lane].count:
+                        key, payload, ref = self.spills[lane].pop()
+                    else:
+                        continue
+                    self._count(key, lane, -1)
+                    self.cond.notify_all()
+                    self._wake()
+                    return key, payload, ref
+                if self.closed or not self.cond.wait(timeout):
+                    return None
+
+    def space(self) -> asyncio.Future:
+        """Future on the running loop, resolved once get() frees a slot or the queue closes."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.cond:
+            if self.closed or self.count < self.size:
+                future.set_result(None)
+            else:
+                self.waiters.append((loop, future))
+        return future
+
+    def _wake(self):
+        """Resolves the space() futures; called with cond held."""
+        for loop, future in self.waiters:
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            except RuntimeError:
+                pass  # its loop is closed
+        self.waiters.clear()
+
+    def warn_full(self):
+        logging.warning(f"[QUEUE] Intake queue full ({self.size}), waiting for hooks to catch up")
+
+    def depth(self) -> int:
+        return self.count + self.spilled()
+
+    def spilled(self) -> int:
+        return sum(spill.count for spill in self.spills if spill is not None)
+
+    def close(self):
+        """No more events: get() returns None once the queue has drained."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            self._wake()
+
+    def remove(self):
+        for spill in self.spills:
+            if spill is not None:
+                spill.close()
+
+def event_queue(args, done: Optional[Callable[[List[int], bool], None]] = None) -> EventQueue:
+    """The intake queue of the watch and --source loops, from the command line options."""
+    equeue = EventQueue(args.queue_size, spill_dir=args.spill_dir,
+                        low_value=json.loads(args.low_value) if args.low_value else None,
+                        policy=args.low_value_policy, bulk_tags=split_list(args.bulk_tags, "upper"),
+                        done=done)
+    METRICS.gauge("psql_watcher_events_spilled", equeue.spilled)
+    return equeue
+
+def start_feeder(equeue: EventQueue, dispatcher: HookDispatcher) -> threading.Thread:
+    """Starts the thread handing queued events to the dispatcher, by priority, until the queue is closed."""
+    def feed():
+        while True:
+            item = equeue.get()
+            if item is None:
+                return
+            dispatcher.submit(*item)
+    feeder = threading.Thread(target=feed, name="event-feeder", daemon=True)
+    feeder.start()
+    return feeder
+
+async def feed_async(equeue: EventQueue, dispatcher: AsyncHookDispatcher):
+    """asyncio counterpart of start_feeder(): runs until the queue is closed and drained."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-feeder") as executor:
+        while True:
+            item = await loop.run_in_executor(executor, equeue.get)
+            if item is None:
+                return
+            await dispatcher.submit(*item)
+
+async def put_async(equeue: EventQueue, key: str, payload, ref: Optional[List[int]] = None):
+    """
+    EventQueue.put() from the event loop. A full queue is awaited on
+    EventQueue.space() rather than a blocking put() on an executor thread,
+    which would hold a worker the hooks need to drain it.
+    """
+    warned = False
+    while not equeue.put(key, payload, ref, block=False):
+        if not warned:
+            equeue.warn_full()
+            warned = True
+        try:
+            await asyncio.wait_for(equeue.space(), 1)
+        except asyncio.TimeoutError:
+            pass  # re-check, as put() does on its condition
+
+def get_conn(dbname: str, dsn: Optional[str] = None):
+    """
+    Autocommit connection to 'dbname' on the .env server, or to a full libpq
+    'dsn'. KEEPALIVES apply unless the dsn sets them itself.
+    """
+    if dsn:
+        conn = psycopg2.connect(**dict(KEEPALIVES, **psycopg2.extensions.parse_dsn(dsn)))
+    else:
+        conn = psycopg2.connect(
+            dbname=dbname,
+            host=POSTGRES_HOST,
+            port=POSTGRES_PORT,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASS,
+            sslmode=os.getenv("POSTGRES_SSLMODE", "disable"),
+            **KEEPALIVES,
+        )
     conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
     return conn
 
-def install_ddl(conn, schemas: List[str], channel: str, names: dict):
+def backoff(attempt: int) -> float:
+    """Seconds to wait before reconnect attempt `attempt` (1-based): exponential, half of it jittered."""
+    base, cap = RECONNECT_BACKOFF
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def text_array(values: List[str]) -> sql.Composable:
+    """ARRAY[...]::text[] literal, or NULL::text[] (= no filter) for an empty/'*' list."""
+    if not values or "*" in values:
+        return sql.SQL("NULL::text[]")
+    return sql.SQL("ARRAY[{}]::text[]").format(sql.SQL(",").join(sql.Literal(v) for v in values))
+
+def install_ddl(conn, schemas: List[str], channel: str, names: dict,
+                events: Optional[List[str]] = None, object_types: Optional[List[str]] = None):
+    """
+    Installs the trigger functions and event triggers. Schema and object type
+    filtering happens inside the functions; command tags are filtered by the
+    event triggers themselves (WHEN TAG IN), so unwanted commands never
+    execute the functions at all.
+    """
     with conn.cursor() as cur:
-        schema_literals = [sql.Literal(schema) for schema in schemas]
-        schema_array = sql.SQL("ARRAY[{}]").format(sql.SQL(",").join(schema_literals))
+        when_tags = sql.SQL("")
+        if events:
+            when_tags = sql.SQL("WHEN TAG IN ({})").format(sql.SQL(",").join(sql.Literal(e) for e in events))
         q = sql.SQL(INSTALL_SQL).format(
             fn_changes=sql.Identifier(names["fn_changes"]),
             fn_drops=sql.Identifier(names["fn_drops"]),
             trg_ddl=sql.Identifier(names["trg_ddl"]),
             trg_drop=sql.Identifier(names["trg_drop"]),
-            schema_array=schema_array,
+            schema_array=text_array(schemas),
+            object_types=text_array(object_types or []),
+            when_tags=when_tags,
             channel=sql.Literal(channel),
+            event_log=sql.Identifier(names["schema"], names["event_log"]),
+            payload_limit=sql.Literal(NOTIFY_PAYLOAD_LIMIT),
         )
         cur.execute(q)
 
@@ -217,123 +2186,1439 @@ def uninstall_ddl(conn, names: dict):
             fn_drops=sql.Identifier(names["fn_drops"]),
             trg_ddl=sql.Identifier(names["trg_ddl"]),
             trg_drop=sql.Identifier(names["trg_drop"]),
+            event_log=sql.Identifier(names["schema"], names["event_log"]),
         )
         cur.execute(q)
 
-def listen_connection(dbname: str, channel: str):
-    conn = get_conn(dbname)
+def installed_ddl(conn, names: dict) -> bool:
+    """True if both event triggers and the event log table still exist."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT count(*) = 2 AND to_regclass(format('%%I.%%I', %s, %s)) IS NOT NULL"
+            "  FROM pg_event_trigger WHERE evtname IN (%s, %s)",
+            (names["schema"], names["event_log"], names["trg_ddl"], names["trg_drop"]),
+        )
+        return cur.fetchone()[0]
+
+def install_version(schemas: List[str], channel: str, events: List[str], object_types: List[str]) -> str:
+    """Content hash of a trigger set: the SQL templates and every setting rendered into them."""
+    spec = [INSTALL_SQL, sorted(schemas), channel, sorted(events), sorted(object_types), NOTIFY_PAYLOAD_LIMIT]
+    return hashlib.sha256(json.dumps(spec).encode("utf-8")).hexdigest()[:12]
+
+def _release_stale(conn, cur, refs: sql.Composable):
+    """Drops the references of dead watchers and every trigger set left without a live one."""
+    cur.execute(sql.SQL(STALE_REFS_SQL).format(refs=refs))
+    stale = dict(cur.fetchall())
+    for version, names in stale.items():
+        cur.execute(sql.SQL("SELECT count(*) FROM {} WHERE version = %s").format(refs), (version,))
+        if not cur.fetchone()[0]:
+            logging.warning(f"[SHARED] Dropping trigger set {version} left behind by stopped watchers")
+            uninstall_ddl(conn, json.loads(names))
+
+def acquire_ddl(conn, watcher: str, version: str, schemas: List[str], channel: str, names: dict,
+                events: Optional[List[str]] = None, object_types: Optional[List[str]] = None,
+                listener: bool = False) -> bool:
+    """
+    --shared: registers `watcher` as a user of the trigger set `names` (named
+    after its version) and installs the set only if it is not there yet, so
+    a start is usually a catalog lookup. Serialized between watchers by an
+    advisory lock. The reference is upserted: on `listener`, the LISTEN
+    connection of the watcher, its backend becomes the liveness pid, so a
+    watcher whose reference was released as stale while it was away (see
+    _release_stale) gets it back. Returns True if the set had to be installed.
+    """
+    refs = sql.Identifier(names["schema"], SHARED_REFS_TABLE)
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SHARED_LOCK,))
+            cur.execute(sql.SQL(REFS_SQL).format(refs=refs))
+            _release_stale(conn, cur, refs)
+            installed = installed_ddl(conn, names)
+            if not installed:
+                uninstall_ddl(conn, names)  # leftovers of a half-dropped set
+                install_ddl(conn, schemas, channel, names, events, object_types)
+            cur.execute(sql.SQL("""
+                INSERT INTO {} (watcher, version, names, pid)
+                VALUES (%s, %s, %s, CASE WHEN %s THEN pg_backend_pid() END)
+                ON CONFLICT (watcher) DO UPDATE SET version = EXCLUDED.version, names = EXCLUDED.names,
+                                                    pid = EXCLUDED.pid, started_at = now()
+                RETURNING xmax = 0
+            """).format(refs), (watcher, version, json.dumps(names), listener))
+            if listener and cur.fetchone()[0]:
+                logging.warning(f"[SHARED] Reference of {watcher} was released while it was away, registered it again")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return not installed
+
+def release_ddl(conn, watcher: str, version: str, names: dict) -> bool:
+    """
+    --shared: drops the reference of `watcher`; the trigger set is dropped
+    only if no live watcher uses it any more. Returns True if it was dropped.
+    """
+    refs = sql.Identifier(names["schema"], SHARED_REFS_TABLE)
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (SHARED_LOCK,))
+            cur.execute("SELECT to_regclass(format('%%I.%%I', %s, %s)) IS NOT NULL",
+                        (names["schema"], SHARED_REFS_TABLE))
+            if not cur.fetchone()[0]:
+                uninstall_ddl(conn, names)
+                conn.commit()
+                return True
+            cur.execute(sql.SQL("DELETE FROM {} WHERE watcher = %s").format(refs), (watcher,))
+            _release_stale(conn, cur, refs)
+            cur.execute(sql.SQL("SELECT count(*) FILTER (WHERE version = %s), count(*) FROM {}").format(refs),
+                        (version,))
+            users, total = cur.fetchone()
+            progress = sql.Identifier(names["schema"], PROGRESS_TABLE)
+            if not users:
+                uninstall_ddl(conn, names)
+                cur.execute("SELECT to_regclass(format('%%I.%%I', %s, %s)) IS NOT NULL",
+                            (names["schema"], PROGRESS_TABLE))
+                if cur.fetchone()[0]:
+                    cur.execute(sql.SQL("DELETE FROM {} WHERE version = %s").format(progress), (version,))
+            if not total:
+                cur.execute(sql.SQL("DROP TABLE {}").format(refs))
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(progress))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+    return not users
+
+def current_schema(conn) -> str:
+    """Schema the watcher's own tables are created in (first schema on search_path)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT current_schema()")
+        return cur.fetchone()[0] or "public"
+
+def listen_connection(dbname: str, channel: str, dsn: Optional[str] = None):
+    conn = get_conn(dbname, dsn)
     with conn.cursor() as cur:
         # channels don't need pre-creation; LISTEN is enough
         cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
     return conn
 
-def send_ping(dbname: str, channel: str):
+def send_ping(dbname: str, channel: str, dsn: Optional[str] = None):
     payload = json.dumps({"event": "PING", "msg": "startup ping"})
-    with get_conn(dbname) as conn:
+    with get_conn(dbname, dsn) as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
 
+class Cluster:
+    """
+    --cluster: one replica of a target watched by several watchers. All of
+    them share the trigger set (--shared) and receive every notification,
+    but hooks only run for events of the partitions a replica holds; an
+    event's partition is a hash of its schema (or schema.object). A
+    partition is held through a session-level pg_try_advisory_lock on a
+    dedicated connection, so it is free the moment its holder dies; with one
+    partition (the default) this is plain leader election.
+
+    tick(), called every --cluster-interval seconds, records the progress of
+    the held partitions, hands surplus ones back so that the partitions stay
+    spread over the live replicas, and takes free ones over. Progress is the
+    sequence number before the oldest event whose hooks have not completed:
+    track() gives every dispatched event a ref and the dispatchers report it
+    through done(). A new holder first catches up, from the event log, on
+    what the previous one had not completed.
+    """
+    _refs = itertools.count()  # refs of events tracked without a journal, unique across targets
+
+    def __init__(self, target: "Target", partitions: int = 1, partition_by: str = "schema",
+                 interval: float = 2.0):
+        self.target = target
+        self.partitions = max(1, partitions)
+        self.partition_by = partition_by
+        self.interval = interval
+        self.conn = None
+        self.held: Dict[int, int] = {}  # partition -> last sequence number dispatched
+        self.running: Dict[int, Tuple[int, int]] = {}  # ref -> (partition, seq) of a dispatched event
+        self.lock = threading.Lock()  # running is completed from the hook workers
+        self.next_tick = 0.0
+
+    def _table(self, name: str) -> sql.Identifier:
+        return sql.Identifier(self.target.names["schema"], name)
+
+    def lock_key(self, partition: int) -> int:
+        """64-bit advisory lock key of a partition of this trigger set."""
+        spec = f"psql-watcher:{self.target.version}:{self.partitions}:{partition}"
+        return int.from_bytes(hashlib.sha256(spec.encode("utf-8")).digest()[:8], "big", signed=True)
+
+    def partition(self, payload) -> int:
+        if self.partitions == 1 or not isinstance(payload, DDLEvent):
+            return 0
+        key = payload.schema or ""
+        if self.partition_by == "object":
+            key = f"{key}.{payload.object or ''}"
+        return zlib.crc32(key.encode("utf-8")) % self.partitions
+
+    def owned(self, payloads: list) -> list:
+        """The events of held partitions, to be dispatched (see track())."""
+        mine = []
+        for payload in payloads:
+            partition = self.partition(payload)
+            if partition not in self.held:
+                continue
+            if isinstance(payload, DDLEvent) and payload.seq is not None:
+                self.held[partition] = max(self.held[partition], payload.seq)
+            mine.append(payload)
+        return mine
+
+    def track(self, items: List[Tuple[object, Optional[List[int]]]]) -> List[Tuple[object, Optional[List[int]]]]:
+        """
+        Registers the (payload, ref) pairs about to be dispatched as running
+        until done() is called for their ref; events without one (no
+        --journal) get a ref of their own.
+        """
+        tracked = []
+        with self.lock:
+            for payload, ref in items:
+                if isinstance(payload, DDLEvent) and payload.seq is not None:
+                    ref = ref or [next(Cluster._refs)]
+                    for r in ref:
+                        self.running[r] = (self.partition(payload), payload.seq)
+                tracked.append((payload, ref))
+        return tracked
+
+    def done(self, refs: List[int], ok: bool = True):
+        """Completion callback of the dispatchers: failed events are complete as well."""
+        with self.lock:
+            for ref in refs:
+                self.running.pop(ref, None)
+
+    def progress(self, partition: int) -> int:
+        """Sequence number up to which the hooks of a held partition completed."""
+        with self.lock:
+            running = [seq for p, seq in self.running.values() if p == partition]
+        return min(running) - 1 if running else self.held[partition]
+
+    def due(self) -> float:
+        """Seconds until the next tick."""
+        return max(0.0, self.next_tick - time.monotonic())
+
+    def _save(self, cur, partitions: Iterable[int]):
+        for partition in partitions:
+            cur.execute(sql.SQL("""
+                INSERT INTO {} AS p (lock_key, version, seq, watcher) VALUES (%s, %s, %s, %s)
+                ON CONFLICT (lock_key) DO UPDATE
+                SET seq = GREATEST(p.seq, EXCLUDED.seq), watcher = EXCLUDED.watcher, updated_at = now()
+            """).format(self._table(PROGRESS_TABLE)),
+                (self.lock_key(partition), self.target.version, self.progress(partition), self.target.watcher))
+
+    def _take_over(self, cur, partition: int) -> list:
+        """Events of a newly held partition the previous holder had not completed."""
+        cur.execute(sql.SQL("SELECT seq FROM {} WHERE lock_key = %s").format(self._table(PROGRESS_TABLE)),
+                    (self.lock_key(partition),))
+        row = cur.fetchone()
+        until = self.target.last_seq  # later ones still arrive through LISTEN
+        after = row[0] if row is not None else until
+        self.held[partition] = max(after, 0)
+        if after >= until:
+            return []
+        statements, oldest = self.target.log.catch_up(after)
+        if oldest is not None and oldest > after + 1:
+            logging.warning(f"[CLUSTER] {self.target.name}: events {after + 1}..{oldest - 1} of partition "
+                            f"{partition} were pruned from the event log before they could be read")
+        events = []
+        for statement in self.target.log.expand([s for s in statements if s.get("seq", 0) <= until]):
+            events += [e for e in unpack_events(statement, self.target.name) if self.partition(e) == partition]
+        logging.info(f"[CLUSTER] {self.target.name}: caught up on {len(events)} events of partition {partition} "
+                     f"after seq {after}")
+        return self.owned(events)
+
+    def tick(self) -> list:
+        """Records progress, rebalances and takes over free partitions; returns the events to catch up on."""
+        self.next_tick = time.monotonic() + self.interval
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = self.target.connect()
+                with self.conn.cursor() as cur:
+                    cur.execute(sql.SQL(PROGRESS_SQL).format(progress=self._table(PROGRESS_TABLE)))
+            with self.conn.cursor() as cur:
+                self._save(cur, list(self.held))
+                # plain --shared watchers of the set hold references too: only replicas share the work
+                refs = self._table(SHARED_REFS_TABLE)
+                cur.execute(sql.SQL("UPDATE {} SET cluster = true WHERE watcher = %s AND NOT cluster").format(refs),
+                            (self.target.watcher,))
+                cur.execute(sql.SQL("SELECT count(*) FROM {} WHERE version = %s AND cluster AND pid IN "
+                                    "(SELECT pid FROM pg_stat_activity)").format(refs),
+                            (self.target.version,))
+                share = -(-self.partitions // max(1, cur.fetchone()[0]))
+                for partition in sorted(self.held, reverse=True)[:max(0, len(self.held) - share)]:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.lock_key(partition),))
+                    del self.held[partition]
+                    logging.info(f"[CLUSTER] {self.target.name}: handed partition {partition} over")
+                events = []
+                for partition in range(self.partitions):
+                    if len(self.held) >= share:
+                        break
+                    if partition in self.held:
+                        continue
+                    cur.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_key(partition),))
+                    if cur.fetchone()[0]:
+                        role = "leader" if self.partitions == 1 else f"holder of partition {partition}"
+                        logging.info(f"[CLUSTER] {self.target.name}: now {role}")
+                        events += self._take_over(cur, partition)
+                return events
+        except psycopg2.Error as e:
+            if self.held:
+                logging.error(f"[CLUSTER] {self.target.name}: {e}; standing down from partitions {sorted(self.held)}")
+            else:
+                logging.error(f"[CLUSTER] {self.target.name}: {e}")
+            self.held.clear()  # the locks went with the session
+            if self.conn is not None:
+                self.conn.close()
+            return []
+
+    def close(self):
+        """Records the final progress and releases the partitions."""
+        if self.conn is None or self.conn.closed:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                self._save(cur, list(self.held))
+        finally:
+            self.held.clear()
+            self.conn.close()
+
+class Target:
+    """
+    One watched database: where to connect, what to watch, the names of the
+    objects installed there and the LISTEN connection held to it. Events
+    received from it are tagged with 'source' = name. The admin connection
+    is only opened for install/uninstall, so a target costs one long-lived
+    connection (plus one for the event log, opened when first needed).
+    Sequence numbers of received events are remembered, so events delivered
+    by both NOTIFY and a catch-up are only dispatched once.
+
+    By default the installed objects are private to this watcher (random
+    suffix). With shared, they are named after install_version() and
+    reference-counted (acquire_ddl / release_ddl), so watchers with the same
+    settings use one trigger set.
+    """
+
+    def __init__(self, name: str, db: Optional[str] = None, dsn: Optional[str] = None,
+                 schemas: Optional[List[str]] = None, channel: str = "ddl_changes",
+                 events: Optional[List[str]] = None, object_types: Optional[List[str]] = None,
+                 shared: bool = False):
+        self.name = name
+        self.db = db
+        self.dsn = dsn
+        self.schemas = schemas or ["public"]
+        self.channel = channel
+        self.events = events or []
+        self.object_types = object_types or []
+        self.shared = shared
+        self.watcher = uuid.uuid4().hex
+        self.version = install_version(self.schemas, channel, self.events, self.object_types)
+        # unique suffix to ensure precise cleanup, or the version of a shared set
+        suffix = f"v{self.version}" if shared else self.watcher[:12]
+        self.names = {
+            "fn_changes": f"notify_schema_changes_{suffix}",
+            "fn_drops":   f"notify_schema_drops_{suffix}",
+            "trg_ddl":    f"on_schema_ddl_{suffix}",
+            "trg_drop":   f"on_schema_drop_{suffix}",
+            "event_log":  f"schema_watch_log_{suffix}",
+        }
+        self.listen_conn = None
+        self.catalog_conn = None
+        self.log: Optional[EventLog] = None
+        self.coalescer: Optional[EventCoalescer] = None
+        self.cluster: Optional[Cluster] = None
+        self.last_seq = 0
+        self.gap = False
+        self.active = time.monotonic()
+        self.attempts = 0
+        self.seen: Set[int] = set()
+        self.seen_order = deque()
+
+    def connect(self):
+        return get_conn(self.db, self.dsn)
+
+    def install(self) -> bool:
+        """Installs the triggers; returns False if a shared set was already installed."""
+        conn = self.connect()
+        try:
+            self.names["schema"] = current_schema(conn)
+            if self.shared:
+                changed = acquire_ddl(conn, self.watcher, self.version, self.schemas, self.channel,
+                                      self.names, self.events, self.object_types)
+            else:
+                # Best-effort pre-clean (in case of same names)
+                uninstall_ddl(conn, self.names)
+                install_ddl(conn, self.schemas, self.channel, self.names, self.events, self.object_types)
+                changed = True
+        finally:
+            conn.close()
+        self.log = EventLog(self.connect, sql.Identifier(self.names["schema"], self.names["event_log"]))
+        return changed
+
+    def listen(self) -> bool:
+        """
+        LISTENs on a new connection. A shared target then (re-)registers it
+        with acquire_ddl(), which installs the set again if it was dropped
+        meanwhile; returns True in that case.
+        """
+        self.listen_conn = listen_connection(self.db, self.channel, self.dsn)
+        if not self.shared:
+            return False
+        return acquire_ddl(self.listen_conn, self.watcher, self.version, self.schemas, self.channel,
+                           self.names, self.events, self.object_types, listener=True)
+
+    def ping(self):
+        send_ping(self.db, self.channel, self.dsn)
+
+    def receive(self) -> list:
+        """Reads pending notifications; returns per-object events (DDLEvent) tagged with this target."""
+        self.listen_conn.poll()
+        self.active = time.monotonic()
+        received = []
+        while self.listen_conn.notifies:
+            n = self.listen_conn.notifies.pop(0)
+            logging.info(f"[WATCHER] Event received from {self.name} on channel: {n.channel}")
+            received.append(decode_notification(n.payload))
+        return self._unpack(received, time.time())
+
+    def probe(self) -> list:
+        """
+        Liveness probe of an idle LISTEN connection: a round-trip that raises
+        psycopg2.Error if the server is gone. Returns what arrived meanwhile.
+        """
+        with self.listen_conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        return self.receive()
+
+    def probe_due(self, interval: float) -> float:
+        """Seconds until the connection should be probed."""
+        return max(0.0, self.active + interval - time.monotonic())
+
+    def reconnect(self) -> list:
+        """
+        Re-opens a lost LISTEN connection and returns the events missed while
+        it was down: LISTEN first, so nothing committed from then on is lost,
+        then one query for everything logged after the last sequence number
+        seen. Events seen twice are dropped by sequence number. The installed
+        triggers are reused; they are only installed again if the server no
+        longer has them (e.g. after failing over to a fresh instance).
+        """
+        try:
+            self.listen_conn.close()
+        except Exception:
+            pass
+        conn = self.connect()
+        try:
+            installed = installed_ddl(conn, self.names)
+        finally:
+            conn.close()
+        if not installed:
+            logging.warning(f"[RECONNECT] {self.name}: Triggers are gone, installing them again")
+            self.log.close()
+            self.install()
+        if self.listen() and installed:
+            # the last other user dropped the shared set between the check above and registering
+            logging.warning(f"[RECONNECT] {self.name}: Shared trigger set was dropped meanwhile, installed it again")
+            installed = False
+        if not installed:
+            self.last_seq = 0
+            self.seen.clear()
+            self.seen_order.clear()
+            self.gap = True
+        self.active = time.monotonic()
+        missed, oldest = self.log.catch_up(max(0, self.last_seq - CATCHUP_OVERLAP))
+        if oldest is not None and oldest > self.last_seq + 1:
+            logging.warning(f"[RECONNECT] {self.name}: events {self.last_seq + 1}..{oldest - 1} "
+                            f"were pruned from the event log before they could be read")
+            self.gap = True
+        logging.info(f"[RECONNECT] {self.name}: LISTEN {self.channel} again, {len(missed)} logged events read")
+        return self._unpack(missed)
+
+    def _unpack(self, received: list, received_at: Optional[float] = None) -> list:
+        events = []
+        for statement in self.log.expand(self._dedupe(received)):
+            self._observe(statement, received_at)
+            events += unpack_events(statement, self.name)
+        return events
+
+    def _observe(self, data, received_at: Optional[float]):
+        """Counts the per-object events of a statement; live ones also give its notification lag."""
+        if not isinstance(data, dict):
+            return
+        objects = data.get("objects") if isinstance(data.get("objects"), list) else [data]
+        for obj in objects:
+            METRICS.inc("psql_watcher_events_received_total", source=self.name, channel=self.channel,
+                        event=data.get("event", ""), schema=obj.get("schema", ""))
+        fired = event_time(data.get("ts")) if received_at is not None else None
+        if fired is not None:
+            METRICS.observe("psql_watcher_notification_lag_seconds", max(0.0, received_at - fired),
+                            source=self.name)
+
+    def _dedupe(self, received: list) -> list:
+        fresh = []
+        for payload in received:
+            seq = payload.get("seq") if isinstance(payload, dict) else None
+            if seq is not None:
+                if seq in self.seen:
+                    continue
+                self.seen.add(seq)
+                self.seen_order.append(seq)
+                if len(self.seen_order) > EVENT_LOG_SIZE:
+                    self.seen.discard(self.seen_order.popleft())
+                self.last_seq = max(self.last_seq, seq)
+            fresh.append(payload)
+        return fresh
+
+    def uninstall(self) -> bool:
+        """
+        Drops ONLY the objects this watcher created; a shared set only when no
+        other watcher still uses it. Returns True if anything was dropped.
+        """
+        if "schema" not in self.names:
+            return False
+        conn = self.connect()
+        try:
+            if self.shared:
+                return release_ddl(conn, self.watcher, self.version, self.names)
+            uninstall_ddl(conn, self.names)
+            return True
+        finally:
+            conn.close()
+
+    def close(self):
+        for resource in (self.log, self.listen_conn, self.catalog_conn):
+            try:
+                if resource is not None:
+                    resource.close()
+            except Exception:
+                pass
+
+def resolve_overflow(payload):
+    """
+    Dispatcher resolve step: fills in parked query texts of a batch from the
+    event's target. A DDLEvent fetches its own on first access to `query`.
+    """
+    if isinstance(payload, DDLEvent) or '"query_ref"' not in payload:
+        return payload
+    target = TARGETS.get(payload_source(payload))
+    if target is None or target.log is None:
+        return payload
+    return target.log.resolve(payload)
+
+def recover(target: Target) -> list:
+    """
+    Reconnects a target and returns the events it missed. Only if the event
+    log had already pruned some of them is the snapshot store rebuilt.
+    """
+    try:
+        payloads = target.reconnect()
+    except psycopg2.Error:
+        METRICS.inc("psql_watcher_reconnects_total", source=target.name, result="error")
+        raise
+    METRICS.inc("psql_watcher_reconnects_total", source=target.name, result="ok")
+    target.attempts = 0
+    if target.gap and target.name in SNAPSHOT_STORES:
+        conn = target.connect()
+        try:
+            changed = SNAPSHOT_STORES[target.name].rebuild(conn)
+        finally:
+            conn.close()
+        logging.info(f"[RECONNECT] {target.name}: Snapshot store rebuilt ({changed} objects changed)")
+    if target.gap and target.name in RELATION_CACHES:
+        conn = target.connect()
+        try:
+            count = RELATION_CACHES[target.name].load(conn)
+        finally:
+            conn.close()
+        logging.info(f"[RECONNECT] {target.name}: Relation cache reloaded ({count} relations)")
+    target.gap = False
+    return payloads
+
+def journal_events(payloads: list) -> List[Tuple[object, Optional[List[int]]]]:
+    """
+    With --journal: appends received events to the journal and commits them
+    with a single fsync before any hook sees them. Parked query texts that a
+    hook asks for are resolved first, the event log table does not outlive
+    the watcher.
+    Returns (payload, ref) pairs for the dispatcher.
+    """
+    if JOURNAL is None:
+        return [(payload, None) for payload in payloads]
+    want = hooks_want_query()
+    if want:
+        payloads = [resolve_overflow(payload) for payload in payloads]
+    offsets = JOURNAL.append([payload_text(payload, want) for payload in payloads])
+    JOURNAL.sync()
+    return [(payload, [offset]) for payload, offset in zip(payloads, offsets)]
+
+def completion(targets: List[Target]) -> Optional[Callable[[List[int], bool], None]]:
+    """
+    done(ref, ok) callback of the dispatchers and the EventQueue: completes
+    journaled events (EventJournal.done) and the events --cluster replicas
+    track for their progress (Cluster.done). None if there is neither.
+    """
+    clusters = [t.cluster for t in targets if t.cluster is not None]
+    if JOURNAL is None and not clusters:
+        return None
+
+    def done(refs: List[int], ok: bool = True):
+        if JOURNAL is not None:
+            JOURNAL.done(refs, ok)
+        for cluster in clusters:
+            cluster.done(refs, ok)
+    return done
+
+def journal_backlog() -> Iterable[Tuple[int, str]]:
+    """Journaled events whose hooks did not complete in a previous run."""
+    if JOURNAL is None or JOURNAL.committed >= JOURNAL.next_offset:
+        return []
+    logging.warning(f"[JOURNAL] Replaying {JOURNAL.next_offset - JOURNAL.committed} events "
+                    f"from offset {JOURNAL.committed} not completed by the previous run")
+    return JOURNAL.replay(JOURNAL.committed)
+
+def split_list(value, case=None) -> List[str]:
+    """Comma-separated string (or list) -> cleaned list, optionally upper/lower-cased."""
+    if isinstance(value, str):
+        value = value.split(",")
+    items = [" ".join(str(v).split()) for v in value or [] if str(v).strip()]
+    if case == "upper":
+        items = [v.upper() for v in items]
+    elif case == "lower":
+        items = [v.lower() for v in items]
+    return items
+
+def dsn_name(dsn: str) -> str:
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return f"{params.get('host', 'local')}/{params.get('dbname', params.get('user', ''))}"
+
+def load_targets(args) -> List[Target]:
+    """
+    Targets from --config (JSON: {"targets": [{...}]} or a list), repeated
+    --db and repeated --dsn. Per-target keys: name, db, dsn, schemas,
+    channel, events, object_types, shared; missing keys fall back to the CLI options.
+    """
+    specs = []
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            data = json.load(f)
+        specs += data.get("targets", []) if isinstance(data, dict) else data
+    specs += [{"db": db} for db in args.db or []]
+    specs += [{"dsn": dsn} for dsn in args.dsn or []]
+    targets = []
+    for spec in specs:
+        if not spec.get("db") and not spec.get("dsn"):
+            raise ValueError(f"target needs 'db' or 'dsn': {spec}")
+        name = spec.get("name") or spec.get("db") or dsn_name(spec["dsn"])
+        if any(t.name == name for t in targets):
+            raise ValueError(f"duplicate target name '{name}', set 'name' in --config")
+        schemas = split_list(spec.get("schemas", args.schemas))
+        if not schemas:
+            raise ValueError(f"schemas list is empty for target '{name}'")
+        targets.append(Target(
+            name,
+            db=spec.get("db"),
+            dsn=spec.get("dsn"),
+            schemas=schemas,
+            channel=spec.get("channel", args.channel),
+            events=split_list(spec.get("events", args.events), "upper"),
+            object_types=split_list(spec.get("object_types", args.object_types), "lower"),
+            shared=bool(spec.get("shared", args.shared)) or args.cluster,
+        ))
+    return targets
+
 def handle_stop(signum, frame):
     global STOP_FLAG
     STOP_FLAG = True
 
 def parse_args():
     p = argparse.ArgumentParser(description="One-file PostgreSQL schema DDL watcher (auto-install & cleanup)")
-    p.add_argument("--db", required=True, help="Target database name (required)")
-    p.add_argument("--schemas", default="public", help="Comma-separated schemas (default: public)")
+    p.add_argument("--db", action="append", help="Target database name (repeat to watch several)")
+    p.add_argument("--dsn", action="append", help="Target libpq connection string (repeat to watch several)")
+    p.add_argument("--config", help="JSON file with a list of targets (see load_targets)")
+    p.add_argument("--schemas", default="public", help="Comma-separated schemas, '*' for all (default: public)")
+    p.add_argument("--events", default="",
+                   help="Comma-separated command tags to watch, e.g. 'CREATE TABLE,ALTER TABLE' (default: all)")
+    p.add_argument("--object-types", default="",
+                   help="Comma-separated object types to watch, e.g. 'table,index' (default: all)")
     p.add_argument("--channel", default="ddl_changes", help="NOTIFY channel name (default: ddl_changes)")
     p.add_argument("--no-ping", action="store_true", help="Do not send startup test NOTIFY")
-    return p.parse_args()
+    p.add_argument("--shared", action="store_true",
+                   help="Share one versioned trigger set with other watchers of the same settings "
+                        "(reference counted, kept while any of them runs) instead of a private one")
+    p.add_argument("--cluster", action="store_true",
+                   help="Run as one of several replicas of this watcher (implies --shared): replicas elect "
+                        "a leader through an advisory lock and only the leader runs hooks")
+    p.add_argument("--cluster-partitions", type=int, default=1,
+                   help="Split hook work of --cluster into this many partitions, spread over the replicas "
+                        "(default: 1, a single leader)")
+    p.add_argument("--cluster-partition-by", choices=("schema", "object"), default="schema",
+                   help="Partition events by a hash of their schema or of schema.object (default: schema)")
+    p.add_argument("--cluster-interval", type=float, default=2,
+                   help="Seconds between leadership checks of --cluster; bounds the takeover time (default: 2)")
+    p.add_argument("--workers", type=int, default=4, help="Number of hook workers (default: 4)")
+    p.add_argument("--queue-size", type=int, default=1000,
+                   help="Max events held in memory between LISTEN and the hooks before events spill "
+                        "(--spill-dir) or LISTEN intake waits; per worker with --replay-from "
+                        "(default: 1000)")
+    p.add_argument("--spill-dir", metavar="DIR",
+                   help="Spill events to files in DIR when the in-memory queue is full instead of "
+                        "pausing LISTEN intake")
+    p.add_argument("--low-value", default='{"schema": "pg_temp"}', metavar="JSON",
+                   help="Match predicates (as in --hooks) of low-value events, shed first when the queue "
+                        "is full ('' for none; default: temp objects, {\"schema\": \"pg_temp\"})")
+    p.add_argument("--low-value-policy", choices=("coalesce", "drop", "keep"), default="coalesce",
+                   help="What happens to low-value events when the queue is full: replace the queued "
+                        "event of the same object, drop them, or queue them like any other "
+                        "(default: coalesce)")
+    p.add_argument("--bulk-tags", default="CREATE INDEX,REINDEX",
+                   help="Command tags queued in the lowest-priority lane, behind everything else "
+                        "(default: CREATE INDEX,REINDEX)")
+    p.add_argument("--pool", choices=("thread", "process"), default="thread",
+                   help="Run hooks in worker threads or in a process pool (default: thread)")
+    p.add_argument("--engine", choices=("select", "asyncio"), default="select",
+                   help="Blocking select loop with hook worker threads, or an asyncio event loop "
+                        "that also awaits 'async def' hooks (default: select)")
+    p.add_argument("--concurrency", type=int, default=100,
+                   help="Max hooks running at once with --engine asyncio (default: 100)")
+    p.add_argument("--hooks", metavar="FILE",
+                   help="JSON file with hooks and their match predicates; replaces script.py / script.sh "
+                        "(see load_hooks)")
+    p.add_argument("--snapshot", metavar="PATH",
+                   help="Write a schema snapshot (schema.sql layout) to PATH after every hook run, "
+                        "read directly from the catalogs ('{source}' in PATH is the target name); "
+                        "replaces the default ./script.sh hook")
+    p.add_argument("--snapshot-dir", metavar="DIR",
+                   help="Keep a content-addressed snapshot history in DIR; each event re-reads only the "
+                        "affected objects and their direct dependents and stores a version of what changed")
+    p.add_argument("--diff", action="store_true",
+                   help="Cache the shape of every relation in memory and attach a structured diff "
+                        "(columns, defaults, constraints, indexes) of the affected relation to each event")
+    p.add_argument("--debounce", type=float, default=0,
+                   help="Coalesce events and run hooks once per batch after this many quiet seconds "
+                        "(default: 0, hooks run once per event)")
+    p.add_argument("--debounce-max", type=float, default=10,
+                   help="Max seconds a batch is held back during continuous DDL activity (default: 10)")
+    p.add_argument("--debounce-max-events", type=int, default=1000,
+                   help="Release a batch once it holds this many events (default: 1000)")
+    p.add_argument("--debounce-max-bytes", type=int, default=1 << 20,
+                   help="Release a batch once its JSON reaches about this many bytes (default: 1048576)")
+    p.add_argument("--probe-interval", type=float, default=10,
+                   help="Probe a LISTEN connection after this many idle seconds (default: 10)")
+    p.add_argument("--event-log-size", type=int, default=EVENT_LOG_SIZE,
+                   help=f"Rows kept in the server-side event log used to catch up after a lost "
+                        f"connection (default: {EVENT_LOG_SIZE})")
+    p.add_argument("--journal", metavar="DIR",
+                   help="Append every received event to an on-disk journal in DIR before its hooks run")
+    p.add_argument("--journal-consumer", default="hooks",
+                   help="Name the journal offset of this watcher is stored under (default: hooks)")
+    p.add_argument("--journal-segment-mb", type=float, default=64,
+                   help="Rotate journal segments at this size in MB (default: 64)")
+    p.add_argument("--journal-keep", type=int, default=0,
+                   help="Keep at most this many journal segments, 0 keeps all (default: 0)")
+    p.add_argument("--journal-retries", type=int, default=3,
+                   help="Retry the hooks of a journaled event this many times before recording it "
+                        "as failed (default: 3)")
+    p.add_argument("--replay-from", metavar="OFFSET",
+                   help="Re-run hooks for journaled events from OFFSET ('committed' for the stored "
+                        "consumer offset, 'failed' for the events recorded as failed) and exit")
+    p.add_argument("--source", metavar="FILE",
+                   help="Feed hooks from an NDJSON file of notifications, or 'synthetic' generated ones, "
+                        "instead of a database; reports hook throughput and latency, then exits")
+    p.add_argument("--source-rate", type=float, default=0,
+                   help="Statements per second fed by --source (default: 0, as fast as possible)")
+    p.add_argument("--source-count", type=int, default=10000,
+                   help="Statements generated by --source synthetic (default: 10000)")
+    p.add_argument("--source-seed", type=int, help="Random seed of --source synthetic")
+    p.add_argument("--metrics-port", type=int, default=0,
+                   help="Serve Prometheus metrics on http://HOST:PORT/metrics (default: 0, off); "
+                        "not supported with --pool process")
+    p.add_argument("--metrics-host", default="127.0.0.1",
+                   help="Address the metrics endpoint binds to (default: 127.0.0.1)")
+    args = p.parse_args()
+    if args.replay_from is not None:
+        if not args.journal:
+            p.error("--replay-from requires --journal")
+        if args.replay_from not in ("committed", "failed") and not args.replay_from.isdigit():
+            p.error("--replay-from takes an offset, 'committed' or 'failed'")
+    elif args.source is not None:
+        if args.journal:
+            p.error("--source cannot be combined with --journal")
+    elif not (args.db or args.dsn or args.config):
+        p.error("at least one of --db, --dsn or --config is required")
+    if args.engine == "asyncio" and args.pool == "process":
+        p.error("--pool process is not supported with --engine asyncio")
+    if args.low_value:
+        try:
+            Hook("low-value", match=json.loads(args.low_value))
+        except (ValueError, AttributeError) as e:
+            p.error(f"--low-value: {e}")
+    if args.cluster and args.cluster_partitions < 1:
+        p.error("--cluster-partitions must be at least 1")
+    if args.diff and args.pool == "process":
+        p.error("--diff is not supported with --pool process")
+    if args.metrics_port and args.pool == "process":
+        p.error("--metrics-port is not supported with --pool process")
+    return args
+
+def start_targets(targets: List[Target], args) -> List[Target]:
+    """Installs triggers, syncs the snapshot store, LISTENs and pings; returns the targets now listening."""
+    watching = []
+    for t in targets:
+        try:
+            logging.info(f"[DEBUG] {t.name}: Creating triggers...")
+            if t.install():
+                logging.info(f"[OK] {t.name}: Installed event triggers & functions")
+            else:
+                logging.info(f"[OK] {t.name}: Shared trigger set v{t.version} already installed, reusing it")
+            if args.snapshot_dir:
+                store = schema_snapshot.ObjectStore(target_path(args.snapshot_dir, t.name))
+                conn = t.connect()
+                try:
+                    changed = store.rebuild(conn)
+                finally:
+                    conn.close()
+                SNAPSHOT_STORES[t.name] = store
+                logging.info(f"[INIT] {t.name}: Snapshot store {store.path} synced "
+                             f"({changed} objects changed, version {store.version})")
+            if args.diff:
+                cache = schema_snapshot.RelationCache(None if "*" in t.schemas else t.schemas)
+                t.catalog_conn = t.connect()
+                count = cache.load(t.catalog_conn)
+                RELATION_CACHES[t.name] = cache
+                logging.info(f"[INIT] {t.name}: Relation cache loaded ({count} relations)")
+            t.listen()
+            logging.info(f"[OK] {t.name}: LISTEN {t.channel}")
+            if args.cluster:
+                t.cluster = Cluster(t, args.cluster_partitions, args.cluster_partition_by, args.cluster_interval)
+                logging.info(f"[INIT] {t.name}: Cluster replica {t.watcher[:12]}, {t.cluster.partitions} "
+                             f"partition(s) by {args.cluster_partition_by}")
+            if not args.no_ping:
+                t.ping()
+                logging.info(f"[OK] {t.name}: Sent startup ping")
+            watching.append(t)
+        except psycopg2.Error as e:
+            logging.error(f"[DB ERROR] {t.name}: {e}")
+    return watching
+
+def watch_select(targets: List[Target], args) -> None:
+    """
+    Blocking engine: one selector multiplexes the LISTEN connections of all
+    targets and hooks run on HookDispatcher threads, fed by a feeder thread
+    from the bounded EventQueue the loop fills. Idle connections are probed
+    every --probe-interval seconds; a lost one is recovered with jittered
+    exponential backoff.
+    """
+    selector = selectors.DefaultSelector()
+    for t in targets:
+        selector.register(t.listen_conn, selectors.EVENT_READ, t)
+    done = completion(targets)
+    dispatcher = HookDispatcher(run_hook, workers=args.workers, queue_size=DISPATCH_WINDOW,
+                                pool=args.pool, resolve=resolve_overflow if hooks_want_query() else None,
+                                done=done, warn=False, retries=args.journal_retries if JOURNAL is not None else 0)
+    equeue = event_queue(args, done)
+    METRICS.gauge("psql_watcher_queue_depth", lambda: equeue.depth() + dispatcher.depth())
+
+    def flush(target: Target, force: bool = False):
+        batch = target.coalescer.ready(force) if target.coalescer is not None else None
+        if batch:
+            payload, count, refs = batch
+            logging.info(f"[WATCHER] Dispatching batch of {count} events from {target.name}")
+            equeue.put(BATCH_KEY + target.name, payload, refs or None)
+
+    def dispatch(target: Target, payloads: list):
+        if target.cluster is not None:
+            payloads = target.cluster.owned(payloads)
+        payloads = attach_diffs(target, payloads)
+        items = journal_events(payloads)
+        if target.cluster is not None:
+            items = target.cluster.track(items)
+        for payload, ref in items:
+            if target.coalescer is not None and target.coalescer.add(payload, ref):
+                flush(target)
+                continue
+            equeue.put(event_key(payload), payload, ref)
+
+    lost: Dict[str, float] = {}  # target name -> time of the next reconnect attempt
+
+    def lose(target: Target, error: psycopg2.Error):
+        logging.error(f"[DB ERROR] {target.name}: {error}")
+        selector.unregister(target.listen_conn)
+        lost[target.name] = time.monotonic()
+    dispatcher.start()
+    feeder = start_feeder(equeue, dispatcher)
+    logging.info(f"[INIT] Hook workers: {args.workers} ({args.pool}), queue size: {args.queue_size}"
+                 f"{f', spilling to {args.spill_dir}' if args.spill_dir else ''}")
+    try:
+        for offset, payload in journal_backlog():
+            equeue.put(event_key(payload), payload, [offset])
+        logging.info(f"[WATCHER] Listening for DDL events on {len(selector.get_map())} target(s)...")
+        while not STOP_FLAG:
+            for target in targets:
+                if target.cluster is not None and target.cluster.due() == 0:
+                    dispatch(target, target.cluster.tick())
+            watched = [key.data for key in selector.get_map().values()]
+            timeouts = [t.coalescer.timeout(args.probe_interval) for t in targets if t.coalescer is not None]
+            timeouts += [t.cluster.due() for t in targets if t.cluster is not None]
+            timeouts += [t.probe_due(args.probe_interval) for t in watched]
+            timeouts += [max(0.0, due - time.monotonic()) for due in lost.values()]
+            ready = selector.select(min(timeouts or [args.probe_interval]))
+            for key, _ in ready:
+                target = key.data
+                try:
+                    payloads = target.receive()
+                except psycopg2.Error as e:
+                    lose(target, e)
+                    continue
+                dispatch(target, payloads)
+            for target in watched:
+                if target.name in lost or target.probe_due(args.probe_interval) > 0:
+                    continue
+                try:
+                    payloads = target.probe()
+                except psycopg2.Error as e:
+                    lose(target, e)
+                    continue
+                dispatch(target, payloads)
+            for name, due in list(lost.items()):
+                if STOP_FLAG or due > time.monotonic():
+                    continue
+                target = TARGETS[name]
+                try:
+                    payloads = recover(target)
+                except psycopg2.Error as e:
+                    target.attempts += 1
+                    delay = backoff(target.attempts)
+                    logging.error(f"[RECONNECT] {name}: {e}; retrying in {delay:.1f}s")
+                    lost[name] = time.monotonic() + delay
+                    continue
+                del lost[name]
+                selector.register(target.listen_conn, selectors.EVENT_READ, target)
+                dispatch(target, payloads)
+            for target in targets:
+                if target.name not in lost:
+                    target.log.prune()  # throttled on its own monotonic clock
+                flush(target)
+            if JOURNAL is not None:
+                JOURNAL.sync()
+    finally:
+        for t in targets:
+            flush(t, force=True)
+        equeue.close()
+        feeder.join()
+        dispatcher.stop()
+        equeue.remove()
+        logging.info("[CLEANUP] Hook workers stopped")
+        selector.close()
+
+async def watch_async(targets: List[Target], args) -> None:
+    """
+    asyncio engine: every LISTEN socket is watched with loop.add_reader() and
+    drained by its own task into the bounded EventQueue; a feeder task hands
+    its events to AsyncHookDispatcher, sync hooks run on a pool of --workers
+    threads. Idle connections are probed every
+    --probe-interval seconds; lost ones are recovered with jittered
+    exponential backoff. Probes, recovery, pruning and --diff run on a
+    separate pool with a thread per target, so they never wait behind hooks;
+    cluster heartbeats get a pool of their own for the same reason.
+    """
+    global ASYNC_HOOKS
+    ASYNC_HOOKS = True
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="hook-worker"))
+    control = ThreadPoolExecutor(max_workers=max(1, len(targets)), thread_name_prefix="watch-control")
+    heartbeat = ThreadPoolExecutor(max_workers=max(1, sum(t.cluster is not None for t in targets)),
+                                   thread_name_prefix="cluster-heartbeat")
+    done = completion(targets)
+    dispatcher = AsyncHookDispatcher(run_hook_async, concurrency=args.concurrency,
+                                     queue_size=2 * args.concurrency,
+                                     resolve=resolve_overflow if hooks_want_query() else None,
+                                     done=done, warn=False,
+                                     retries=args.journal_retries if JOURNAL is not None else 0)
+    equeue = event_queue(args, done)
+    METRICS.gauge("psql_watcher_queue_depth", lambda: equeue.depth() + dispatcher.depth())
+    put = functools.partial(put_async, equeue)
+    wakeups = {t.name: asyncio.Event() for t in targets}
+
+    def request_stop():
+        handle_stop(None, None)
+        for wakeup in wakeups.values():
+            wakeup.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, request_stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # no loop signal support (Windows): handle_stop still sets STOP_FLAG
+
+    async def flush(target: Target, force: bool = False):
+        batch = target.coalescer.ready(force) if target.coalescer is not None else None
+        if batch:
+            payload, count, refs = batch
+            logging.info(f"[WATCHER] Dispatching batch of {count} events from {target.name}")
+            await put(BATCH_KEY + target.name, payload, refs or None)
+
+    async def sleep(target: Target, seconds: float):
+        try:
+            await asyncio.wait_for(wakeups[target.name].wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def reconnect(target: Target) -> Optional[list]:
+        while not STOP_FLAG:
+            try:
+                return await loop.run_in_executor(control, recover, target)
+            except psycopg2.Error as e:
+                target.attempts += 1
+                delay = backoff(target.attempts)
+                logging.error(f"[RECONNECT] {target.name}: {e}; retrying in {delay:.1f}s")
+                await sleep(target, delay)
+        return None
+
+    async def watch(target: Target):
+        wakeup = wakeups[target.name]
+        fd = target.listen_conn.fileno()
+        loop.add_reader(fd, wakeup.set)
+        try:
+            while not STOP_FLAG:
+                caught_up = []
+                if target.cluster is not None and target.cluster.due() == 0:
+                    caught_up = await loop.run_in_executor(heartbeat, target.cluster.tick)
+                timeout = target.probe_due(args.probe_interval)
+                if target.coalescer is not None:
+                    timeout = target.coalescer.timeout(timeout)
+                if target.cluster is not None:
+                    timeout = min(timeout, target.cluster.due())
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                    woken = True
+                except asyncio.TimeoutError:
+                    woken = False
+                    await loop.run_in_executor(control, target.log.prune)
+                wakeup.clear()
+                if STOP_FLAG:
+                    break
+                try:
+                    if woken or target.probe_due(args.probe_interval) > 0:
+                        payloads = target.receive()
+                    else:
+                        payloads = await loop.run_in_executor(control, target.probe)
+                except psycopg2.Error as e:
+                    logging.error(f"[DB ERROR] {target.name}: {e}")
+                    loop.remove_reader(fd)
+                    payloads = await reconnect(target)
+                    if payloads is None:
+                        break
+                    fd = target.listen_conn.fileno()
+                    loop.add_reader(fd, wakeup.set)
+                if target.cluster is not None:
+                    payloads = caught_up + target.cluster.owned(payloads)
+                if target.name in RELATION_CACHES:
+                    payloads = await loop.run_in_executor(control, attach_diffs, target, payloads)
+                items = journal_events(payloads)
+                if target.cluster is not None:
+                    items = target.cluster.track(items)
+                for payload, ref in items:
+                    if target.coalescer is not None and target.coalescer.add(payload, ref):
+                        await flush(target)
+                        continue
+                    await put(event_key(payload), payload, ref)
+                await flush(target)
+                if JOURNAL is not None:
+                    JOURNAL.sync()
+        finally:
+            loop.remove_reader(fd)
+
+    logging.info(f"[INIT] asyncio engine: {args.concurrency} concurrent hooks, "
+                 f"{args.workers} threads for sync hooks, queue size: {args.queue_size}")
+    logging.info(f"[WATCHER] Listening for DDL events on {len(targets)} target(s)...")
+    feeder = asyncio.ensure_future(feed_async(equeue, dispatcher))
+    try:
+        for offset, payload in journal_backlog():
+            await put(event_key(payload), payload, [offset])
+        await asyncio.gather(*(watch(t) for t in targets))
+    finally:
+        for t in targets:
+            await flush(t, force=True)
+        equeue.close()
+        await feeder
+        await dispatcher.stop()
+        equeue.remove()
+        control.shutdown(wait=False)
+        heartbeat.shutdown(wait=False)
+        logging.info("[CLEANUP] Hook workers stopped")
+
+def replay(args) -> bool:
+    """
+    --replay-from: re-runs the hooks for journaled events from an offset, or
+    for the events recorded as failed, then exits. Failed events that now
+    succeed (or were not reached) are taken off the failed list.
+    """
+    failed = JOURNAL.failed_offsets() if args.replay_from == "failed" else None
+    if failed is not None:
+        start = min(failed, default=JOURNAL.next_offset)
+    else:
+        start = JOURNAL.committed if args.replay_from == "committed" else int(args.replay_from)
+    dispatcher = HookDispatcher(run_hook, workers=args.workers, queue_size=args.queue_size,
+                                pool=args.pool, done=JOURNAL.done, retries=args.journal_retries)
+    dispatcher.start()
+    replayed = set()
+    try:
+        for offset, payload in JOURNAL.replay(start, set(failed) if failed is not None else None):
+            if STOP_FLAG:
+                break
+            dispatcher.submit(event_key(payload), payload, [offset])
+            replayed.add(offset)
+    finally:
+        dispatcher.stop()
+        if failed is not None:
+            JOURNAL.set_failed((set(failed) - replayed) | JOURNAL.failed)
+    logging.info(f"[JOURNAL] Replayed {len(replayed)} events from offset {start}, {len(JOURNAL.failed)} failed")
+    return not JOURNAL.failed
+
+# Statement mix of the synthetic source: (command tag, sql_drop?, objects per statement)
+SYNTHETIC_STATEMENTS = (
+    ("CREATE TABLE", False, ("table", "sequence", "index")),
+    ("ALTER TABLE", False, ("table",)),
+    ("CREATE INDEX", False, ("index",)),
+    ("ALTER TABLE", False, ("table",)),
+    ("DROP TABLE", True, ("table", "sequence", "index", "type", "type")),
+)
+
+def synthetic_payloads(count: int, seed: Optional[int] = None) -> Iterable[str]:
+    """
+    Statement-level NOTIFY payloads shaped like the triggers' ones, for
+    --source synthetic: a fixed mix of CREATE/ALTER/DROP statements on
+    `count` statements, with 'ts' taken when each payload is produced.
+    """
+    rng = random.Random(seed)
+    objid = itertools.count(100000)
+    for seq in range(1, count + 1):
+        tag, dropped, types = SYNTHETIC_STATEMENTS[(seq - 1) % len(SYNTHETIC_STATEMENTS)]
+        table = f"synthetic_{rng.randrange(1000)}"
+        objects = [{
+            "schema": "public",
+            "object": f"public.{table}" if kind == "table" else f"public.{table}_{kind}",
+            "object_type": kind,
+            "classid": 1247 if kind == "type" else 1259,
+            "objid": next(objid),
+        } for kind in types]
+        yield json.dumps({
+            "seq": seq,
+            "event": tag,
+            "command_tag": tag,
+            "trigger": "sql_drop" if dropped else "ddl_command_end",
+            "username": "synthetic",
+            "txid": 1000000 + seq,
+            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + " UTC",
+            "query": f"{tag} public.{table}" + (" CASCADE" if dropped else ""),
+            "objects": objects,
+        })
+
+def file_payloads(path: str) -> Iterable[str]:
+    """
+    NOTIFY payloads from an NDJSON file, one per line: raw notifications as
+    sent by the triggers, per-object hook payloads, or journal records
+    ({"offset": ..., "payload": ...}).
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line
+                continue
+            if isinstance(record, dict) and isinstance(record.get("payload"), str) and "event" not in record:
+                yield record["payload"]
+            else:
+                yield line
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class SourceStats:
+    """
+    Hook throughput and latency of a --source run: every event is stamped
+    when it is fed to the dispatcher, and the dispatcher's done() callback
+    gives its completion time (for a batch, that of every event in it) and
+    whether its hooks failed (run_hook raised).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.fed: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.failed = 0
+        self.statements = 0
+        self.started = time.monotonic()
+
+    def feed(self, payloads: list) -> List[Tuple[object, List[int]]]:
+        now = time.monotonic()
+        items = []
+        with self.lock:
+            self.statements += 1
+            for payload in payloads:
+                ref = next(self.ids)
+                self.fed[ref] = now
+                items.append((payload, [ref]))
+        return items
+
+    def done(self, refs: List[int], ok: bool):
+        now = time.monotonic()
+        with self.lock:
+            for ref in refs:
+                self.latencies.append(now - self.fed.pop(ref, now))
+            if not ok:
+                self.failed += len(refs)
+
+    def report(self, name: str):
+        elapsed = time.monotonic() - self.started
+        done = len(self.latencies)
+        log = logging.warning if self.failed else logging.info
+        log(f"[SOURCE] {name}: {self.statements} statements, {done} events in {elapsed:.2f}s "
+            f"({done / elapsed if elapsed else 0:.1f} events/s), {self.failed} failed, "
+            f"{len(self.fed)} unfinished")
+        if done:
+            logging.info(f"[SOURCE] {name}: hook latency p50 {percentile(self.latencies, 50) * 1000:.2f}ms "
+                         f"p95 {percentile(self.latencies, 95) * 1000:.2f}ms "
+                         f"p99 {percentile(self.latencies, 99) * 1000:.2f}ms "
+                         f"max {max(self.latencies) * 1000:.2f}ms")
+
+def source_payloads(args) -> Tuple[str, Iterable[str]]:
+    """(source name, NOTIFY payloads) of --source."""
+    if args.source == "synthetic":
+        return "synthetic", synthetic_payloads(args.source_count, args.source_seed)
+    return os.path.basename(args.source), file_payloads(args.source)
+
+def run_source(args) -> bool:
+    """
+    --source: feeds recorded or synthetic notifications through the same
+    unpack / coalesce / dispatch steps as the LISTEN loop of --engine select,
+    without a database, and reports hook throughput and latency. Returns
+    False (exit code 1) if the hooks of any event failed.
+    """
+    name, payloads = source_payloads(args)
+    coalescer = EventCoalescer(args.debounce, args.debounce_max, args.debounce_max_events,
+                               args.debounce_max_bytes) if args.debounce > 0 else None
+    stats = SourceStats()
+    dispatcher = HookDispatcher(run_hook, workers=args.workers, queue_size=DISPATCH_WINDOW,
+                                pool=args.pool, resolve=resolve_overflow, done=stats.done, warn=False)
+    equeue = event_queue(args, stats.done)
+    METRICS.gauge("psql_watcher_queue_depth", lambda: equeue.depth() + dispatcher.depth())
+
+    def flush(force: bool = False):
+        batch = coalescer.ready(force) if coalescer is not None else None
+        if batch:
+            payload, _, refs = batch
+            equeue.put(BATCH_KEY + name, payload, refs or None)
+
+    dispatcher.start()
+    feeder = start_feeder(equeue, dispatcher)
+    logging.info(f"[SOURCE] Feeding {name} to {args.workers} hook workers ({args.pool}), "
+                 f"rate: {args.source_rate or 'unlimited'}")
+    try:
+        for n, payload in enumerate(payloads):
+            # --source-rate: wait for this statement's slot, releasing due batches meanwhile
+            while not STOP_FLAG and args.source_rate > 0:
+                delay = stats.started + n / args.source_rate - time.monotonic()
+                if delay <= 0:
+                    break
+                time.sleep(coalescer.timeout(delay) if coalescer is not None else delay)
+                flush()
+            if STOP_FLAG:
+                break
+            for event, ref in stats.feed(unpack_events(decode_notification(payload), name)):
+                if coalescer is not None and coalescer.add(event, ref):
+                    flush()
+                    continue
+                equeue.put(event_key(event), event, ref)
+            flush()
+        flush(force=True)
+    finally:
+        equeue.close()
+        feeder.join()
+        dispatcher.stop(timeout=None)
+        equeue.remove()
+        stats.report(name)
+    return not stats.failed
+
+async def run_source_async(args) -> bool:
+    """--source with --engine asyncio: the same feed through AsyncHookDispatcher."""
+    global ASYNC_HOOKS
+    ASYNC_HOOKS = True
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="hook-worker"))
+    name, payloads = source_payloads(args)
+    coalescer = EventCoalescer(args.debounce, args.debounce_max, args.debounce_max_events,
+                               args.debounce_max_bytes) if args.debounce > 0 else None
+    stats = SourceStats()
+    dispatcher = AsyncHookDispatcher(run_hook_async, concurrency=args.concurrency,
+                                     queue_size=2 * args.concurrency,
+                                     resolve=resolve_overflow if hooks_want_query() else None,
+                                     done=stats.done, warn=False)
+    equeue = event_queue(args, stats.done)
+    METRICS.gauge("psql_watcher_queue_depth", lambda: equeue.depth() + dispatcher.depth())
+    put = functools.partial(put_async, equeue)
+
+    async def flush(force: bool = False):
+        batch = coalescer.ready(force) if coalescer is not None else None
+        if batch:
+            payload, _, refs = batch
+            await put(BATCH_KEY + name, payload, refs or None)
+
+    logging.info(f"[SOURCE] Feeding {name} to the asyncio engine ({args.concurrency} concurrent hooks), "
+                 f"rate: {args.source_rate or 'unlimited'}")
+    feeder = asyncio.ensure_future(feed_async(equeue, dispatcher))
+    try:
+        for n, payload in enumerate(payloads):
+            while not STOP_FLAG and args.source_rate > 0:
+                delay = stats.started + n / args.source_rate - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(coalescer.timeout(delay) if coalescer is not None else delay)
+                await flush()
+            if STOP_FLAG:
+                break
+            for event, ref in stats.feed(unpack_events(decode_notification(payload), name)):
+                if coalescer is not None and coalescer.add(event, ref):
+                    await flush()
+                    continue
+                await put(event_key(event), event, ref)
+            await flush()
+        await flush(force=True)
+    finally:
+        equeue.close()
+        await feeder
+        await dispatcher.stop(timeout=None)
+        equeue.remove()
+        stats.report(name)
+    return not stats.failed
 
 def main():
+    global SNAPSHOT_PATH, JOURNAL, EVENT_LOG_SIZE, HOOKS
     args = parse_args()
 
-    schemas = [s.strip() for s in args.schemas.split(",") if s.strip()]
-    if not schemas:
-        logging.error("[FATAL] schemas list is empty")
+    try:
+        targets = load_targets(args)
+    except (OSError, ValueError) as e:
+        logging.error(f"[FATAL] {e}")
         sys.exit(1)
-
-    # unique suffix to ensure precise cleanup
-    suffix = uuid.uuid4().hex[:12]
-    names = {
-        "fn_changes": f"notify_schema_changes_{suffix}",
-        "fn_drops":   f"notify_schema_drops_{suffix}",
-        "trg_ddl":    f"on_schema_ddl_{suffix}",
-        "trg_drop":   f"on_schema_drop_{suffix}",
-    }
+    TARGETS.update((t.name, t) for t in targets)
+    SNAPSHOT_PATH = args.snapshot
+    EVENT_LOG_SIZE = args.event_log_size
 
     signal.signal(signal.SIGINT, handle_stop)
     signal.signal(signal.SIGTERM, handle_stop)
 
-    logging.info(f"[INIT] DB={args.db} CHANNEL={args.channel} SCHEMAS={schemas}")
-    logging.info(f"[INIT] Objects: {names}")
+    try:
+        hooks = load_hooks(args.hooks) if args.hooks else default_hooks(snapshot=bool(args.snapshot))
+    except (OSError, ValueError, ImportError, AttributeError) as e:
+        logging.error(f"[FATAL] Cannot load hooks: {e}")
+        sys.exit(1)
+    HOOKS = HookRegistry(hooks + entry_point_hooks())
+    logging.info(f"[INIT] Hooks: {[h.name for h in HOOKS.hooks] or 'none'} "
+                 f"({len(HOOKS.table)} dispatch table entries)")
+
+    if args.journal:
+        JOURNAL = EventJournal(args.journal, consumer=args.journal_consumer,
+                               segment_size=int(args.journal_segment_mb * 1024 * 1024),
+                               keep=args.journal_keep)
+        logging.info(f"[INIT] Journal {args.journal}: offset {JOURNAL.committed} of {JOURNAL.next_offset} "
+                     f"(consumer '{JOURNAL.consumer}')")
+    if args.replay_from is not None:
+        try:
+            ok = replay(args)
+        finally:
+            for hook in HOOKS.hooks:
+                hook.close()
+            JOURNAL.close()
+        sys.exit(0 if ok else 1)
+
+    metrics = None
+    if args.metrics_port:
+        try:
+            metrics = serve_metrics(args.metrics_host, args.metrics_port)
+        except OSError as e:
+            logging.error(f"[FATAL] Cannot serve metrics on {args.metrics_host}:{args.metrics_port}: {e}")
+            sys.exit(1)
+        logging.info(f"[INIT] Metrics: http://{args.metrics_host}:{args.metrics_port}/metrics")
+    if args.source is not None:
+        try:
+            if args.engine == "asyncio":
+                ok = asyncio.run(run_source_async(args))
+            else:
+                ok = run_source(args)
+        except OSError as e:
+            logging.error(f"[FATAL] Cannot read {args.source}: {e}")
+            ok = False
+        finally:
+            for hook in HOOKS.hooks:
+                hook.close()
+            if metrics is not None:
+                metrics.shutdown()
+                metrics.server_close()
+        sys.exit(0 if ok else 1)
 
-    admin_conn = None
-    listen_conn = None
+    for t in targets:
+        logging.info(f"[INIT] {t.name}: CHANNEL={t.channel} SCHEMAS={t.schemas}")
+        logging.info(f"[INIT] {t.name}: EVENTS={t.events or 'all'} OBJECT_TYPES={t.object_types or 'all'}")
+        logging.info(f"[INIT] {t.name}: Objects: {t.names}")
+        if args.debounce > 0:
+            t.coalescer = EventCoalescer(args.debounce, args.debounce_max, args.debounce_max_events,
+                                         args.debounce_max_bytes)
+    if args.debounce > 0:
+        logging.info(f"[INIT] Coalescing events: quiet window {args.debounce}s, "
+                     f"max wait {max(args.debounce, args.debounce_max)}s, "
+                     f"max {args.debounce_max_events} events / {args.debounce_max_bytes} bytes per batch")
 
     try:
-        logging.info("[DEBUG] Connecting to database...")
-        admin_conn = get_conn(args.db)
-        logging.info("[DEBUG] Connection successful!")
-
-        # Best-effort pre-clean (in case of same names)
-        logging.info("[DEBUG] Removing old triggers...")
-        uninstall_ddl(admin_conn, names)
-        logging.info("[DEBUG] Old triggers removed!")
-
-        # Install objects
-        logging.info("[DEBUG] Creating new triggers...")
-        install_ddl(admin_conn, schemas, args.channel, names)
-        logging.info("[DEBUG] Triggers created!")
-        logging.info("[OK] Installed event triggers & functions")
-
-        # Start listening
-        listen_conn = listen_connection(args.db, args.channel)
-        logging.info(f"[OK] LISTEN {args.channel}")
-
-        if not args.no_ping:
-            send_ping(args.db, args.channel)
-            logging.info("[OK] Sent startup ping")
-
-        # Event loop
-        logging.info("[WATCHER] Listening for DDL events...")
-        while not STOP_FLAG:
-            r, _, _ = select.select([listen_conn], [], [], 30)
-            if not r:
-                continue
-            listen_conn.poll()
-            while listen_conn.notifies:
-                n = listen_conn.notifies.pop(0)
-                logging.info(f"[WATCHER] Event received on channel: {n.channel}")
-                try:
-                    run_hook(n.payload)
-                except Exception as e:
-                    logging.error(f"[WATCHER ERROR] Hook failed: {e}")
+        # Install objects and start listening, per target
+        watching = start_targets(targets, args)
+        if not watching:
+            logging.error("[FATAL] No target could be watched")
+            sys.exit(2)
 
-    except psycopg2.Error as e:
-        logging.error(f"[DB ERROR] {e}")
-        sys.exit(2)
+        if args.engine == "asyncio":
+            asyncio.run(watch_async(watching, args))
+        else:
+            watch_select(watching, args)
 
     finally:
-        # Cleanup ONLY objects we created
-        try:
-            if admin_conn is None:
-                admin_conn = get_conn(args.db)
-            uninstall_ddl(admin_conn, names)
-            logging.info("[CLEANUP] Dropped created triggers & functions")
-        except Exception as e:
-            logging.warning(f"[CLEANUP WARN] {e}")
-        finally:
-            try:
-                if listen_conn is not None:
-                    listen_conn.close()
-            except Exception as e:
-                pass
+        for t in targets:
+            if t.cluster is not None:
+                try:
+                    t.cluster.close()
+                except Exception as e:
+                    logging.warning(f"[CLEANUP WARN] {t.name}: {e}")
+            # Cleanup ONLY objects we created
             try:
-                if admin_conn is not None:
-                    admin_conn.close()
+                if t.uninstall():
+                    logging.info(f"[CLEANUP] {t.name}: Dropped created triggers & functions")
+                elif "schema" in t.names:
+                    logging.info(f"[CLEANUP] {t.name}: Shared trigger set v{t.version} still in use, kept")
             except Exception as e:
-                pass
+                logging.warning(f"[CLEANUP WARN] {t.name}: {e}")
+            finally:
+                t.close()
+        for hook in HOOKS.hooks:
+            hook.close()
+        if JOURNAL is not None:
+            JOURNAL.close()
+        if metrics is not None:
+            metrics.shutdown()
+            metrics.server_close()
         logging.info("[BYE] stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,980 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL schema snapshot engine:
+- Reads the system catalogs (pg_class, pg_attribute, pg_constraint, pg_index,
+  pg_inherits, pg_type, pg_enum, pg_range, pg_proc, pg_trigger, pg_sequence,
+  views, roles, ACLs, extensions, settings)
+  over ONE connection inside one REPEATABLE READ transaction
+- Emits the same sections as script.sh's schema.sql, without running pg_dump
+- Used by psql-watcher.py (--snapshot) and by script.sh
+- ObjectStore keeps the snapshot history content-addressed: the DDL of each
+  (classid, objid) is stored compressed once per distinct content, and each
+  version is a manifest of the changed hashes linked to its event (txid, ts).
+  It refreshes only changed objects and their direct dependents
+  (psql-watcher.py --snapshot-dir)
+- RelationCache keeps the shape of every relation in memory and diffs only
+  the relations an event touched (psql-watcher.py --diff)
+
+Requirements:
+pip3 install psycopg2-binary python-dotenv
+
+Usage:
+python3 schema_snapshot.py --db mydb --output schema.sql
+python3 schema_snapshot.py --db mydb --schemas public,app
+python3 schema_snapshot.py --db mydb --store snapshot/ --output schema.sql
+python3 schema_snapshot.py --db mydb --store snapshot/ --event "$PAYLOAD" --output schema.sql
+echo "$PAYLOAD" | python3 schema_snapshot.py --db mydb --store snapshot/ --event - --output schema.sql
+python3 schema_snapshot.py --from-store snapshot/ --output schema.sql
+python3 schema_snapshot.py --from-store snapshot/ --at txid:123456 --output schema.sql
+python3 schema_snapshot.py --from-store snapshot/ --history
+"""
+import os
+import sys
+import json
+import zlib
+import hashlib
+import argparse
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+# pip install python-dotenv psycopg2-binary
+try:
+    import fcntl
+except ImportError:  # Windows: a store then takes one writer at a time
+    fcntl = None
+
+import psycopg2
+import psycopg2.extensions
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    def load_dotenv(*args, **kwargs):
+        pass
+
+load_dotenv('.env')
+
+# One catalog object of a snapshot: 'section' is the schema.sql section it is
+# rendered into, (classid, objid) identify it in the catalogs, 'kind' orders
+# objects inside a section.
+SnapshotObject = namedtuple("SnapshotObject", "section kind classid objid identity ddl")
+
+# schema.sql sections in output order
+SECTIONS = (
+    "SCHEMAS AND TABLES",
+    "USERS AND ROLES",
+    "PRIVILEGES AND PERMISSIONS",
+    "FUNCTIONS AND PROCEDURES",
+    "SEQUENCES",
+    "INDEXES",
+    "TRIGGERS",
+    "VIEWS",
+    "EXTENSIONS",
+    "DATABASE SETTINGS",
+)
+
+# User schemas, optionally restricted to %(schemas)s
+SCHEMA_FILTER = """
+  n.nspname <> 'information_schema' AND n.nspname !~ '^pg_'
+  AND (%(schemas)s::text[] IS NULL OR n.nspname = ANY (%(schemas)s::text[]))
+"""
+
+# Restricts a query to %(objids)s (incremental refresh); NULL means all objects
+OBJID_FILTER = """
+  (%(objids)s::oid[] IS NULL OR {objid} = ANY (%(objids)s::oid[]))
+"""
+
+# Objects created by an extension are recreated by CREATE EXTENSION, skip them
+NOT_EXTENSION_MEMBER = """
+  NOT EXISTS (SELECT 1 FROM pg_depend e
+              WHERE e.classid = {classid}::regclass AND e.objid = {objid} AND e.deptype = 'e')
+"""
+
+# (section, kind, query); every query returns classid, objid, identity, ddl
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+QUERIES = (
+    ("SCHEMAS AND TABLES", "schema", """
+SELECT 'pg_namespace'::regclass::oid, n.oid, quote_ident(n.nspname),
+       'CREATE SCHEMA IF NOT EXISTS ' || quote_ident(n.nspname) || ';'
+FROM pg_namespace n
+WHERE """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="n.oid") + """
+ORDER BY n.nspname
+"""),
+    # Enum, composite and range types; the row types of tables and the array
+    # and multirange types PostgreSQL creates implicitly are not dumped
+    ("SCHEMAS AND TABLES", "type", """
+SELECT 'pg_type'::regclass::oid, t.oid, quote_ident(n.nspname) || '.' || quote_ident(t.typname),
+       'CREATE TYPE ' || quote_ident(n.nspname) || '.' || quote_ident(t.typname)
+       || CASE t.typtype
+            WHEN 'e' THEN ' AS ENUM (' || COALESCE((
+                SELECT string_agg(quote_literal(e.enumlabel), ', ' ORDER BY e.enumsortorder)
+                FROM pg_enum e WHERE e.enumtypid = t.oid), '') || ')'
+            WHEN 'c' THEN E' AS (\n' || COALESCE((
+                SELECT string_agg('    ' || quote_ident(a.attname) || ' ' || format_type(a.atttypid, a.atttypmod),
+                                  E',\n' ORDER BY a.attnum)
+                FROM pg_attribute a
+                WHERE a.attrelid = t.typrelid AND a.attnum > 0 AND NOT a.attisdropped), '') || E'\n)'
+            ELSE ' AS RANGE (SUBTYPE = ' || format_type(r.rngsubtype, NULL)
+                 || CASE WHEN NOT opc.opcdefault
+                         THEN ', SUBTYPE_OPCLASS = ' || quote_ident(opn.nspname) || '.' || quote_ident(opc.opcname)
+                         ELSE '' END
+                 || COALESCE((
+                      SELECT ', COLLATION = ' || quote_ident(cn.nspname) || '.' || quote_ident(co.collname)
+                      FROM pg_collation co JOIN pg_namespace cn ON cn.oid = co.collnamespace
+                      WHERE co.oid = r.rngcollation AND r.rngcollation <> st.typcollation), '')
+                 || CASE WHEN r.rngcanonical <> 0 THEN ', CANONICAL = ' || r.rngcanonical::regproc::text ELSE '' END
+                 || CASE WHEN r.rngsubdiff <> 0 THEN ', SUBTYPE_DIFF = ' || r.rngsubdiff::regproc::text ELSE '' END
+                 || ')'
+          END || ';'
+FROM pg_type t
+JOIN pg_namespace n ON n.oid = t.typnamespace
+LEFT JOIN pg_class tc ON tc.oid = t.typrelid
+LEFT JOIN pg_range r ON r.rngtypid = t.oid
+LEFT JOIN pg_type st ON st.oid = r.rngsubtype
+LEFT JOIN pg_opclass opc ON opc.oid = r.rngsubopc
+LEFT JOIN pg_namespace opn ON opn.oid = opc.opcnamespace
+WHERE (t.typtype IN ('e', 'r') OR (t.typtype = 'c' AND tc.relkind = 'c')) AND """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_type'", objid="t.oid") + """
+  AND """ + OBJID_FILTER.format(objid="t.oid") + """
+ORDER BY n.nspname, t.typname
+"""),
+    # Domains come after the types they may be based on; NOT NULL is typnotnull,
+    # only CHECK constraints are listed
+    ("SCHEMAS AND TABLES", "domain", """
+SELECT 'pg_type'::regclass::oid, t.oid, quote_ident(n.nspname) || '.' || quote_ident(t.typname),
+       'CREATE DOMAIN ' || quote_ident(n.nspname) || '.' || quote_ident(t.typname)
+       || ' AS ' || format_type(t.typbasetype, t.typtypmod)
+       || COALESCE((
+            SELECT ' COLLATE ' || quote_ident(cn.nspname) || '.' || quote_ident(co.collname)
+            FROM pg_collation co JOIN pg_namespace cn ON cn.oid = co.collnamespace
+            WHERE co.oid = t.typcollation AND t.typcollation <> bt.typcollation), '')
+       || CASE WHEN t.typdefault IS NOT NULL THEN ' DEFAULT ' || t.typdefault ELSE '' END
+       || CASE WHEN t.typnotnull THEN ' NOT NULL' ELSE '' END
+       || COALESCE((
+            SELECT string_agg(' CONSTRAINT ' || quote_ident(con.conname) || ' ' || pg_get_constraintdef(con.oid),
+                              '' ORDER BY con.conname)
+            FROM pg_constraint con
+            WHERE con.contypid = t.oid AND con.contype = 'c'), '') || ';'
+FROM pg_type t
+JOIN pg_namespace n ON n.oid = t.typnamespace
+JOIN pg_type bt ON bt.oid = t.typbasetype
+WHERE t.typtype = 'd' AND """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_type'", objid="t.oid") + """
+  AND """ + OBJID_FILTER.format(objid="t.oid") + """
+ORDER BY n.nspname, t.typname
+"""),
+    # Columns a table inherits come from its INHERITS parents and are not repeated
+    ("SCHEMAS AND TABLES", "table", """
+SELECT 'pg_class'::regclass::oid, c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       CASE WHEN c.relispartition THEN
+         'CREATE TABLE ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+         || ' PARTITION OF ' || (SELECT i.inhparent::regclass::text FROM pg_inherits i WHERE i.inhrelid = c.oid)
+         || ' ' || pg_get_expr(c.relpartbound, c.oid)
+       ELSE
+         'CREATE ' || CASE WHEN c.relpersistence = 'u' THEN 'UNLOGGED ' ELSE '' END
+         || 'TABLE ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname) || E' (\n'
+         || COALESCE((
+              SELECT string_agg(
+                       '    ' || quote_ident(a.attname) || ' ' || format_type(a.atttypid, a.atttypmod)
+                       || CASE
+                            WHEN a.attgenerated = 's' THEN ' GENERATED ALWAYS AS (' || pg_get_expr(d.adbin, d.adrelid) || ') STORED'
+                            WHEN a.attidentity = 'a' THEN ' GENERATED ALWAYS AS IDENTITY'
+                            WHEN a.attidentity = 'd' THEN ' GENERATED BY DEFAULT AS IDENTITY'
+                            WHEN d.adbin IS NOT NULL THEN ' DEFAULT ' || pg_get_expr(d.adbin, d.adrelid)
+                            ELSE ''
+                          END
+                       || CASE WHEN a.attnotnull THEN ' NOT NULL' ELSE '' END,
+                       E',\n' ORDER BY a.attnum)
+              FROM pg_attribute a
+              LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+              WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped AND a.attislocal), '')
+         || E'\n)'
+         || COALESCE((
+              SELECT ' INHERITS (' || string_agg(i.inhparent::regclass::text, ', ' ORDER BY i.inhseqno) || ')'
+              FROM pg_inherits i
+              WHERE i.inhrelid = c.oid), '')
+         || CASE WHEN c.relkind = 'p' THEN ' PARTITION BY ' || pg_get_partkeydef(c.oid) ELSE '' END
+       END || ';'
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p') AND """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_class'", objid="c.oid") + """
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+ORDER BY n.nspname, c.relname
+"""),
+    ("SCHEMAS AND TABLES", "constraint", """
+SELECT 'pg_constraint'::regclass::oid, con.oid,
+       quote_ident(n.nspname) || '.' || quote_ident(c.relname) || ' ' || quote_ident(con.conname),
+       'ALTER TABLE ONLY ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+       || ' ADD CONSTRAINT ' || quote_ident(con.conname) || ' ' || pg_get_constraintdef(con.oid) || ';'
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE con.contype IN ('p', 'u', 'c', 'x') AND con.conislocal AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="con.oid") + """
+ORDER BY n.nspname, c.relname, con.conname
+"""),
+    # Foreign keys go last so that the tables they reference already exist
+    ("SCHEMAS AND TABLES", "foreign_key", """
+SELECT 'pg_constraint'::regclass::oid, con.oid,
+       quote_ident(n.nspname) || '.' || quote_ident(c.relname) || ' ' || quote_ident(con.conname),
+       'ALTER TABLE ONLY ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+       || ' ADD CONSTRAINT ' || quote_ident(con.conname) || ' ' || pg_get_constraintdef(con.oid) || ';'
+FROM pg_constraint con
+JOIN pg_class c ON c.oid = con.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE con.contype IN ('f') AND con.conislocal AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="con.oid") + """
+ORDER BY n.nspname, c.relname, con.conname
+"""),
+    ("USERS AND ROLES", "role", """
+SELECT 'pg_authid'::regclass::oid, r.oid, quote_ident(r.rolname),
+       'CREATE ROLE ' || quote_ident(r.rolname) || ';'
+FROM pg_roles r
+WHERE r.rolname NOT IN ('postgres', 'rdsadmin', 'rds_superuser', 'rds_replication', 'rds_iam')
+  AND r.rolname !~ '^pg_'
+  AND """ + OBJID_FILTER.format(objid="r.oid") + """
+ORDER BY r.rolname
+"""),
+    # One entry per object, holding all of its GRANTs
+    ("PRIVILEGES AND PERMISSIONS", "table_acl", """
+SELECT 'pg_class'::regclass::oid, c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       string_agg('GRANT ' || acl.privilege_type || ' ON ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+                  || ' TO ' || CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END
+                  || ';', E'\n' ORDER BY acl.grantee, acl.privilege_type)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+CROSS JOIN LATERAL aclexplode(c.relacl) acl
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f') AND acl.grantor <> acl.grantee AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+GROUP BY c.oid, n.nspname, c.relname
+ORDER BY n.nspname, c.relname
+"""),
+    ("PRIVILEGES AND PERMISSIONS", "schema_acl", """
+SELECT 'pg_namespace'::regclass::oid, n.oid, quote_ident(n.nspname),
+       string_agg('GRANT ' || acl.privilege_type || ' ON SCHEMA ' || quote_ident(n.nspname)
+                  || ' TO ' || CASE WHEN acl.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(acl.grantee)) END
+                  || ';', E'\n' ORDER BY acl.grantee, acl.privilege_type)
+FROM pg_namespace n
+CROSS JOIN LATERAL aclexplode(n.nspacl) acl
+WHERE acl.grantor <> acl.grantee AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="n.oid") + """
+GROUP BY n.oid, n.nspname
+ORDER BY n.nspname
+"""),
+    ("FUNCTIONS AND PROCEDURES", "function", """
+SELECT 'pg_proc'::regclass::oid, p.oid, p.oid::regprocedure::text, pg_get_functiondef(p.oid)
+FROM pg_proc p
+JOIN pg_namespace n ON n.oid = p.pronamespace
+WHERE p.prokind IN ('f', 'p') AND """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_proc'", objid="p.oid") + """
+  AND """ + OBJID_FILTER.format(objid="p.oid") + """
+ORDER BY n.nspname, p.proname, p.oid
+"""),
+    # Identity sequences belong to their column and are not dumped separately
+    ("SEQUENCES", "sequence", """
+SELECT 'pg_class'::regclass::oid, c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       'CREATE SEQUENCE ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+       || ' AS ' || format_type(s.seqtypid, NULL)
+       || ' START WITH ' || s.seqstart || ' INCREMENT BY ' || s.seqincrement
+       || ' MINVALUE ' || s.seqmin || ' MAXVALUE ' || s.seqmax || ' CACHE ' || s.seqcache
+       || CASE WHEN s.seqcycle THEN ' CYCLE' ELSE '' END || ';'
+FROM pg_sequence s
+JOIN pg_class c ON c.oid = s.seqrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_class'", objid="c.oid") + """
+  AND NOT EXISTS (SELECT 1 FROM pg_depend i
+                  WHERE i.classid = 'pg_class'::regclass AND i.objid = c.oid AND i.deptype = 'i')
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+ORDER BY n.nspname, c.relname
+"""),
+    # Indexes backing PRIMARY KEY / UNIQUE / EXCLUDE constraints come with the constraint
+    ("INDEXES", "index", """
+SELECT 'pg_class'::regclass::oid, c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       pg_get_indexdef(c.oid) || ';'
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE """ + SCHEMA_FILTER + """
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                  WHERE con.conindid = i.indexrelid AND con.contype IN ('p', 'u', 'x'))
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+ORDER BY n.nspname, c.relname
+"""),
+    ("TRIGGERS", "trigger", """
+SELECT 'pg_trigger'::regclass::oid, t.oid,
+       quote_ident(t.tgname) || ' ON ' || quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       pg_get_triggerdef(t.oid) || ';'
+FROM pg_trigger t
+JOIN pg_class c ON c.oid = t.tgrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE NOT t.tgisinternal AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="t.oid") + """
+ORDER BY n.nspname, c.relname, t.tgname
+"""),
+    ("VIEWS", "view", """
+SELECT 'pg_class'::regclass::oid, c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       CASE WHEN c.relkind = 'm' THEN 'CREATE MATERIALIZED VIEW ' ELSE 'CREATE VIEW ' END
+       || quote_ident(n.nspname) || '.' || quote_ident(c.relname) || E' AS\n'
+       || rtrim(pg_get_viewdef(c.oid), ';')
+       || CASE WHEN c.relkind = 'm' THEN ' WITH NO DATA' ELSE '' END || ';'
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('v', 'm') AND """ + SCHEMA_FILTER + """
+  AND """ + NOT_EXTENSION_MEMBER.format(classid="'pg_class'", objid="c.oid") + """
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+ORDER BY n.nspname, c.relname
+"""),
+    ("EXTENSIONS", "extension", """
+SELECT 'pg_extension'::regclass::oid, x.oid, quote_ident(x.extname),
+       'CREATE EXTENSION IF NOT EXISTS ' || quote_ident(x.extname) || ';'
+FROM pg_extension x
+WHERE x.extname <> 'plpgsql'
+  AND """ + OBJID_FILTER.format(objid="x.oid") + """
+ORDER BY x.extname
+"""),
+    # All settings form a single entry of the database
+    ("DATABASE SETTINGS", "setting", """
+SELECT 'pg_database'::regclass::oid, d.oid, quote_ident(d.datname),
+       string_agg('ALTER DATABASE ' || quote_ident(d.datname) || ' SET ' || s.name || ' = '
+                  || quote_literal(s.setting) || ';', E'\n' ORDER BY s.name)
+FROM pg_settings s
+JOIN pg_database d ON d.datname = current_database()
+WHERE s.context IN ('user', 'superuser', 'postmaster') AND s.source <> 'default'
+  AND """ + OBJID_FILTER.format(objid="d.oid") + """
+GROUP BY d.oid, d.datname
+"""),
+)
+
+# Rendering order of object kinds inside a section
+KINDS = tuple(kind for _, kind, _ in QUERIES)
+
+def get_conn(dbname: str):
+    conn = psycopg2.connect(
+        dbname=dbname,
+        host=os.getenv("POSTGRES_HOST", "localhost"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+        user=os.getenv("POSTGRES_USER", "postgres"),
+        password=os.getenv("POSTGRES_PASSWORD", "password"),
+        sslmode=os.getenv("POSTGRES_SSLMODE", "disable"),
+    )
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    return conn
+
+# Objects that depend directly on the given ones (columns' constraints, indexes,
+# triggers, owned sequences, views through their rewrite rule, schema members)
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+DEPENDENTS_SQL = """
+SELECT DISTINCT
+       CASE WHEN d.classid = 'pg_rewrite'::regclass THEN 'pg_class'::regclass::oid ELSE d.classid END,
+       CASE WHEN d.classid = 'pg_rewrite'::regclass THEN r.ev_class ELSE d.objid END
+FROM pg_depend d
+LEFT JOIN pg_rewrite r ON d.classid = 'pg_rewrite'::regclass AND r.oid = d.objid
+WHERE (d.refclassid, d.refobjid) IN (SELECT * FROM unnest(%(classids)s::oid[], %(objids)s::oid[]))
+  AND d.deptype IN ('n', 'a', 'i')
+"""
+
+def take_snapshot(conn, schemas: Optional[List[str]] = None,
+                  keys: Optional[Set[Tuple[int, int]]] = None) -> List[SnapshotObject]:
+    """
+    Reads snapshot objects in one REPEATABLE READ, READ ONLY transaction, so
+    all sections describe the same catalog state. With 'keys' (a set of
+    (classid, objid)) only those objects and their direct dependents are
+    read. Works on autocommit connections (as returned by get_conn) and
+    leaves them in autocommit.
+    """
+    params = {"schemas": schemas or None, "objids": None}
+    objects = []
+    with conn.cursor() as cur:
+        cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        try:
+            if keys is not None:
+                if not keys:
+                    return []
+                keys = set(keys) | dependents(cur, keys)
+                params["objids"] = sorted({objid for _, objid in keys})
+            for section, kind, query in QUERIES:
+                cur.execute(query, params)
+                for classid, objid, identity, ddl in cur.fetchall():
+                    if keys is not None and (classid, objid) not in keys:
+                        continue
+                    ddl = ddl.rstrip()
+                    if not ddl.endswith(";"):
+                        ddl += ";"
+                    objects.append(SnapshotObject(section, kind, int(classid), int(objid), identity, ddl))
+        finally:
+            cur.execute("ROLLBACK")
+    return objects
+
+def dependents(cur, keys: Set[Tuple[int, int]]) -> Set[Tuple[int, int]]:
+    classids, objids = zip(*sorted(keys))
+    cur.execute(DEPENDENTS_SQL, {"classids": list(classids), "objids": list(objids)})
+    return {(int(classid), int(objid)) for classid, objid in cur.fetchall()}
+
+def render_snapshot(objects: List[SnapshotObject], dbname: str, host: str) -> str:
+    """Renders snapshot objects in the schema.sql layout of script.sh."""
+    by_section: Dict[str, List[SnapshotObject]] = {section: [] for section in SECTIONS}
+    for obj in objects:
+        by_section[obj.section].append(obj)
+    banner = "-- =============================================="
+    out = [
+        "-- PostgreSQL Schema Backup",
+        f"-- Database: {dbname}",
+        f"-- Host: {host}",
+        "-- Generated by psql-watcher schema_snapshot.py",
+        "",
+        banner,
+        f"-- SCHEMA BACKUP FOR DATABASE: {dbname}",
+        banner,
+    ]
+    for section in SECTIONS:
+        out += ["", banner, f"-- {section}", banner, ""]
+        for obj in sorted(by_section[section], key=lambda o: (KINDS.index(o.kind), o.identity)):
+            out.append(obj.ddl)
+    out += ["", banner, "-- BACKUP COMPLETED", banner, f"-- Database: {dbname}", f"-- Host: {host}", banner, ""]
+    return "\n".join(out)
+
+def write_snapshot(conn, path: str, schemas: Optional[List[str]] = None) -> int:
+    """Takes a snapshot and atomically replaces 'path' with it. Returns the number of objects."""
+    objects = take_snapshot(conn, schemas)
+    _write_file(path, render_snapshot(objects, *describe(conn)))
+    return len(objects)
+
+def describe(conn) -> Tuple[str, str]:
+    """(dbname, host:port) of a connection, for the snapshot header."""
+    params = conn.get_dsn_parameters()
+    return params.get("dbname", ""), f"{params.get('host', '')}:{params.get('port', '')}"
+
+def _write_file(path: str, data: Union[str, bytes]):
+    tmp = f"{path}.tmp"
+    if isinstance(data, bytes):
+        with open(tmp, "wb") as f:
+            f.write(data)
+    else:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+    os.replace(tmp, path)
+
+def parse_time(value) -> Optional[datetime]:
+    """
+    An aware datetime from a payload 'ts' ('YYYY-MM-DDTHH:MI:SS.MS UTC') or an
+    ISO 8601 time (UTC if it has no offset), or None.
+    """
+    stamp = str(value).strip()
+    if stamp.endswith((" UTC", " GMT")):
+        stamp = stamp[:-len(" UTC")] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(stamp)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+def event_stamp(payload: str) -> Tuple[Optional[int], Optional[datetime]]:
+    """(txid, ts) of an event payload, or of the latest event of a batch; (None, None) if it has none."""
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    txids, stamps = [], []
+    for event in data.get("statements", [data]):
+        try:
+            txids.append(int(event["txid"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+        if isinstance(event, dict) and parse_time(event.get("ts")) is not None:
+            stamps.append(parse_time(event["ts"]))
+    return max(txids, default=None), max(stamps, default=None)
+
+# Manifests between two full checkpoints of the object map of an ObjectStore:
+# materializing any version replays at most CHECKPOINT_EVERY - 1 of them
+CHECKPOINT_EVERY = 100
+
+def _key_name(key: Tuple[int, int]) -> str:
+    return f"{key[0]}-{key[1]}"
+
+def _parse_key(name: str) -> Tuple[int, int]:
+    classid, objid = name.split("-")
+    return int(classid), int(objid)
+
+def _merge(objects: Dict[Tuple[int, int], str], manifest: dict):
+    """Applies one manifest to an object map."""
+    objects.update((_parse_key(name), digest) for name, digest in manifest["objects"].items())
+    for name in manifest["removed"]:
+        objects.pop(_parse_key(name), None)
+
+class ObjectStore:
+    """
+    Snapshot history, content-addressed per catalog object (classid, objid).
+    The entries of one object (e.g. a table and its GRANTs) are stored once
+    per distinct content, zlib-compressed and named by their sha256:
+    <path>/blobs/<2 hex>/<62 hex>. A snapshot version is a manifest, one
+    line of <path>/manifests.ndjson, that lists only what changed since the
+    previous version (the new hash of each changed object, the removed
+    keys) and links it to the event that produced it (txid, ts). Every
+    CHECKPOINT_EVERY versions the full object map goes to
+    <path>/checkpoints/<version>.json.z.
+
+    refresh() re-reads only the given objects and their direct dependents
+    and writes only blobs not stored yet plus one manifest line, so storage
+    and write I/O follow the size of a change, not of the database times
+    the number of events. render() materializes schema.sql of the current
+    or of any earlier version without touching the database. A store in
+    the earlier layout (<path>/objects/<classid>-<objid>.json) is imported
+    as its first version.
+
+    Writers in several processes (script.sh runs one per event) take turns
+    on an exclusive flock of <path>/lock, held from reading the catalogs to
+    appending the manifest: each first catches up on the versions the
+    others appended, so none of them writes a version from a stale head.
+    """
+
+    def __init__(self, path: str, schemas: Optional[List[str]] = None):
+        self.path = path
+        self.schemas = schemas
+        self.blobs_dir = os.path.join(path, "blobs")
+        self.checkpoints_dir = os.path.join(path, "checkpoints")
+        self.manifests_path = os.path.join(path, "manifests.ndjson")
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.checkpoints_dir, exist_ok=True)
+        with self._locked():
+            self.head, self.version, self.end = self._replay()
+            self._sync()
+            self._import_legacy(os.path.join(path, "objects"))
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock of the store against writers in other processes; not reentrant."""
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # released when f is closed
+
+    def _sync(self):
+        """Under the lock: applies the versions appended since self.end, drops a torn last manifest."""
+        for manifest, offset in self._manifests(self.end):
+            _merge(self.head, manifest)
+            self.version, self.end = manifest["version"], offset
+        if os.path.exists(self.manifests_path) and os.path.getsize(self.manifests_path) > self.end:
+            # Torn write of the last manifest (its writer died): the next one is appended in its place
+            with open(self.manifests_path, "r+b") as f:
+                f.truncate(self.end)
+
+    def _blob(self, digest: str) -> str:
+        return os.path.join(self.blobs_dir, digest[:2], digest[2:])
+
+    def _put(self, objects: List[SnapshotObject]) -> str:
+        """Stores the entries of one object unless identical ones already are; returns their hash."""
+        data = json.dumps([obj._asdict() for obj in objects], sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_file(path, zlib.compress(data))
+        return digest
+
+    def _get(self, digest: str) -> List[SnapshotObject]:
+        with open(self._blob(digest), "rb") as f:
+            return [SnapshotObject(**obj) for obj in json.loads(zlib.decompress(f.read()).decode("utf-8"))]
+
+    def _manifests(self, offset: int = 0):
+        """(manifest, end offset) of every complete manifest line from 'offset' on."""
+        try:
+            f = open(self.manifests_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    manifest = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    return
+                offset += len(line)
+                yield manifest, offset
+
+    def _checkpoint(self, version: Optional[int]) -> Tuple[Dict[Tuple[int, int], str], int, int]:
+        """(object map, version, manifests offset) of the newest checkpoint at or before 'version'."""
+        versions = sorted(int(name.split(".")[0]) for name in os.listdir(self.checkpoints_dir)
+                          if name.endswith(".json.z"))
+        for found in reversed(versions):
+            if version is None or found <= version:
+                with open(os.path.join(self.checkpoints_dir, f"{found:010d}.json.z"), "rb") as f:
+                    data = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+                return {_parse_key(name): digest for name, digest in data["objects"].items()}, found, data["offset"]
+        return {}, 0, 0
+
+    def _replay(self, version: Optional[int] = None) -> Tuple[Dict[Tuple[int, int], str], int, int]:
+        """(object map, version, manifests offset) at 'version' (None: the latest)."""
+        objects, found, end = self._checkpoint(version)
+        for manifest, offset in self._manifests(end):
+            if version is not None and manifest["version"] > version:
+                break
+            _merge(objects, manifest)
+            found, end = manifest["version"], offset
+        return objects, found, end
+
+    def _import_legacy(self, objects_dir: str):
+        if not os.path.isdir(objects_dir):
+            return
+        names = [name for name in os.listdir(objects_dir) if name.endswith(".json")]
+        objects = []
+        for name in names:
+            with open(os.path.join(objects_dir, name), encoding="utf-8") as f:
+                objects += [SnapshotObject(**obj) for obj in json.load(f)]
+        if names:
+            self._apply(objects, None)
+        for name in names:
+            os.remove(os.path.join(objects_dir, name))
+        try:
+            os.rmdir(objects_dir)
+        except OSError:
+            pass
+        logging.info(f"[SNAPSHOT] Imported {len(names)} object files of {objects_dir} as version {self.version}")
+
+    def _apply(self, objects: List[SnapshotObject], gone: Optional[Set[Tuple[int, int]]],
+               txid: Optional[int] = None, ts: Optional[datetime] = None) -> int:
+        """Under the lock: stores a version of 'objects', removing the keys of 'gone' (None: all) left out."""
+        if gone is None:
+            gone = set(self.head)
+        grouped: Dict[Tuple[int, int], List[SnapshotObject]] = {}
+        for obj in objects:
+            grouped.setdefault((obj.classid, obj.objid), []).append(obj)
+        changed = {}
+        for key, objs in grouped.items():
+            digest = self._put(objs)
+            if self.head.get(key) != digest:
+                changed[key] = digest
+        removed = sorted(key for key in gone - set(grouped) if key in self.head)
+        if not changed and not removed:
+            return 0
+        manifest = {
+            "version": self.version + 1,
+            "txid": txid,
+            "ts": (ts or datetime.now(timezone.utc)).isoformat(),
+            "objects": {_key_name(key): digest for key, digest in sorted(changed.items())},
+            "removed": [_key_name(key) for key in removed],
+        }
+        with open(self.manifests_path, "ab") as f:
+            f.write((json.dumps(manifest, sort_keys=True) + "\n").encode("utf-8"))
+            self.end = f.tell()
+        self.head.update(changed)
+        for key in removed:
+            del self.head[key]
+        self.version += 1
+        if self.version % CHECKPOINT_EVERY == 0:
+            data = {"version": self.version, "offset": self.end,
+                    "objects": {_key_name(key): digest for key, digest in sorted(self.head.items())}}
+            _write_file(os.path.join(self.checkpoints_dir, f"{self.version:010d}.json.z"),
+                        zlib.compress(json.dumps(data).encode("utf-8")))
+        return len(changed) + len(removed)
+
+    def keys(self) -> Set[Tuple[int, int]]:
+        return set(self.head)
+
+    def rebuild(self, conn, txid: Optional[int] = None, ts: Optional[datetime] = None) -> int:
+        """
+        Full pass: syncs the store with the database, a new version if anything
+        changed (linked to txid and ts when given). Returns the number of
+        objects changed.
+        """
+        with self._locked():
+            self._sync()
+            return self._apply(take_snapshot(conn, self.schemas), None, txid, ts)
+
+    def refresh(self, conn, keys: Set[Tuple[int, int]], txid: Optional[int] = None,
+                ts: Optional[datetime] = None) -> int:
+        """
+        Re-reads 'keys' and their direct dependents. Requested objects that no
+        longer exist (dropped) are removed. A change is recorded as a new
+        version linked to the event (txid, ts). Returns the number of objects
+        changed.
+        """
+        with self._locked():
+            self._sync()
+            return self._apply(take_snapshot(conn, self.schemas, keys), set(keys), txid, ts)
+
+    def history(self) -> List[dict]:
+        """Every manifest, oldest first: version, txid, ts, objects (changed: hash) and removed."""
+        return [manifest for manifest, _ in self._manifests()]
+
+    def find(self, txid: Optional[int] = None, ts: Optional[datetime] = None) -> Optional[int]:
+        """
+        Latest version produced by an event with a txid up to 'txid', or taken
+        at or before 'ts'; None if there is none.
+        """
+        found = None
+        for manifest in self.history():
+            if txid is not None and (manifest["txid"] is None or manifest["txid"] > txid):
+                continue
+            if ts is not None and parse_time(manifest["ts"]) > ts:
+                continue
+            found = manifest["version"]
+        return found
+
+    def load(self, version: Optional[int] = None) -> List[SnapshotObject]:
+        """Objects of 'version' (None: the latest)."""
+        if version is None or version == self.version:
+            digests = self.head
+        elif 0 < version < self.version:
+            digests = self._replay(version)[0]
+        else:
+            raise ValueError(f"no snapshot version {version} in {self.path} (latest: {self.version})")
+        objects = []
+        for digest in digests.values():
+            objects += self._get(digest)
+        return objects
+
+    def render(self, path: str, dbname: str, host: str, version: Optional[int] = None) -> int:
+        """Writes schema.sql of a version (None: the latest). Returns the number of objects."""
+        objects = self.load(version)
+        _write_file(path, render_snapshot(objects, dbname, host))
+        return len(objects)
+
+# Shape of every table, view, materialized view and foreign table: columns
+# (with their defaults), constraints and indexes, each a JSON object keyed by
+# name. Constraint and index oids map dropped ones back to their relation.
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+RELATIONS_SQL = """
+SELECT c.oid, quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+       (SELECT json_object_agg(a.attname, json_build_object(
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'not_null', a.attnotnull,
+                   'default', pg_get_expr(d.adbin, d.adrelid),
+                   'identity', NULLIF(a.attidentity, ''),
+                   'generated', NULLIF(a.attgenerated, '')) ORDER BY a.attnum)
+        FROM pg_attribute a
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+       (SELECT json_object_agg(con.conname, json_build_object(
+                   'oid', con.oid, 'definition', pg_get_constraintdef(con.oid)) ORDER BY con.conname)
+        FROM pg_constraint con WHERE con.conrelid = c.oid),
+       (SELECT json_object_agg(ic.relname, json_build_object(
+                   'oid', i.indexrelid, 'definition', pg_get_indexdef(i.indexrelid)) ORDER BY ic.relname)
+        FROM pg_index i JOIN pg_class ic ON ic.oid = i.indexrelid WHERE i.indrelid = c.oid)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f') AND """ + SCHEMA_FILTER + """
+  AND """ + OBJID_FILTER.format(objid="c.oid") + """
+"""
+
+# Relation an event object belongs to: itself for a relation or one of its
+# columns, the indexed table of an index, the table of a constraint or column default
+# noinspection SqlResolve,SqlNoDataSourceInspection,SqlDialectInspection
+RELATION_OF_SQL = """
+SELECT k.classid, k.objid, COALESCE(i.indrelid, con.conrelid, ad.adrelid, c.oid)
+FROM unnest(%(classids)s::oid[], %(objids)s::oid[]) AS k(classid, objid)
+LEFT JOIN pg_index i ON k.classid = 'pg_class'::regclass AND i.indexrelid = k.objid
+LEFT JOIN pg_class c ON k.classid = 'pg_class'::regclass AND c.oid = k.objid
+                    AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+LEFT JOIN pg_constraint con ON k.classid = 'pg_constraint'::regclass AND con.oid = k.objid
+LEFT JOIN pg_attrdef ad ON k.classid = 'pg_attrdef'::regclass AND ad.oid = k.objid
+"""
+
+# Column attributes compared by RelationCache; the default is reported apart
+COLUMN_ATTRIBUTES = ("type", "not_null", "identity", "generated")
+
+def _diff_members(old: dict, new: dict, compare: Callable[[dict], object]) -> dict:
+    """added / dropped / changed members of two {name: {...}} maps."""
+    diff = {}
+    added = {name: new[name] for name in new if name not in old}
+    dropped = {name: old[name] for name in old if name not in new}
+    changed = {name: {"old": old[name], "new": new[name]} for name in new
+               if name in old and compare(old[name]) != compare(new[name])}
+    for section, members in (("added", added), ("dropped", dropped), ("changed", changed)):
+        if members:
+            diff[section] = members
+    return diff
+
+def diff_relation(old: Optional[dict], new: Optional[dict]) -> Optional[dict]:
+    """
+    Structured diff of two shapes of one relation (as kept by RelationCache):
+    {"relation", "status": created|dropped|altered, "columns", "defaults",
+    "constraints", "indexes"}, each section with "added", "dropped" and
+    "changed" ({"old", "new"}) members. None if nothing changed.
+    """
+    if old is None and new is None:
+        return None
+    before, after = old or {}, new or {}
+    sections = {
+        "columns": _diff_members(before.get("columns", {}), after.get("columns", {}),
+                                 lambda c: tuple(c.get(a) for a in COLUMN_ATTRIBUTES)),
+        "defaults": _diff_members(
+            {name: c["default"] for name, c in before.get("columns", {}).items() if c.get("default") is not None},
+            {name: c["default"] for name, c in after.get("columns", {}).items() if c.get("default") is not None},
+            lambda d: d),
+        "constraints": _diff_members(before.get("constraints", {}), after.get("constraints", {}),
+                                     lambda c: c["definition"]),
+        "indexes": _diff_members(before.get("indexes", {}), after.get("indexes", {}),
+                                 lambda i: i["definition"]),
+    }
+    diff = {section: changes for section, changes in sections.items() if changes}
+    if not diff and old is not None and new is not None and old["relation"] == new["relation"]:
+        return None
+    status = "created" if old is None else "dropped" if new is None else "altered"
+    result = {"relation": after.get("relation", before.get("relation")), "status": status}
+    if status == "altered" and old["relation"] != new["relation"]:
+        result["renamed_from"] = old["relation"]
+    result.update(diff)
+    return result
+
+class RelationCache:
+    """
+    In-memory shape (columns, defaults, constraints, indexes) of every
+    relation in the watched schemas, keyed by its pg_class oid. load() reads
+    them all once; refresh() re-reads only the relations an event touched,
+    in a single query, and returns their structured diffs (diff_relation)
+    against the cached shapes, which it then replaces. Dropped indexes and
+    constraints are found again through the oids remembered at the last read.
+    """
+
+    def __init__(self, schemas: Optional[List[str]] = None):
+        self.schemas = schemas
+        self.relations: Dict[int, dict] = {}
+        self.owners: Dict[int, int] = {}
+
+    def _read(self, conn, oids: Optional[List[int]]) -> Dict[int, dict]:
+        with conn.cursor() as cur:
+            cur.execute(RELATIONS_SQL, {"schemas": self.schemas or None, "objids": oids})
+            return {int(oid): {"relation": identity, "columns": columns or {},
+                               "constraints": constraints or {}, "indexes": indexes or {}}
+                    for oid, identity, columns, constraints, indexes in cur.fetchall()}
+
+    def _store(self, oid: int, shape: Optional[dict]):
+        old = self.relations.pop(oid, None)
+        for member in (old or {}).get("constraints", {}).values():
+            self.owners.pop(member["oid"], None)
+        for member in (old or {}).get("indexes", {}).values():
+            self.owners.pop(member["oid"], None)
+        if shape is None:
+            return
+        self.relations[oid] = shape
+        for member in list(shape["constraints"].values()) + list(shape["indexes"].values()):
+            self.owners[member["oid"]] = oid
+
+    def load(self, conn) -> int:
+        """Reads every relation, replacing the cache. Returns the number of relations."""
+        self.relations.clear()
+        self.owners.clear()
+        for oid, shape in self._read(conn, None).items():
+            self._store(oid, shape)
+        return len(self.relations)
+
+    def relations_of(self, conn, keys: Set[Tuple[int, int]]) -> Set[int]:
+        """pg_class oids of the relations the (classid, objid) objects belong to."""
+        oids = set()
+        unknown = set()
+        for classid, objid in keys:
+            if objid in self.relations:
+                oids.add(objid)
+            elif objid in self.owners:
+                oids.add(self.owners[objid])
+            else:
+                unknown.add((classid, objid))
+        if unknown:
+            classids, objids = zip(*sorted(unknown))
+            with conn.cursor() as cur:
+                cur.execute(RELATION_OF_SQL, {"classids": list(classids), "objids": list(objids)})
+                oids |= {int(oid) for _, _, oid in cur.fetchall() if oid is not None}
+        return oids
+
+    def refresh(self, conn, keys: Set[Tuple[int, int]]) -> Dict[int, dict]:
+        """
+        Re-reads the relations of 'keys' (see relations_of) and returns
+        {oid: diff} for those that changed since they were last read.
+        """
+        oids = self.relations_of(conn, keys)
+        if not oids:
+            return {}
+        shapes = self._read(conn, sorted(oids))
+        diffs = {}
+        for oid in sorted(oids):
+            diff = diff_relation(self.relations.get(oid), shapes.get(oid))
+            self._store(oid, shapes.get(oid))
+            if diff is not None:
+                diffs[oid] = diff
+        return diffs
+
+def parse_args():
+    p = argparse.ArgumentParser(description="PostgreSQL schema snapshot from the system catalogs (no pg_dump)")
+    p.add_argument("--db", default=os.getenv("POSTGRES_DB", "default"), help="Database name (default: $POSTGRES_DB)")
+    p.add_argument("--schemas", default="", help="Comma-separated schemas (default: all user schemas)")
+    p.add_argument("--output", default="schema.sql", help="Output file (default: schema.sql)")
+    p.add_argument("--store", metavar="DIR",
+                   help="Sync the per-object snapshot store in DIR with the database, then render --output from it")
+    p.add_argument("--from-store", metavar="DIR",
+                   help="Render --output from the per-object store in DIR without connecting to the database")
+    p.add_argument("--event", metavar="JSON",
+                   help="Event payload the --store version is linked to (its txid and ts); '-' reads it from stdin")
+    p.add_argument("--at", metavar="VERSION",
+                   help="With --from-store, render an earlier version: its number, 'txid:N' (latest version "
+                        "of an event up to txid N) or an ISO 8601 time (latest version at or before it)")
+    p.add_argument("--history", action="store_true",
+                   help="With --from-store, list the versions (number, ts, txid, changes) instead of rendering")
+    return p.parse_args()
+
+def resolve_version(store: ObjectStore, at: str) -> int:
+    """Version number of an --at value; ValueError if no version matches."""
+    if at.isdigit():
+        return int(at)
+    if at.startswith("txid:"):
+        version = store.find(txid=int(at[len("txid:"):]))
+    else:
+        ts = parse_time(at)
+        if ts is None:
+            raise ValueError(f"--at {at}: expected a version, txid:N or an ISO 8601 time")
+        version = store.find(ts=ts)
+    if version is None:
+        raise ValueError(f"no snapshot version in {store.path} matches --at {at}")
+    return version
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s]: %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    args = parse_args()
+    schemas = [s.strip() for s in args.schemas.split(",") if s.strip()]
+    if args.from_store:
+        store = ObjectStore(args.from_store)
+        if args.history:
+            for manifest in store.history():
+                print(f"{manifest['version']}\t{manifest['ts']}\ttxid={manifest['txid'] or '-'}\t"
+                      f"{len(manifest['objects'])} changed, {len(manifest['removed'])} removed")
+            return
+        try:
+            version = resolve_version(store, args.at) if args.at else None
+            count = store.render(args.output, args.db, "store", version)
+        except ValueError as e:
+            logging.error(f"[SNAPSHOT] {e}")
+            sys.exit(1)
+        logging.info(f"[SNAPSHOT] Rendered {count} objects of version {version or store.version} "
+                     f"from {args.from_store} to {args.output}")
+        return
+    try:
+        conn = get_conn(args.db)
+        try:
+            if args.store:
+                store = ObjectStore(args.store, schemas)
+                event = sys.stdin.read() if args.event == "-" else args.event
+                txid, ts = event_stamp(event) if event else (None, None)
+                changed = store.rebuild(conn, txid, ts)
+                logging.info(f"[SNAPSHOT] Store {args.store}: {changed} objects changed, version {store.version}")
+                count = store.render(args.output, *describe(conn))
+            else:
+                count = write_snapshot(conn, args.output, schemas)
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        logging.error(f"[SNAPSHOT] {e}")
+        sys.exit(2)
+    logging.info(f"[SNAPSHOT] Wrote {count} objects to {args.output}")
+
+if __name__ == "__main__":
+    main()
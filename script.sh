@@ -17,6 +17,19 @@ PG_DB=${POSTGRES_DB:-default}
 
 # Output file
 OUTPUT_FILE="schema.sql"
+# Snapshot history: every run stores only the objects that changed, as a
+# version linked to the event payload the watcher passes. Off by default:
+# each run re-reads the whole schema to find them, so use the watcher's
+# --snapshot-dir for a history that re-reads only an event's objects
+SNAPSHOT_STORE=${SNAPSHOT_STORE-}
+
+# The watcher writes the event payload to stdin; when run by hand it may be
+# given as the first argument instead
+if [ ! -t 0 ]; then
+    PAYLOAD=$(cat)
+else
+    PAYLOAD=${1:-}
+fi
 
 echo "[BACKUP] Starting PostgreSQL schema backup..."
 echo "[BACKUP] Database: $PG_DB"
@@ -24,257 +37,31 @@ echo "[BACKUP] Host: $PG_HOST:$PG_PORT"
 echo "[BACKUP] User: $PG_USER"
 echo "[BACKUP] Output: $OUTPUT_FILE"
 
-# Set PGPASSWORD for non-interactive authentication
-export PGPASSWORD="$PG_PASSWORD"
-
 # Function to log with timestamp
 log() {
     echo "[$(date '+%Y-%m-%d %H:%M:%S')] $1"
 }
 
-# Start backup file with header
-cat > "$OUTPUT_FILE" << EOF
--- PostgreSQL Schema Backup
--- Database: $PG_DB
--- Host: $PG_HOST:$PG_PORT
--- Generated by psql-watcher script.sh
-
--- ==============================================
--- SCHEMA BACKUP FOR DATABASE: $PG_DB
--- ==============================================
-
-EOF
-
-log "Backing up database schema..."
-
-# Check if PostgreSQL clients are available
-if ! command -v pg_dump &> /dev/null; then
-    log "ERROR: pg_dump not found. Please install PostgreSQL client tools."
-    log "Run: sudo apt install postgresql-client"
+# Check if the snapshot engine is available
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+if ! python3 -c "import psycopg2" &> /dev/null; then
+    log "ERROR: psycopg2 not found. Please install the Python requirements."
+    log "Run: pip install -r requirements.txt"
     exit 1
 fi
 
-# 1. Database and schema creation
-log "1. Backing up database and schema structure..."
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain >> "$OUTPUT_FILE"
-
-# 2. Users and roles
-log "2. Backing up users and roles..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- USERS AND ROLES
--- ==============================================
-
-EOF
-
-# Get all roles
-psql -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" -t -c "
-SELECT 'CREATE ROLE ' || rolname || ';'
-FROM pg_roles 
-WHERE rolname NOT IN ('postgres', 'rdsadmin', 'rds_superuser', 'rds_replication', 'rds_iam')
-ORDER BY rolname;
-" >> "$OUTPUT_FILE"
-
-# 3. Privileges and permissions
-log "3. Backing up privileges and permissions..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- PRIVILEGES AND PERMISSIONS
--- ==============================================
-
-EOF
-
-# Get table privileges
-psql -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" -t -c "
-SELECT 'GRANT ' || privilege_type || ' ON ' || table_name || ' TO ' || grantee || ';'
-FROM information_schema.table_privileges 
-WHERE grantor != grantee
-ORDER BY table_name, grantee, privilege_type;
-" >> "$OUTPUT_FILE"
-
-# Get schema privileges
-psql -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" -t -c "
-SELECT 'GRANT ' || privilege_type || ' ON SCHEMA ' || object_schema || ' TO ' || grantee || ';'
-FROM information_schema.usage_privileges 
-WHERE object_type = 'SCHEMA' AND grantor != grantee
-ORDER BY object_schema, grantee, privilege_type;
-" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 4. Functions and procedures
-log "4. Backing up functions and procedures..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- FUNCTIONS AND PROCEDURES
--- ==============================================
-
-EOF
-
-# Get all functions and procedures
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain \
-    --section=pre-data \
-    --section=post-data | grep -E "(CREATE|ALTER).*(FUNCTION|PROCEDURE)" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 5. Sequences
-log "5. Backing up sequences..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- SEQUENCES
--- ==============================================
-
-EOF
-
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain \
-    --section=pre-data | grep -E "CREATE SEQUENCE" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 6. Indexes
-log "6. Backing up indexes..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- INDEXES
--- ==============================================
-
-EOF
-
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain \
-    --section=pre-data | grep -E "CREATE.*INDEX" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 7. Triggers
-log "7. Backing up triggers..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- TRIGGERS
--- ==============================================
-
-EOF
-
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain \
-    --section=pre-data | grep -E "CREATE.*TRIGGER" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 8. Views
-log "8. Backing up views..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- VIEWS
--- ==============================================
-
-EOF
-
-pg_dump -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" \
-    --schema-only \
-    --no-owner \
-    --no-privileges \
-    --no-tablespaces \
-    --no-comments \
-    --no-security-labels \
-    --no-subscriptions \
-    --no-publications \
-    --no-sync \
-    --format=plain \
-    --section=pre-data | grep -E "CREATE.*VIEW" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 9. Extensions
-log "9. Backing up extensions..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- EXTENSIONS
--- ==============================================
-
-EOF
-
-psql -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" -t -c "
-SELECT 'CREATE EXTENSION IF NOT EXISTS ' || extname || ';'
-FROM pg_extension 
-WHERE extname != 'plpgsql'
-ORDER BY extname;
-" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# 10. Database settings and configuration
-log "10. Backing up database settings..."
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- DATABASE SETTINGS
--- ==============================================
-
-EOF
-
-psql -h "$PG_HOST" -p "$PG_PORT" -U "$PG_USER" -d "$PG_DB" -t -c "
-SELECT 'ALTER DATABASE ' || current_database() || ' SET ' || name || ' = ' || setting || ';'
-FROM pg_settings 
-WHERE context IN ('user', 'superuser', 'postmaster')
-AND source != 'default'
-ORDER BY name;
-" >> "$OUTPUT_FILE" 2>/dev/null || true
-
-# Add footer
-cat >> "$OUTPUT_FILE" << EOF
-
--- ==============================================
--- BACKUP COMPLETED
--- ==============================================
--- Database: $PG_DB
--- Host: $PG_HOST:$PG_PORT
--- ==============================================
-
-EOF
+# All sections (schema, types, domains, tables, roles, privileges, functions,
+# sequences, indexes, triggers, views, extensions, settings) are read from the
+# catalogs over a single connection instead of six pg_dump passes and several
+# psql sessions
+log "Backing up database schema..."
+STORE_ARGS=()
+if [ -n "$SNAPSHOT_STORE" ]; then
+    STORE_ARGS=(--store "$SNAPSHOT_STORE" --event -)
+fi
+POSTGRES_HOST="$PG_HOST" POSTGRES_PORT="$PG_PORT" POSTGRES_USER="$PG_USER" POSTGRES_PASSWORD="$PG_PASSWORD" \
+    python3 "$SCRIPT_DIR/schema_snapshot.py" --db "$PG_DB" --output "$OUTPUT_FILE" ${STORE_ARGS[@]+"${STORE_ARGS[@]}"} \
+    <<< "$PAYLOAD"
 
 # Get file size
 FILE_SIZE=$(du -h "$OUTPUT_FILE" | cut -f1)
@@ -295,7 +82,4 @@ echo "File size: $FILE_SIZE"
 echo "Status: Ready"
 echo "=============================================="
 
-# Clean up environment variable
-unset PGPASSWORD
-
 exit 0